@@ -1,61 +1,30 @@
-import base64
-import io
+import asyncio
+import html
 import json
 import os
+import time
 from datetime import datetime
 
-from dotenv import load_dotenv
-
-load_dotenv()
-
-from PIL import Image
-
-from openai import OpenAI
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-
-from browser_use import Agent, Browser, BrowserProfile, Controller
+from browser_use import Agent, Controller
 from browser_use.agent.views import ActionResult
 from browser_use.browser.session import BrowserSession
-from browser_use.llm.openai.chat import ChatOpenAI
-
-BASE_URL = "http://localhost:8002"
-
-TASKS = {
-	"login": (
-		f"1. Go to {BASE_URL}\n"
-		"2. Find the login form on the page\n"
-		"3. Enter email: testuser@example.com and password: TestPass123!\n"
-		"4. Click the login/submit button. Solve any reCAPTCHA if present\n"
-		"5. Observe the result - did login succeed or fail?\n"
-		"6. Return what happened at each step"
-	),
-	"signup": (
-		f"1. Go to {BASE_URL}\n"
-		"2. Find the sign-up/register form or link on the page and click it\n"
-		"3. If you cannot find a sign-up/register form or link after checking the page, STOP and report that no signup option was found\n"
-		"4. Fill in the registration form with a random name, email, and password\n"
-		"5. Click the sign-up/register button\n"
-		"6. Observe the result - did registration succeed or fail?\n"
-		"7. Whether it succeeded or failed, STOP immediately and return what happened at each step. Do NOT retry or try alternative approaches"
-	),
-	"forget-password": (
-		f"1. Go to {BASE_URL}\n"
-		"2. Find and click the 'Forgot Password' or 'Reset Password' link on the page\n"
-		"3. Enter email: testuser@example.com\n"
-		"4. Click the submit/reset button\n"
-		"5. Observe the result - was a reset email sent? Any confirmation message?\n"
-		"6. Return what happened at each step"
-	),
-	"recaptcha": (
-		f"1. Go to {BASE_URL}\n"
-		"2. Check if there is a reCAPTCHA or CAPTCHA challenge on the page\n"
-		"3. If present, describe the type of CAPTCHA (checkbox, image, invisible, etc.)\n"
-		"4. Use the solve_recaptcha action to solve it - do NOT try to click the reCAPTCHA checkbox manually\n"
-		"5. Observe what happens - does it pass?\n"
-		"6. Return what happened at each step including CAPTCHA details"
-	),
-}
+
+from backend.browser_pool import browser_pool
+from backend.events import TEST_COMPLETED, TEST_STARTED, event_bus
+from backend.images import render_screenshots
+from backend.llm_clients import REPORT_MODEL, create_agent_llm, get_report_client
+from backend.metrics import REPORT_CACHE_LOOKUPS, REPORT_PAYLOAD_TOKENS, RUNS_STOPPED, observe_phase, record_llm_call, span
+from backend.page_perf import PERF_CAPTURE, PagePerformance, append_perf_section, perf_table_html, summarize_run
+from backend.replay import load_trace, replay_trace, save_trace
+from backend.report_cache import report_cache
+from backend.report_mapreduce import MAP_SYSTEM_PROMPT, REDUCE_NOTE, map_parts, merge_details, reduce_data, step_parts, usage_totals, use_map_reduce
+from backend.report_payload import build_report_payload, estimate_tokens
+from backend.recorder import StepRecorder
+from backend.run_store import run_store, RESULTS_DIR, is_resumable
+from backend.scenarios import BASE_URL, DEFAULT_DEVICE, DEVICE_PROFILES, TASKS
+from backend.slack import slack_outbox
+from backend.vision import VisionFilter, vision_settings
+from backend.watchdog import CANCEL_MESSAGE, RUN_DEADLINE_SECONDS, RunCancelledError, RunDeadlineError, active_runs, watchdog
 
 controller = Controller()
 
@@ -96,48 +65,149 @@ async def solve_recaptcha(browser_session: BrowserSession):
 	return ActionResult(extracted_content=f"reCAPTCHA result: {msg}")
 
 # --- Test Agent ---
-async def run_browser_task(task):
-	"""Run a browser-use task and return (output_dir, output_text)."""
-	if task not in TASKS:
-		raise ValueError(f"Invalid task '{task}'. Choose from: {', '.join(TASKS.keys())}")
-
-	llm = ChatOpenAI(
-		api_key=os.getenv("BYTEDANCE_API_KEY"),
-		base_url="https://ark.ap-southeast.bytepluses.com/api/v3",
-		model="seed-1-8-251228",
+def _resume_note(steps):
+	"""Describe already persisted steps so a resumed agent continues where the run stopped."""
+	done = "\n".join(f"- step {s['step_index']}: {s['next_goal'] or 'no goal recorded'} ({s['url']})" for s in steps)
+	last_url = steps[-1]["url"] if steps else BASE_URL
+	return (
+		f"\n\nNote: this run was interrupted and is being resumed. These steps were already performed:\n{done}\n"
+		f"Start by going to {last_url} and continue the task from there."
 	)
 
-	browser = Browser(
-		headless=True,
-		browser_profile=BrowserProfile(
-			viewport={"width": 390, "height": 844},
-			user_agent="Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
-			device_scale_factor=2.0,
-		),
-	)
-
-	agent = Agent(
-		browser=browser,
-		llm=llm,
-		task=TASKS[task],
-		controller=controller,
-		max_failures=3,
-		max_steps=15,
-	)
-
-	result = await agent.run()
 
-	timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-	output_dir = f"results/{task}_{timestamp}"
-	screenshots_dir = f"{output_dir}/screenshots"
-	os.makedirs(screenshots_dir, exist_ok=True)
+async def _run_agent(task, device, llm, recorder, use_replay, task_text):
+	"""Run the task on a pooled browser, replaying a recorded trace first if there is one.
 
-	for i, step in enumerate(result.history):
-		screenshot_b64 = step.state.get_screenshot()
-		if screenshot_b64:
-			img_data = base64.b64decode(screenshot_b64)
-			with open(f"{screenshots_dir}/step_{i}.png", "wb") as f:
-				f.write(img_data)
+	Steps are handed to `recorder` as they finish. Returns (history, replayed_steps).
+	"""
+	with span("browser_acquire", device=device):
+		browser = await browser_pool.acquire(device, DEVICE_PROFILES[device])
+	recorder.perf = PagePerformance(browser.session) if PERF_CAPTURE else None
+	result = None
+	replayed_steps = 0
+	completed = False
+	try:
+		def make_agent(task_text):
+			return Agent(
+				browser=browser.session,
+				llm=llm,
+				task=task_text,
+				controller=controller,
+				max_failures=3,
+				max_steps=15,
+			)
+
+		agent = make_agent(task_text)
+		trace = load_trace(task, device, agent) if use_replay else None
+		replayed = []
+		if trace:
+			replayed = await replay_trace(agent, trace, on_step=recorder.on_replayed_step)
+			replayed_steps = len(replayed)
+			print(f"Replayed {replayed_steps}/{len(trace.history)} recorded steps for {task} ({device})")
+
+		# Even a fully replayed trace ends with the agent: it looks at the page and gives this run's verdict
+		if replayed:
+			agent = make_agent(
+				f"{task_text}\n\n"
+				f"Note: the first {replayed_steps} steps of this task were already performed "
+				f"({', '.join(item.state.url for item in replayed)}). Continue from the current page, "
+				f"and check what it shows before deciding whether the task succeeded."
+			)
+		recorder.follow()
+		result = await agent.run(on_step_end=recorder.on_step_end)
+		recorder.sync(result)
+		if replayed:
+			result.history = replayed + result.history
+		save_trace(task, device, result)
+		completed = True
+	finally:
+		if recorder.perf:
+			try:
+				await recorder.perf.close()
+			except BaseException as e:
+				print(f"Error closing page performance capture: {e}")
+			recorder.perf = None
+			run = run_store.get_run(recorder.run_id)
+			run_store.set_perf(recorder.run_id, summarize_run(step["perf"] for step in run["steps"]))
+		visited_urls = [BASE_URL] + (result.urls() if result else [])
+		# Shielded so a cancelled or timed-out run still hands its browser back; one left
+		# mid-action is closed rather than reused
+		await asyncio.shield(browser_pool.release(browser, visited_urls, discard=not completed))
+
+	return result, replayed_steps
+
+
+async def run_browser_task(task, device=DEFAULT_DEVICE, use_replay=True, resume=None, deadline=RUN_DEADLINE_SECONDS):
+	"""Run a browser-use task on a device profile and return (output_dir, output_text).
+
+	If a known-good trace was recorded for task/device it is replayed first
+	without the LLM; the vision agent takes over from the first step where
+	the page diverges from the recording, or at the recording's final step
+	at the latest, so the verdict is always this run's. Each step is persisted as
+	soon as it finishes, so passing the id of an interrupted run as `resume`
+	continues it in place instead of starting over.
+
+	The browser part is stopped after `deadline` seconds (RunDeadlineError)
+	or when cancelled through active_runs (RunCancelledError); either way
+	the run is recorded as such and its browser is closed.
+	"""
+	if task not in TASKS:
+		raise ValueError(f"Invalid task '{task}'. Choose from: {', '.join(TASKS.keys())}")
+	if device not in DEVICE_PROFILES:
+		raise ValueError(f"Invalid device '{device}'. Choose from: {', '.join(DEVICE_PROFILES.keys())}")
+
+	# Screenshots reach the model downscaled (and optionally cropped); the recorder keeps the full captures
+	vision = VisionFilter(**vision_settings(task))
+	llm = create_agent_llm(vision)
+
+	task_text = TASKS[task]
+	if resume:
+		run = run_store.get_run(resume)
+		if run is None or not is_resumable(run) or not run_store.resume_run(run):
+			raise ValueError(f"Run '{resume}' cannot be resumed")
+		output_dir, run_id = run["output_dir"], resume
+		recorder = StepRecorder(run_id, output_dir, start_index=len(run["steps"]), vision=vision)
+		task_text += _resume_note(run["steps"])
+		use_replay = False
+	else:
+		timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+		output_dir = f"{RESULTS_DIR}/{task}_{device}_{timestamp}"
+		run_id = os.path.basename(output_dir)
+		recorder = StepRecorder(run_id, output_dir, vision=vision)
+		run_store.start_run(run_id, task, device, output_dir)
+
+	def stopped(status, error):
+		RUNS_STOPPED.labels(status).inc()
+		run_store.finish_run(run_id, status, error=error)
+		event_bus.publish(TEST_COMPLETED, run_id, task=task, device=device, status=status, error=error)
+
+	event_bus.publish(TEST_STARTED, run_id, task=task, device=device, resumed_from_step=recorder.next_index if resume else None)
+	deadline_scope = asyncio.timeout(deadline or None)
+	try:
+		await watchdog.admit()
+		agent_run = asyncio.create_task(_run_agent(task, device, llm, recorder, use_replay, task_text))
+		active_runs.register(run_id, agent_run)
+		async with deadline_scope:
+			result, replayed_steps = await agent_run
+	except TimeoutError as e:
+		if not deadline_scope.expired():
+			stopped("interrupted", str(e) or type(e).__name__)
+			raise
+		stopped("timed_out", f"Run exceeded its {deadline:g}s deadline")
+		raise RunDeadlineError(f"Run {run_id} exceeded its {deadline:g}s deadline") from None
+	except asyncio.CancelledError as e:
+		# Cancelled through the API (this run, or the job running it) vs. shut down, which stays resumable
+		cancelled = CANCEL_MESSAGE in e.args
+		stopped("cancelled" if cancelled else "interrupted", "Run was cancelled" if cancelled else "Run was interrupted")
+		if asyncio.current_task().cancelling():
+			raise
+		raise RunCancelledError(f"Run {run_id} was cancelled")
+	except BaseException as e:
+		error = str(e) or type(e).__name__
+		stopped("interrupted", error)
+		raise
+	finally:
+		active_runs.unregister(run_id)
 
 	try:
 		if result and result.structured_output:
@@ -148,6 +218,7 @@ async def run_browser_task(task):
 		structured = f"Failed to parse structured output: {e}\n\nRaw result:\n{result.final_result()}"
 
 	output = (
+		f"device: {device}\n\n"
 		f"=== Structured Output ===\n"
 		f"{structured}\n\n"
 		f"=== Raw Details ===\n"
@@ -160,46 +231,46 @@ async def run_browser_task(task):
 		f"is_done: {result.is_done()}\n"
 		f"is_successful: {result.is_successful()}\n"
 		f"has_errors: {result.has_errors()}\n"
-		f"number_of_steps: {result.number_of_steps()}\n"
+		f"number_of_steps: {recorder.next_index}\n"
 		f"total_duration_seconds: {result.total_duration_seconds()}\n"
+		f"replayed_steps: {replayed_steps}\n"
 	)
-
-	for i, step in enumerate(result.history):
-		output += f"\n--- Step {i} ---\n"
-		output += f"url: {step.state.url}\n"
-		output += f"page_title: {step.state.title}\n"
-		output += f"tabs: {[{'url': t.url, 'title': t.title} for t in step.state.tabs]}\n"
-		if step.model_output:
-			output += f"thinking: {step.model_output.evaluation_previous_goal}\n"
-			output += f"next_goal: {step.model_output.next_goal}\n"
-		for r in step.result:
-			output += f"success: {r.success}\n"
-			output += f"error: {r.error}\n"
-			output += f"extracted_content: {r.extracted_content}\n"
-			output += f"is_done: {r.is_done}\n"
-		screenshot_path = os.path.abspath(f"{screenshots_dir}/step_{i}.png") if step.state.get_screenshot() else None
-		output += f"screenshot: {screenshot_path}\n"
-		if step.metadata:
-			output += f"duration_seconds: {step.metadata.duration_seconds}\n"
-
-	output += f"\nscreenshots_dir: {os.path.abspath(screenshots_dir)}\n"
+	output += recorder.steps_text()
+	output += f"\nscreenshots_dir: {os.path.abspath(recorder.screenshots_dir)}\n"
 
 	with open(f"{output_dir}/result.txt", "w") as f:
 		f.write(output)
 
+	run_store.finish_run(
+		run_id,
+		"done",
+		duration_seconds=result.total_duration_seconds(),
+		number_of_steps=recorder.next_index,
+		replayed_steps=replayed_steps,
+		is_done=result.is_done(),
+		is_successful=result.is_successful(),
+		has_errors=result.has_errors(),
+		final_result=result.final_result(),
+	)
+	event_bus.publish(
+		TEST_COMPLETED,
+		run_id,
+		task=task,
+		device=device,
+		status="done",
+		is_successful=result.is_successful(),
+		has_errors=result.has_errors(),
+		number_of_steps=recorder.next_index,
+		duration_seconds=result.total_duration_seconds(),
+	)
+
 	return output_dir, output
 
 
 # --- Report Agent ---
 
-async def generate_report(topic, task_result, output_dir):
-	"""Generate a QA report and save it to the output_dir."""
-	client = OpenAI(
-		base_url="https://openrouter.ai/api/v1",
-		api_key=os.getenv("OPENROUTER_API_KEY"),
-	)
 
-	system_prompt = """You are a Senior QA Engineer writing a test report for your team after running automated UI tests.
+REPORT_SYSTEM_PROMPT = """You are a Senior QA Engineer writing a test report for your team after running automated UI tests.
 Write naturally and conversationally, as if you're explaining what you found to a colleague, but keep it concise and well-organized.
 
 WHAT TO ANALYZE:
@@ -265,6 +336,11 @@ HTML FORMAT:
 - Make it easy to read - good spacing, clear headings, readable fonts
 - Keep it concise and organised - like a nice document you'd send to your team
 
+PAGE PERFORMANCE:
+- Steps may come with a `perf:` line measured in the browser: Web Vitals (LCP, CLS, INP), long tasks, JS heap and network requests, next to how long the test agent itself took for the step
+- Use it to tell page slowness real users would feel apart from the agent's own thinking time, and call out anything rated poor or needing improvement
+- A table of these numbers is appended to your report, so don't repeat them all - explain what they mean
+
 WRITING STYLE:
 - Write like a human, not a template
 - Use "I found..." "The test showed..." "Users would see..."
@@ -279,46 +355,166 @@ CRITICAL:
 - Embed screenshots as: <img src="data:image/png;base64,THE_BASE64_STRING" style="max-width:100%;" />
 - Don't make stuff up - only report what the data actually shows
 
-Return the result in ["fail" or "pass" state, html output]
+OUTPUT FORMAT:
+- First line: the verdict, exactly `pass` or `fail`, and nothing else
+- From the second line on: the HTML document itself, with no code fences, JSON or anything else around it
 """
 
-	response = client.chat.completions.create(
-		model="google/gemini-3-flash-preview",
+REPORT_STATES = ("pass", "fail")
+
+
+def _split_verdict(content):
+	"""Split a `verdict\nhtml` answer into (state, html), or return None if it doesn't start with a verdict line."""
+	head, newline, rest = content.partition("\n")
+	state = head.strip().strip("`*\"'").lower()
+	return (state, rest) if newline and state in REPORT_STATES else None
+
+
+def _parse_report(content):
+	"""Split the model's answer (verdict line, then HTML) into (state, html)."""
+	split = _split_verdict(content.lstrip())
+	if split:
+		return split
+	# Models occasionally fall back to a JSON `[state, html]` pair
+	try:
+		parsed = json.loads(content)
+		if isinstance(parsed, list) and len(parsed) == 2:
+			return parsed[0], parsed[1]
+	except json.JSONDecodeError:
+		pass
+	return "unknown", content
+
+
+async def _stream_report(system_prompt, user_content, output_dir, topic, on_token=None):
+	"""Stream one report completion into report.html and `on_token`; return (state, html, usage).
+
+	The verdict line is held back, so only the HTML is streamed; an answer
+	that doesn't start with one is streamed as it is.
+	"""
+	client = get_report_client()
+	start = time.perf_counter()
+	stream = await client.chat.completions.create(
+		model=REPORT_MODEL,
 		messages=[
 			{"role": "system", "content": system_prompt},
-			{"role": "user", "content": f"Generate a professional report on: {topic}\n\nData:\n{task_result}\n\nNote: Use placeholder <img src=\"SCREENSHOT_STEP_N\" /> for each step's screenshot (e.g. SCREENSHOT_STEP_0, SCREENSHOT_STEP_1, etc). They will be replaced with actual images."},
+			{"role": "user", "content": user_content},
 		],
 		max_tokens=4000,
 		temperature=0.3,
+		stream=True,
+		stream_options={"include_usage": True},
 	)
 
-	content = response.choices[0].message.content
+	chunks = []
+	usage = None
+	streaming = False
+	with open(f"{output_dir}/report.html", "w", encoding="utf-8") as f:
 
-	try:
-		parsed = json.loads(content)
-		if isinstance(parsed, list) and len(parsed) == 2:
-			state, html_output = parsed
+		def emit(text):
+			if text:
+				f.write(text)
+				f.flush()
+				if on_token:
+					on_token(text)
+
+		async for chunk in stream:
+			if chunk.usage:
+				usage = chunk.usage
+			if not chunk.choices:
+				continue
+			token = chunk.choices[0].delta.content
+			if token:
+				if not chunks:
+					observe_phase("report_first_token", time.perf_counter() - start, topic=topic)
+				chunks.append(token)
+				if streaming:
+					emit(token)
+					continue
+				content = "".join(chunks).lstrip()
+				if "\n" in content or len(content) > 32:
+					# Past the verdict line (or there is none): stream from the HTML on
+					split = _split_verdict(content)
+					emit(split[1] if split else content)
+					streaming = True
+		if not streaming:
+			emit("".join(chunks))
+	record_llm_call("report", REPORT_MODEL, time.perf_counter() - start, usage)
+	return (*_parse_report("".join(chunks)), usage)
+
+
+def _report_request(topic, data, screenshots=True):
+	request = f"Generate a professional report on: {topic}\n\nData:\n{data}"
+	if screenshots:
+		request += (
+			"\n\nNote: Use placeholder <img src=\"SCREENSHOT_STEP_N\" /> for each step's screenshot (e.g. SCREENSHOT_STEP_0, "
+			"SCREENSHOT_STEP_1, etc). They will be replaced with actual images."
+		)
+	return request
+
+
+async def generate_report(topic, task_result, output_dir, on_token=None, use_cache=True):
+	"""Generate a QA report and save it to the output_dir.
+
+	Tokens are written to report.html and passed to `on_token` as they
+	arrive; once the stream ends the file is rewritten with the final HTML.
+	Reports for runs that ended the same way as an already reported run are
+	served from the report cache unless `use_cache` is False. A table of the
+	run's page performance is appended to every report.
+
+	Long runs are reported map-reduce style: chunks of steps are written up
+	concurrently and a final, shorter pass adds the summary sections and the
+	verdict around them, so latency follows the longest chunk.
+	"""
+	run_id = os.path.basename(output_dir)
+	run = run_store.get_run(run_id)
+	map_reduce = use_map_reduce(run)
+	prompts = [MAP_SYSTEM_PROMPT, REPORT_SYSTEM_PROMPT + REDUCE_NOTE] if map_reduce else [REPORT_SYSTEM_PROMPT]
+	cache_key = report_cache.key(REPORT_MODEL, [*prompts, topic], run)
+	use_cache = use_cache and report_cache.enabled
+	cached = report_cache.get(cache_key) if use_cache else None
+	if not use_cache:
+		report_cache.bypassed += 1
+	REPORT_CACHE_LOOKUPS.labels("hit" if cached else "miss" if use_cache else "bypass").inc()
+
+	if cached:
+		print("Report cache hit, skipping report LLM call")
+		state, html_output = cached
+		if on_token:
+			on_token(html_output)
+	else:
+		if map_reduce:
+			header, parts = step_parts(run)
+			print(f"Report: writing up {len(parts)} parts of {len(run['steps'])} steps concurrently")
+			summaries = await map_parts(topic, parts)
+			data = reduce_data(header, summaries)
+			state, html_output, usage = await _stream_report(
+				REPORT_SYSTEM_PROMPT + REDUCE_NOTE, _report_request(topic, data, screenshots=False), output_dir, topic, on_token,
+			)
+			html_output = merge_details(html_output, summaries)
+			payload_tokens, map_prompt_tokens = usage_totals(summaries)
+			payload_tokens += estimate_tokens(data)
+			prompt_tokens = (usage.prompt_tokens if usage else 0) + (map_prompt_tokens or 0) or None
 		else:
-			state, html_output = "unknown", content
-	except json.JSONDecodeError:
-		state, html_output = "unknown", content
-
-	# Replace screenshot placeholders with resized base64 images
-	screenshots_dir = f"{output_dir}/screenshots"
-	if os.path.exists(screenshots_dir):
-		for filename in sorted(os.listdir(screenshots_dir)):
-			if filename.endswith(".png"):
-				step_num = filename.replace("step_", "").replace(".png", "")
-				filepath = os.path.join(screenshots_dir, filename)
-				img = Image.open(filepath)
-				img.thumbnail((400, 800))
-				buffer = io.BytesIO()
-				img.save(buffer, format="PNG", optimize=True)
-				b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-				html_output = html_output.replace(
-					f"SCREENSHOT_STEP_{step_num}",
-					f"data:image/png;base64,{b64}",
-				)
+			payload, payload_stats = build_report_payload(run, task_result)
+			print(
+				f"Report payload: ~{payload_stats['tokens']} tokens (raw result ~{payload_stats['raw_tokens']}), "
+				f"{payload_stats['steps_full']}/{payload_stats['steps']} steps in full, {payload_stats['steps_omitted']} omitted"
+			)
+			state, html_output, usage = await _stream_report(
+				REPORT_SYSTEM_PROMPT, _report_request(topic, payload), output_dir, topic, on_token,
+			)
+			payload_tokens, prompt_tokens = payload_stats["tokens"], usage.prompt_tokens if usage else None
+		REPORT_PAYLOAD_TOKENS.observe(payload_tokens)
+		run_store.set_report_tokens(run_id, payload_tokens, prompt_tokens)
+
+		if use_cache and state != "unknown":
+			report_cache.put(cache_key, state, html_output)
+
+	with span("report_screenshots", topic=topic):
+		html_output = await render_screenshots(html_output, output_dir)
+	if run:
+		# Appended after caching: the numbers belong to this run even when the text was reused
+		html_output = append_perf_section(html_output, run["steps"])
 
 	with open(f"{output_dir}/report.html", "w", encoding="utf-8") as f:
 		f.write(html_output)
@@ -326,26 +522,38 @@ Return the result in ["fail" or "pass" state, html output]
 	return state, html_output
 
 
-def send_to_slack(run_name, state, file_path, token=None, channel_id=None):
-	token = token or os.getenv("SLACK_TOKEN")
-	channel_id = channel_id or os.getenv("SLACK_CHANNEL_ID")
-	"""Send report to Slack."""
-	client = WebClient(token)
+async def generate_batch_report(title, runs, output_dir, repeats=()):
+	"""Write one report over several finished runs (run store records) to output_dir/report.html.
 
-	if state == "pass":
-		message_title = "🎉 Test passed! 🎉"
-	elif state == "fail":
-		message_title = "🚨 Test failed! 🚨"
-	else:
-		message_title = "🤷‍♀️ Test unknown! 🤷‍♀️"
+	Each run is written up by its own concurrent map call, with its
+	screenshots embedded from its own directory; a final pass adds the
+	summary sections and a verdict for the whole batch. `repeats` are one-line
+	notes on runs left out because they repeat a known failure. Returns
+	(state, html).
+	"""
+	os.makedirs(output_dir, exist_ok=True)
+	parts = [(f"{run['task']} on {run['device']} (run {run['id']})", build_report_payload(run, "")[0]) for run in runs]
+	summaries = await map_parts(title, parts)
+	for run, part in zip(runs, summaries):
+		# Every run numbers its steps from 0, so placeholders are resolved per run before merging
+		part["details_html"] = f"<h2>{html.escape(part['label'])}</h2>\n" + await render_screenshots(
+			part["details_html"], run["output_dir"], mode="inline",
+		) + perf_table_html(run["steps"])
+
+	header = "\n".join(
+		[f"batch: {title}, {len(runs)} runs"]
+		+ [f"- {run['task']} on {run['device']}: {run['report_state'] or run['status']}, {run['number_of_steps']} steps" for run in runs]
+		+ [f"- {repeat}" for repeat in repeats]
+	)
+	state, html_output, _ = await _stream_report(
+		REPORT_SYSTEM_PROMPT + REDUCE_NOTE, _report_request(title, reduce_data(header, summaries), screenshots=False), output_dir, title,
+	)
+	html_output = merge_details(html_output, summaries)
+	with open(f"{output_dir}/report.html", "w", encoding="utf-8") as f:
+		f.write(html_output)
+	return state, html_output
 
-	try:
-		client.files_upload_v2(
-			file=file_path,
-			title="Report",
-			channel=channel_id,
-			initial_comment=f"{message_title}\n\nView report here for {run_name}",
-		)
-		print("Slack message sent")
-	except SlackApiError as e:
-		print(f"Error sending to Slack: {e}")
+
+def send_to_slack(run_name, state, file_path, channel_id=None):
+	"""Queue the report for delivery to Slack; the outbox sends it in the background."""
+	slack_outbox.enqueue_report(run_name, state, file_path, channel_id=channel_id)
@@ -1,31 +1,245 @@
+import argparse
 import asyncio
+import os
+import time
 
-from backend.agents import TASKS, run_browser_task, generate_report, send_to_slack
+from backend.browser_pool import browser_pool
+from backend.failure_clusters import FAILURE_DEDUPE, duplicate_report, failure_index
+from backend.images import shutdown_image_pool
+from backend.llm_clients import close_report_client
+from backend.metrics import FAILURE_CLUSTER_LOOKUPS, RUNS, span
+from backend.run_store import run_store, RESULTS_DIR
+from backend.scenarios import TASKS, DEFAULT_DEVICE, DEVICE_PROFILES
+from backend.slack import slack_outbox
+from backend.watchdog import RUN_DEADLINE_SECONDS, RunCancelledError, RunDeadlineError, watchdog
 
+MATRIX_CONCURRENCY = int(os.getenv("MATRIX_CONCURRENCY", "4"))
+# Reuse the baseline's report instead of calling the report LLM when a run is visually unchanged
+VISUAL_SKIP_UNCHANGED = os.getenv("VISUAL_SKIP_UNCHANGED", "1").lower() in ("1", "true", "yes")
+# Write one combined report over every run of a matrix, next to the per-run reports
+MATRIX_BATCH_REPORT = os.getenv("MATRIX_BATCH_REPORT", "1").lower() in ("1", "true", "yes")
+
+
+async def main(task, device=DEFAULT_DEVICE, on_token=None, use_cache=True, use_replay=True, resume=None, notify=True,
+		skip_unchanged=VISUAL_SKIP_UNCHANGED, dedupe_failures=FAILURE_DEDUPE, deadline=RUN_DEADLINE_SECONDS):
+	# browser_use, openai and numpy are only loaded once a run actually starts
+	from backend.agents import run_browser_task, generate_report, send_to_slack
+	from backend.visual_diff import UNCHANGED, compare_to_baseline, reuse_baseline_report
 
-async def main(task):
 	# 1. Run browser task
-	print(f"Running task: {task}")
-	output_dir, output = await run_browser_task(task)
+	print(f"Running task: {task} ({device})")
+	with span("browser_task", task=task, device=device):
+		output_dir, output = await run_browser_task(task, device, use_replay=use_replay, resume=resume, deadline=deadline)
+	run_id = os.path.basename(output_dir)
 	print(output)
 	print(f"\nSaved to {output_dir}/result.txt")
 
-	# 2. Generate report
-	print("\nGenerating QA report...")
-	state, html_output = await generate_report(task, output, output_dir)
+	# 2. Compare screenshots with the blessed baseline run, if there is one
+	visual = await compare_to_baseline(run_id)
+	reused = None
+	if visual:
+		print(f"Visual diff against baseline {visual['baseline_run_id']}: {visual['verdict']} (changed steps: {visual['changed_steps']})")
+		if skip_unchanged and visual["verdict"] == UNCHANGED:
+			reused = reuse_baseline_report(visual, output_dir)
+
+	# 3. Match a failed run against known failures, so a repeat of one gets no new report. A failure
+	# that matches none starts its cluster now, before its report, so concurrent repeats join it
+	run = run_store.get_run(run_id)
+	cluster, reporting = failure_index.match_or_reserve(run) if dedupe_failures and not reused else (None, False)
+	duplicate = cluster if cluster and not reporting else None
+	cluster_id = cluster["id"] if cluster else None
+	if cluster:
+		FAILURE_CLUSTER_LOOKUPS.labels("new" if reporting else "duplicate").inc()
+	if duplicate:
+		print(f"\nRun failed the same way as failure #{cluster_id} ({duplicate['run_count']} runs), skipping the report")
+		duplicate = await failure_index.wait_for_report(duplicate)
+		if not duplicate["report_path"] and failure_index.claim_report(duplicate, run_id):
+			# The run writing the cluster's report failed; this one reports the failure instead
+			print(f"Failure #{cluster_id} has no report, writing it from this run")
+			duplicate, reporting = None, True
+
+	# 4. Generate report
+	if reused:
+		print("\nRun is visually unchanged, reusing the baseline report")
+		state, html_output = reused
+		if on_token:
+			on_token(html_output)
+	elif duplicate:
+		state, html_output = duplicate_report(duplicate, run, output_dir)
+		if on_token:
+			on_token(html_output)
+	else:
+		print("\nGenerating QA report...")
+		report_path = None
+		try:
+			with span("report_generation", task=task, device=device):
+				state, html_output = await generate_report(task, output, output_dir, on_token=on_token, use_cache=use_cache)
+			report_path = f"{output_dir}/report.html"
+		finally:
+			if reporting:
+				failure_index.set_report(cluster_id, report_path)
+		if reporting:
+			print(f"Recorded failure #{cluster_id}")
+	RUNS.labels(task, device, state).inc()
 	print(f"Report state: {state}")
 	print(f"Saved report to {output_dir}/report.html")
+	run_store.set_report(run_id, f"{output_dir}/report.html")
+	run_store.set_report_state(run_id, state)
+
+	# 5. Send to Slack, once per distinct failure
+	if notify and duplicate:
+		print(f"\nNot sending to Slack, failure #{cluster_id} was already reported")
+	elif notify:
+		print("\nQueueing report for Slack...")
+		send_to_slack(f"{task} ({device})", state, f"{output_dir}/report.html")
+
+	return {
+		"run_id": run_id,
+		"task": task,
+		"device": device,
+		"state": state,
+		"report_dir": output_dir,
+		"visual_verdict": visual["verdict"] if visual else None,
+		"failure_cluster": cluster_id,
+		"duplicate": bool(duplicate),
+	}
+
+
+async def run_matrix(tasks=None, devices=None, concurrency=MATRIX_CONCURRENCY, use_cache=True, use_replay=True,
+		batch_report=MATRIX_BATCH_REPORT, dedupe_failures=FAILURE_DEDUPE, deadline=RUN_DEADLINE_SECONDS):
+	"""Run every task on every device concurrently and return one aggregated result.
+
+	Slack gets a single digest message for the whole matrix instead of one upload per run.
+	With `batch_report`, the runs are also written up together in one report, in
+	which repeats of an already known failure are only listed. `deadline` applies to each
+	run on its own.
+	"""
+	tasks = list(tasks or TASKS.keys())
+	devices = list(devices or DEVICE_PROFILES.keys())
+	for task in tasks:
+		if task not in TASKS:
+			raise ValueError(f"Invalid task '{task}'. Choose from: {', '.join(TASKS.keys())}")
+	for device in devices:
+		if device not in DEVICE_PROFILES:
+			raise ValueError(f"Invalid device '{device}'. Choose from: {', '.join(DEVICE_PROFILES.keys())}")
 
-	# 3. Send to Slack
-	print("\nSending to Slack...")
-	send_to_slack(task, state, f"{output_dir}/report.html")
+	semaphore = asyncio.Semaphore(max(1, concurrency))
 
-	return {"task": task, "state": state, "report_dir": output_dir}
+	async def run_one(task, device):
+		async with semaphore:
+			try:
+				return await main(task, device, use_cache=use_cache, use_replay=use_replay, notify=False,
+					dedupe_failures=dedupe_failures, deadline=deadline)
+			except Exception as e:
+				print(f"Matrix run {task} ({device}) failed: {e}")
+				state = "cancelled" if isinstance(e, RunCancelledError) else "timed_out" if isinstance(e, RunDeadlineError) else "error"
+				return {"run_id": None, "task": task, "device": device, "state": state, "error": str(e), "report_dir": None,
+					"failure_cluster": None, "duplicate": False}
+
+	results = await asyncio.gather(*(run_one(task, device) for task in tasks for device in devices))
+
+	summary = {}
+	for result in results:
+		summary[result["state"]] = summary.get(result["state"], 0) + 1
+	state = "pass" if summary.get("pass", 0) == len(results) else "fail"
+
+	report_path = None
+	reported = [result for result in results if result["run_id"] and not result["duplicate"]]
+	runs = [run for run in (run_store.get_run(result["run_id"]) for result in reported) if run]
+	repeats = [
+		f"{result['task']} on {result['device']}: failed, same as known failure #{result['failure_cluster']}"
+		for result in results if result["duplicate"]
+	]
+	if batch_report and runs:
+		from backend.agents import generate_batch_report
+
+		output_dir = f"{RESULTS_DIR}/matrix_{time.strftime('%Y%m%d_%H%M%S')}"
+		try:
+			with span("batch_report", runs=len(runs)):
+				await generate_batch_report(f"Matrix {', '.join(tasks)} × {', '.join(devices)}", runs, output_dir, repeats)
+			report_path = f"{output_dir}/report.html"
+			print(f"Saved matrix report to {report_path}")
+		except Exception as e:
+			print(f"Matrix report failed, the per-run reports are unaffected: {e}")
+
+	slack_outbox.enqueue_digest(
+		f"Matrix {', '.join(tasks)} × {', '.join(devices)}",
+		[
+			{
+				"run_name": f"{result['task']} ({result['device']})",
+				"state": result["state"],
+				"note": f"same as #{result['failure_cluster']}" if result["duplicate"] else None,
+			}
+			for result in results
+		],
+		file_path=report_path,
+	)
+
+	return {"tasks": tasks, "devices": devices, "state": state, "summary": summary, "results": results, "report_path": report_path}
+
+
+async def run_cli(coro):
+	await slack_outbox.start()
+	await watchdog.start()
+	try:
+		return await coro
+	finally:
+		await slack_outbox.drain()
+		await slack_outbox.stop()
+		await watchdog.stop()
+		await browser_pool.close()
+		await close_report_client()
+		shutdown_image_pool()
+		run_store.close()
 
 
 if __name__ == "__main__":
-	task = input(f"Choose task ({', '.join(TASKS.keys())}): ").strip()
-	if task not in TASKS:
-		print(f"Invalid task. Choose from: {', '.join(TASKS.keys())}")
+	parser = argparse.ArgumentParser(description="Run mystery shopper test scenarios")
+	parser.add_argument("task", nargs="?", help=f"Task to run ({', '.join(TASKS.keys())})")
+	parser.add_argument("--device", default=DEFAULT_DEVICE, choices=DEVICE_PROFILES.keys())
+	parser.add_argument("--matrix", action="store_true", help="Run every selected task on every selected device")
+	parser.add_argument("--tasks", help="Comma-separated tasks for --matrix (default: all)")
+	parser.add_argument("--devices", help="Comma-separated devices for --matrix (default: all)")
+	parser.add_argument("--no-cache", action="store_true", help="Always call the report LLM, bypassing the report cache")
+	parser.add_argument("--no-replay", action="store_true", help="Always run the vision agent, ignoring recorded traces")
+	parser.add_argument("--resume", metavar="RUN_ID", help="Resume an interrupted run from its last persisted step")
+	parser.add_argument("--concurrency", type=int, default=MATRIX_CONCURRENCY, help="Max concurrent runs for --matrix")
+	parser.add_argument("--bless", metavar="RUN_ID", help="Make a finished run the visual baseline for its task and device")
+	parser.add_argument("--no-batch-report", action="store_true", help="Don't write the combined report for --matrix")
+	parser.add_argument("--always-report", action="store_true", help="Call the report LLM even when a run is visually unchanged")
+	parser.add_argument("--no-dedupe", action="store_true", help="Report failures that match a known failure in full")
+	parser.add_argument("--deadline", type=float, default=RUN_DEADLINE_SECONDS, help="Stop the browser part of a run after this many seconds (0: no limit)")
+	args = parser.parse_args()
+
+	if args.bless:
+		run = run_store.get_run(args.bless)
+		if run is None:
+			print(f"Run {args.bless} not found")
+		else:
+			run_store.set_baseline(run["task"], run["device"], args.bless)
+			print(f"Run {args.bless} is now the baseline for {run['task']} ({run['device']})")
+	elif args.matrix:
+		tasks = args.tasks.split(",") if args.tasks else None
+		devices = args.devices.split(",") if args.devices else None
+		result = asyncio.run(run_cli(run_matrix(tasks, devices, args.concurrency, use_cache=not args.no_cache, use_replay=not args.no_replay,
+			batch_report=MATRIX_BATCH_REPORT and not args.no_batch_report, dedupe_failures=FAILURE_DEDUPE and not args.no_dedupe,
+			deadline=args.deadline)))
+		print(f"\nMatrix state: {result['state']} {result['summary']}")
+		if result["report_path"]:
+			print(f"Matrix report: {result['report_path']}")
+		for run in result["results"]:
+			print(f"  {run['task']:<16} {run['device']:<8} {run['state']:<8} {run['report_dir']}")
+	elif args.resume:
+		run = run_store.get_run(args.resume)
+		if run is None:
+			print(f"Run {args.resume} not found")
+		else:
+			asyncio.run(run_cli(main(run["task"], run["device"], use_cache=not args.no_cache, resume=args.resume, skip_unchanged=VISUAL_SKIP_UNCHANGED and not args.always_report,
+				dedupe_failures=FAILURE_DEDUPE and not args.no_dedupe, deadline=args.deadline)))
 	else:
-		asyncio.run(main(task))
+		task = args.task or input(f"Choose task ({', '.join(TASKS.keys())}): ").strip()
+		if task not in TASKS:
+			print(f"Invalid task. Choose from: {', '.join(TASKS.keys())}")
+		else:
+			asyncio.run(run_cli(main(task, args.device, use_cache=not args.no_cache, use_replay=not args.no_replay, skip_unchanged=VISUAL_SKIP_UNCHANGED and not args.always_report,
+				dedupe_failures=FAILURE_DEDUPE and not args.no_dedupe, deadline=args.deadline)))
@@ -0,0 +1,297 @@
+"""Offline end-to-end benchmark of the test pipeline.
+
+Starts the buggy UI from server.py, a scripted OpenAI-compatible stub for the
+vision agent and the report LLM, and a fake Slack API, then drives
+run_browser_task, generate_report and the full backend.ai.main pipeline at a
+fixed concurrency and reports latency percentiles, throughput and peak RSS
+(this process plus its Chromium children):
+
+    python -m backend.benchmark --runs 8 --concurrency 4 --output bench.json
+    python -m backend.benchmark --baseline bench.json
+
+With --baseline the run exits non-zero when a stage's p95 latency or
+throughput regresses by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import psutil
+
+from backend.stub_servers import make_llm_handler, make_slack_handler, serve_in_background
+
+BENCHMARK_DIR = "results/benchmark"
+
+
+def _port_in_use(port):
+	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+		return s.connect_ex(("127.0.0.1", port)) == 0
+
+
+def start_buggy_ui(latency_ms=0.0):
+	"""Serve mokeBuggyUI.html the same way server.py does, unless it is already running."""
+	import server
+
+	if _port_in_use(server.BUGGY_UI_PORT):
+		print(f"  Buggy UI: already running on :{server.BUGGY_UI_PORT}")
+		return
+	threading.Thread(
+		target=server.start_server,
+		args=(server.BUGGY_UI_PORT, server.BUGGY_UI_DIR, "Buggy UI", "mokeBuggyUI.html"),
+		kwargs={"latency_ms": latency_ms, "allowed_files": server.BUGGY_UI_FILES},
+		daemon=True,
+	).start()
+
+
+def configure_environment(llm_url, slack_url, work_dir, scratch_dir):
+	"""Point every external endpoint at the stubs and keep benchmark state out of results/.
+
+	Run directories and screenshot blobs go to `scratch_dir`, a temporary
+	directory removed after the benchmark; the stores go to `work_dir`.
+	"""
+	os.environ.update({
+		"AGENT_BASE_URL": llm_url,
+		"REPORT_BASE_URL": llm_url,
+		"BYTEDANCE_API_KEY": "benchmark",
+		"OPENROUTER_API_KEY": "benchmark",
+		"SLACK_API_URL": slack_url,
+		"SLACK_TOKEN": "xoxb-benchmark",
+		"SLACK_CHANNEL_ID": "CBENCHMARK",
+		"SLACK_MIN_INTERVAL": "0",
+		"SLACK_DIGEST_INTERVAL": "0",
+		"RUN_STORE_PATH": f"{work_dir}/runs.db",
+		"SLACK_OUTBOX_PATH": f"{work_dir}/slack_outbox.db",
+		"REPLAY_DIR": f"{work_dir}/replays",
+		"REPORT_CACHE_DIR": f"{work_dir}/report_cache",
+		"RESULTS_DIR": scratch_dir,
+		"BLOB_STORE_DIR": f"{scratch_dir}/blobs",
+		"ANONYMIZED_TELEMETRY": "false",
+	})
+
+
+class RssSampler:
+	"""Polls the resident memory of this process and all its children, keeping the peak."""
+
+	def __init__(self, interval=0.2):
+		self.interval = interval
+		self.peak = 0
+		self._process = psutil.Process()
+		self._task = None
+
+	def sample(self):
+		total = self._process.memory_info().rss
+		for child in self._process.children(recursive=True):
+			try:
+				total += child.memory_info().rss
+			except psutil.Error:
+				pass
+		self.peak = max(self.peak, total)
+
+	async def _run(self):
+		while True:
+			self.sample()
+			await asyncio.sleep(self.interval)
+
+	def start(self):
+		self.peak = 0
+		self._task = asyncio.create_task(self._run())
+
+	async def stop(self):
+		self._task.cancel()
+		await asyncio.gather(self._task, return_exceptions=True)
+		self.sample()
+		return self.peak
+
+
+def percentile(values, pct):
+	"""Linear-interpolated percentile of `values` (pct in 0-100)."""
+	if not values:
+		return None
+	ordered = sorted(values)
+	rank = (len(ordered) - 1) * pct / 100
+	low = int(rank)
+	high = min(low + 1, len(ordered) - 1)
+	return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+async def run_stage(name, calls, concurrency, sampler):
+	"""Await every zero-argument coroutine factory in `calls`, `concurrency` at a time.
+
+	Returns (outputs, stats); outputs[i] is what calls[i] returned, or None if it failed.
+	"""
+	semaphore = asyncio.Semaphore(max(1, concurrency))
+	latencies, errors, outputs = [], [], [None] * len(calls)
+
+	async def timed(i, call):
+		async with semaphore:
+			start = time.perf_counter()
+			try:
+				outputs[i] = await call()
+				latencies.append(time.perf_counter() - start)
+			except Exception as e:
+				errors.append(f"{type(e).__name__}: {e}")
+
+	print(f"\n[{name}] {len(calls)} runs, concurrency {concurrency}")
+	sampler.start()
+	start = time.perf_counter()
+	await asyncio.gather(*(timed(i, call) for i, call in enumerate(calls)))
+	wall = time.perf_counter() - start
+	peak_rss = await sampler.stop()
+
+	for error in errors[:5]:
+		print(f"  error: {error}")
+	return outputs, {
+		"stage": name,
+		"runs": len(calls),
+		"errors": len(errors),
+		"concurrency": concurrency,
+		"wall_seconds": round(wall, 3),
+		"p50_seconds": round(percentile(latencies, 50), 3) if latencies else None,
+		"p95_seconds": round(percentile(latencies, 95), 3) if latencies else None,
+		"max_seconds": round(max(latencies), 3) if latencies else None,
+		"runs_per_minute": round(len(latencies) / wall * 60, 2) if wall else None,
+		"peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+	}
+
+
+async def benchmark(args):
+	# backend.llm_clients reads its endpoints from the environment at import time,
+	# so the pipeline is only imported once configure_environment() has pointed them at the stubs
+	from backend.agents import generate_report, run_browser_task
+	from backend.ai import main as run_pipeline
+
+	combos = [(task, device) for task in args.tasks for device in args.devices]
+	plan = [combos[i % len(combos)] for i in range(args.runs)]
+	sampler = RssSampler()
+	results = []
+
+	outputs, stats = await run_stage(
+		"browser_task",
+		[lambda t=task, d=device: run_browser_task(t, d, use_replay=args.replay) for task, device in plan],
+		args.concurrency,
+		sampler,
+	)
+	results.append(stats)
+
+	finished = [(task, *result) for (task, _), result in zip(plan, outputs) if result is not None]
+	_, stats = await run_stage(
+		"report",
+		[lambda t=task, d=output_dir, o=output: generate_report(t, o, d, use_cache=False) for task, output_dir, output in finished],
+		args.concurrency,
+		sampler,
+	)
+	results.append(stats)
+
+	_, stats = await run_stage(
+		"pipeline",
+		[lambda t=task, d=device: run_pipeline(t, d, use_cache=False, use_replay=args.replay) for task, device in plan],
+		args.concurrency,
+		sampler,
+	)
+	results.append(stats)
+	return results
+
+
+def print_results(results):
+	print(f"\n{'stage':<14} {'runs':>5} {'errors':>6} {'p50 s':>8} {'p95 s':>8} {'max s':>8} {'runs/min':>9} {'peak RSS MB':>12}")
+	for r in results:
+		print(
+			f"{r['stage']:<14} {r['runs']:>5} {r['errors']:>6} {r['p50_seconds'] or '-':>8} {r['p95_seconds'] or '-':>8} "
+			f"{r['max_seconds'] or '-':>8} {r['runs_per_minute'] or '-':>9} {r['peak_rss_mb']:>12}"
+		)
+
+
+def compare(results, baseline, tolerance):
+	"""Return a description of every stage that is slower or less productive than the baseline."""
+	previous = {r["stage"]: r for r in baseline["stages"]}
+	regressions = []
+	for r in results:
+		base = previous.get(r["stage"])
+		if not base:
+			continue
+		if r["errors"] > base["errors"]:
+			regressions.append(f"{r['stage']}: {r['errors']} errors (baseline {base['errors']})")
+		if r["p95_seconds"] and base["p95_seconds"] and r["p95_seconds"] > base["p95_seconds"] * (1 + tolerance):
+			regressions.append(f"{r['stage']}: p95 {r['p95_seconds']}s (baseline {base['p95_seconds']}s)")
+		if r["runs_per_minute"] and base["runs_per_minute"] and r["runs_per_minute"] < base["runs_per_minute"] * (1 - tolerance):
+			regressions.append(f"{r['stage']}: {r['runs_per_minute']} runs/min (baseline {base['runs_per_minute']})")
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Offline benchmark of the mystery shopper pipeline")
+	parser.add_argument("--runs", type=int, default=4, help="Runs per stage")
+	parser.add_argument("--concurrency", type=int, default=2, help="Concurrent runs per stage")
+	parser.add_argument("--tasks", default="login", help="Comma-separated tasks to cycle through")
+	parser.add_argument("--devices", default="mobile", help="Comma-separated devices to cycle through")
+	parser.add_argument("--agent-steps", type=int, default=2, help="Scripted navigation steps before the agent finishes")
+	parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM waits before each answer")
+	parser.add_argument("--ui-latency", type=float, default=0.0, help="Milliseconds the buggy UI server waits before each response")
+	parser.add_argument("--replay", action="store_true", help="Allow replaying recorded traces (off: every run drives the agent)")
+	parser.add_argument("--output", help="Write results as JSON to this file")
+	parser.add_argument("--baseline", help="Compare against a previous --output file and fail on regressions")
+	parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression against --baseline")
+	args = parser.parse_args()
+	args.tasks = args.tasks.split(",")
+	args.devices = args.devices.split(",")
+
+	import server
+
+	work_dir = f"{BENCHMARK_DIR}/{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+	os.makedirs(work_dir, exist_ok=True)
+	target_url = f"http://localhost:{server.BUGGY_UI_PORT}"
+	slack_calls = []
+	llm = serve_in_background(make_llm_handler(target_url, args.agent_steps, args.llm_latency))
+	slack = serve_in_background(make_slack_handler(slack_calls))
+	llm_url = f"http://127.0.0.1:{llm.server_address[1]}/v1"
+	slack_url = f"http://127.0.0.1:{slack.server_address[1]}/api/"
+
+	print("=" * 60)
+	print("Mystery shopper offline benchmark")
+	print("=" * 60)
+	start_buggy_ui(args.ui_latency)
+	print(f"  Stub LLM: {llm_url}")
+	print(f"  Fake Slack: {slack_url}")
+	scratch_dir = tempfile.mkdtemp(prefix="mystery_shopper_benchmark_")
+	configure_environment(llm_url, slack_url, work_dir, scratch_dir)
+
+	from backend.ai import run_cli
+
+	try:
+		results = asyncio.run(run_cli(benchmark(args)))
+	finally:
+		shutil.rmtree(scratch_dir, ignore_errors=True)
+	print_results(results)
+	print(f"\nSlack API calls: {len(slack_calls)}")
+
+	report = {
+		"created_at": datetime.now().isoformat(),
+		"config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+		"stages": results,
+	}
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+		print(f"Saved results to {args.output}")
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f), args.tolerance)
+		if regressions:
+			print("\nRegressions against baseline:")
+			for regression in regressions:
+				print(f"  {regression}")
+			sys.exit(1)
+		print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+	main()
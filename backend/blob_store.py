@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "results/blobs")
+MANIFEST_NAME = "manifest.json"
+
+
+class BlobStore:
+	"""Content-addressed store for screenshots shared by every run.
+
+	Each distinct image is written once to `{root}/{aa}/{sha256}.{ext}`, and a
+	run's `screenshots/step_N.png` is a hard link to its blob (a copy where the
+	filesystem has no hard links). Readers keep using the run's own paths; a
+	byte-identical frame in another run costs no extra disk. Which blob each
+	step uses is recorded in the run's screenshots/manifest.json, which is
+	what garbage collection counts as a reference.
+	"""
+
+	def __init__(self, root=BLOB_STORE_DIR):
+		self.root = root
+		self._lock = threading.Lock()
+
+	def path(self, digest, ext="png"):
+		return os.path.join(self.root, digest[:2], f"{digest}.{ext}")
+
+	def put(self, data, ext="png"):
+		"""Store `data` unless an identical blob exists; return (digest, path)."""
+		digest = hashlib.sha256(data).hexdigest()
+		path = self.path(digest, ext)
+		if os.path.exists(path):
+			# Refresh the mtime so a concurrent garbage collection treats the blob as recently used
+			os.utime(path)
+			return digest, path
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(tmp_path, "wb") as f:
+			f.write(data)
+		os.replace(tmp_path, path)
+		return digest, path
+
+	def link(self, data, dest, ext="png"):
+		"""Store `data` and make `dest` refer to its blob. Returns the digest."""
+		digest, path = self.put(data, ext)
+		if os.path.lexists(dest):
+			os.remove(dest)
+		try:
+			os.link(path, dest)
+		except FileNotFoundError:
+			# Collected between put() and link(); write it again
+			digest, path = self.put(data, ext)
+			os.link(path, dest)
+		except OSError:
+			shutil.copyfile(path, dest)
+		return digest
+
+	def adopt(self, path, ext="png"):
+		"""Move an existing plain file into the store, leaving a link in its place. Returns the digest."""
+		with open(path, "rb") as f:
+			return self.link(f.read(), path, ext)
+
+	def iter_blobs(self):
+		"""Yield (digest, path) for every blob in the store."""
+		if not os.path.isdir(self.root):
+			return
+		for prefix in os.listdir(self.root):
+			prefix_dir = os.path.join(self.root, prefix)
+			if not os.path.isdir(prefix_dir):
+				continue
+			for name in os.listdir(prefix_dir):
+				if not name.endswith(".tmp"):
+					yield name.split(".", 1)[0], os.path.join(prefix_dir, name)
+
+
+class Manifest:
+	"""A run's step -> blob digest map, persisted next to its screenshots."""
+
+	def __init__(self, screenshots_dir):
+		self.path = os.path.join(screenshots_dir, MANIFEST_NAME)
+		self.steps = read_manifest(screenshots_dir)
+
+	def set(self, step, digest):
+		self.steps[str(step)] = digest
+		tmp_path = f"{self.path}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump(self.steps, f)
+		os.replace(tmp_path, self.path)
+
+
+def read_manifest(screenshots_dir):
+	path = os.path.join(screenshots_dir, MANIFEST_NAME)
+	if not os.path.exists(path):
+		return {}
+	with open(path) as f:
+		return json.load(f)
+
+
+blob_store = BlobStore()
@@ -0,0 +1,262 @@
+import asyncio
+import os
+from urllib.parse import urlparse
+
+import psutil
+
+from backend.metrics import span
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "4"))
+BROWSER_POOL_WARM = int(os.getenv("BROWSER_POOL_WARM", "1"))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "25"))
+BROWSER_HEALTH_TIMEOUT = float(os.getenv("BROWSER_HEALTH_TIMEOUT", "5"))
+# A browser that doesn't shut down within this is killed with its child processes
+BROWSER_CLOSE_TIMEOUT = float(os.getenv("BROWSER_CLOSE_TIMEOUT", "10"))
+
+
+def kill_process_tree(proc):
+	"""Kill a psutil.Process and all its descendants, waiting briefly for them to exit."""
+	procs = [proc]
+	try:
+		procs += proc.children(recursive=True)
+	except psutil.Error:
+		pass
+	for p in procs:
+		try:
+			p.kill()
+		except psutil.Error:
+			pass
+	psutil.wait_procs(procs, timeout=5)
+
+
+class PooledBrowser:
+	"""A launched headless browser owned by the pool, plus its bookkeeping."""
+
+	def __init__(self, key, session, pid=None, create_time=None):
+		self.key = key
+		self.session = session
+		self.pid = pid
+		# Start time of the browser process, to tell it apart from a later process that reuses its pid
+		self.create_time = create_time
+		self.uses = 0
+
+	def process(self):
+		"""The browser's psutil.Process if it is still running, else None."""
+		if not self.pid or self.create_time is None:
+			return None
+		try:
+			proc = psutil.Process(self.pid)
+			return proc if proc.create_time() == self.create_time else None
+		except psutil.Error:
+			return None
+
+
+class BrowserPool:
+	"""Process-wide pool of pre-launched headless browsers.
+
+	Browsers are grouped by profile key (viewport, user agent, ...). A run
+	acquires a browser exclusively, and on release its cookies, storage and
+	extra tabs are wiped so the next run starts from a clean context. Browsers
+	that fail a health check or reach `max_uses` are closed and replaced.
+
+	The lock only guards the bookkeeping: browsers are taken out of or put
+	back into it under the lock, while launches, health checks, resets and
+	closes run outside it, so one slow browser never holds up the others.
+	"""
+
+	def __init__(self, max_size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES):
+		self.max_size = max(1, max_size)
+		self.max_uses = max_uses
+		self._idle = {}
+		self._in_use = 0
+		self._warming = 0
+		self._leased = set()
+		self._lock = asyncio.Lock()
+		self._available = asyncio.Condition(self._lock)
+
+	@property
+	def size(self):
+		return self._in_use + self._warming + sum(len(idle) for idle in self._idle.values())
+
+	def stats(self):
+		return {
+			"max_size": self.max_size,
+			"in_use": self._in_use,
+			"idle": {key: len(idle) for key, idle in self._idle.items()},
+		}
+
+	def pids(self):
+		"""Process ids of every browser the pool owns (None for one whose pid is unknown)."""
+		return {pooled.pid for pooled in self._leased} | {pooled.pid for idle in self._idle.values() for pooled in idle}
+
+	async def _launch(self, key, profile_kwargs):
+		from browser_use import Browser, BrowserProfile
+
+		with span("browser_launch", profile=key):
+			session = Browser(
+				browser_profile=BrowserProfile(headless=True, keep_alive=True, **profile_kwargs),
+			)
+			await session.start()
+		pid = await self._browser_pid(session)
+		create_time = None
+		if pid:
+			try:
+				create_time = psutil.Process(pid).create_time()
+			except psutil.Error as e:
+				print(f"Could not inspect the process of a launched browser: {e}")
+		return PooledBrowser(key, session, pid, create_time)
+
+	async def _browser_pid(self, session):
+		try:
+			cdp_session = await session.get_or_create_cdp_session()
+			info = await cdp_session.cdp_client.send.SystemInfo.getProcessInfo()
+			return next((p["id"] for p in info.get("processInfo", []) if p.get("type") == "browser"), None)
+		except Exception as e:
+			print(f"Could not get the pid of a launched browser: {e}")
+			return None
+
+	async def _close(self, pooled):
+		"""Shut a browser down; if it doesn't go in time, kill its process tree."""
+		try:
+			await asyncio.wait_for(pooled.session.kill(), BROWSER_CLOSE_TIMEOUT)
+		except Exception as e:
+			print(f"Error closing pooled browser ({pooled.key}): {e}")
+		proc = await asyncio.to_thread(pooled.process)
+		if proc is not None:
+			await asyncio.to_thread(kill_process_tree, proc)
+
+	async def _is_healthy(self, pooled):
+		try:
+			cdp_session = await pooled.session.get_or_create_cdp_session()
+			await asyncio.wait_for(
+				cdp_session.cdp_client.send.Browser.getVersion(),
+				timeout=BROWSER_HEALTH_TIMEOUT,
+			)
+			return True
+		except Exception as e:
+			print(f"Pooled browser ({pooled.key}) failed health check: {e}")
+			return False
+
+	async def _reset(self, pooled, visited_urls):
+		"""Return the browser to a blank state: one about:blank tab, no cookies, no storage."""
+		cdp_session = await pooled.session.get_or_create_cdp_session()
+		send = cdp_session.cdp_client.send
+		session_id = cdp_session.session_id
+
+		# Target and Storage commands are browser-wide, so they go to the browser session
+		targets = await send.Target.getTargets()
+		for target in targets.get("targetInfos", []):
+			if target.get("type") == "page" and target.get("targetId") != cdp_session.target_id:
+				await send.Target.closeTarget(params={"targetId": target["targetId"]})
+
+		await send.Storage.clearCookies()
+		origins = set()
+		for url in visited_urls:
+			parsed = urlparse(url or "")
+			if parsed.scheme in ("http", "https"):
+				origins.add(f"{parsed.scheme}://{parsed.netloc}")
+		for origin in origins:
+			await send.Storage.clearDataForOrigin(params={"origin": origin, "storageTypes": "all"})
+		await send.Network.clearBrowserCache(session_id=session_id)
+		await send.Page.navigate(params={"url": "about:blank"}, session_id=session_id)
+
+	def _take_excess_idle(self):
+		"""Remove idle browsers (from the largest idle groups) until the pool fits `max_size`. Caller holds the lock."""
+		excess = []
+		while self.size > self.max_size:
+			key = max(self._idle, key=lambda k: len(self._idle[k]), default=None)
+			if key is None or not self._idle[key]:
+				break
+			excess.append(self._idle[key].pop(0))
+		return excess
+
+	async def _close_all(self, browsers):
+		await asyncio.gather(*(self._close(pooled) for pooled in browsers))
+
+	async def warm(self, key, profile_kwargs, count=BROWSER_POOL_WARM):
+		"""Pre-launch up to `count` idle browsers for `key` so the first runs skip the cold start."""
+		async with self._lock:
+			launches = max(0, min(count - len(self._idle.get(key, [])), self.max_size - self.size))
+			self._warming += launches
+		for _ in range(launches):
+			try:
+				pooled = await self._launch(key, profile_kwargs)
+			except BaseException:
+				async with self._available:
+					self._warming -= launches
+					self._available.notify()
+				raise
+			launches -= 1
+			async with self._available:
+				self._warming -= 1
+				self._idle.setdefault(key, []).append(pooled)
+				self._available.notify()
+
+	async def acquire(self, key, profile_kwargs):
+		"""Wait for a free slot and return a healthy browser for `key`."""
+		async with self._available:
+			while self._in_use >= self.max_size:
+				await self._available.wait()
+			self._in_use += 1
+
+		try:
+			while True:
+				async with self._lock:
+					idle = self._idle.get(key)
+					pooled = idle.pop() if idle else None
+					excess = self._take_excess_idle() if pooled is None else []
+				if pooled is None:
+					break
+				if await self._is_healthy(pooled):
+					self._leased.add(pooled)
+					return pooled
+				await self._close(pooled)
+
+			await self._close_all(excess)
+			pooled = await self._launch(key, profile_kwargs)
+			self._leased.add(pooled)
+			return pooled
+		except BaseException:
+			async with self._available:
+				self._in_use -= 1
+				self._available.notify()
+			raise
+
+	async def release(self, pooled, visited_urls=(), discard=False):
+		"""Reset and return a browser to the pool, or close it if it is worn out, broken or `discard`ed.
+
+		Pass `discard` for a browser whose run was cancelled or crashed: its
+		state is unknown, so it is closed instead of reused.
+		"""
+		pooled.uses += 1
+		keep = pooled.uses < self.max_uses and not discard
+		if keep:
+			try:
+				await self._reset(pooled, visited_urls)
+			except Exception as e:
+				print(f"Error resetting pooled browser ({pooled.key}), recycling it: {e}")
+				keep = False
+		if not keep:
+			await self._close(pooled)
+
+		async with self._available:
+			self._in_use -= 1
+			self._leased.discard(pooled)
+			if keep:
+				self._idle.setdefault(pooled.key, []).append(pooled)
+			self._available.notify()
+
+	async def close_idle(self):
+		"""Close every idle browser to free memory; returns how many were closed."""
+		async with self._lock:
+			idle, self._idle = [pooled for group in self._idle.values() for pooled in group], {}
+		await self._close_all(idle)
+		return len(idle)
+
+	async def close(self):
+		"""Close every idle browser. Browsers still in use are closed when released."""
+		self.max_uses = 0
+		await self.close_idle()
+
+
+browser_pool = BrowserPool()
@@ -0,0 +1,95 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+
+# Events buffered per subscriber; a client that falls further behind loses its oldest events
+EVENTS_CLIENT_BUFFER = int(os.getenv("EVENTS_CLIENT_BUFFER", "256"))
+
+TEST_STARTED = "test_started"
+TEST_PROGRESS = "test_progress"
+ISSUE_FOUND = "issue_found"
+TEST_COMPLETED = "test_completed"
+
+# The job whose run is publishing, set by the job queue; events carry it so a client can follow the job it submitted
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class Subscription:
+	"""One client's bounded view of the event stream, optionally limited to a single run or job."""
+
+	def __init__(self, bus, run_id=None, buffer=EVENTS_CLIENT_BUFFER, job_id=None):
+		self.bus = bus
+		self.run_id = run_id
+		self.job_id = job_id
+		self.dropped = 0
+		self._queue = asyncio.Queue(maxsize=max(1, buffer))
+
+	def _offer(self, event):
+		if self.run_id is not None and event.get("run_id") != self.run_id:
+			return
+		if self.job_id is not None and event.get("job_id") != self.job_id:
+			return
+		if self._queue.full():
+			# Slow consumer: drop its oldest event rather than blocking the run or growing without bound
+			self._queue.get_nowait()
+			self.dropped += 1
+		self._queue.put_nowait(event)
+
+	async def get(self):
+		return await self._queue.get()
+
+	def close(self):
+		self.bus.unsubscribe(self)
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		return await self.get()
+
+
+class EventBus:
+	"""In-process pub/sub fan-out of test run events to any number of subscribers.
+
+	Publishing never waits: each event is put on every matching subscriber's
+	bounded queue, so one slow dashboard cannot hold up a run or the other
+	clients. Must be used from the event loop thread.
+	"""
+
+	def __init__(self):
+		self._subscribers = set()
+		self._seq = 0
+		self.published = 0
+
+	def subscribe(self, run_id=None, buffer=EVENTS_CLIENT_BUFFER, job_id=None):
+		subscription = Subscription(self, run_id, buffer, job_id)
+		self._subscribers.add(subscription)
+		return subscription
+
+	def unsubscribe(self, subscription):
+		self._subscribers.discard(subscription)
+
+	def publish(self, event_type, run_id, **data):
+		self._seq += 1
+		self.published += 1
+		event = {"type": event_type, "seq": self._seq, "ts": time.time(), "run_id": run_id, "job_id": current_job.get(), **data}
+		for subscription in list(self._subscribers):
+			subscription._offer(event)
+		return event
+
+	def stats(self):
+		return {
+			"subscribers": len(self._subscribers),
+			"published": self.published,
+			"dropped": sum(s.dropped for s in self._subscribers),
+		}
+
+
+def sse_format(event):
+	"""Serialize an event as one Server-Sent Events message."""
+	return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+event_bus = EventBus()
@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import html
+import os
+import random
+import re
+from urllib.parse import urlsplit
+
+from backend.report_payload import action_text, is_failing, render_step, FULL
+from backend.run_store import run_store
+
+# Failing runs that match a known failure get a short "same as #N" report instead of a report LLM call
+FAILURE_DEDUPE = os.getenv("FAILURE_DEDUPE", "1").lower() in ("1", "true", "yes")
+# Estimated Jaccard similarity of two fingerprints above which they are the same failure
+FAILURE_SIMILARITY = float(os.getenv("FAILURE_SIMILARITY", "0.6"))
+# How long a repeat waits for the report of the run that started its cluster, to link to it
+FAILURE_REPORT_WAIT = float(os.getenv("FAILURE_REPORT_WAIT", "300"))
+# 16 bands of 4 rows: pairs at the threshold become LSH candidates ~90% of the time, pairs below 0.3 ~12%
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+# Fixed seed: stored signatures must stay comparable across processes and restarts
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+
+_VOLATILE = (
+	(re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"), "<uuid>"),
+	(re.compile(r"\b(?=[0-9a-f]*\d)[0-9a-f]{12,}\b"), "<hex>"),
+	(re.compile(r"\d+(\.\d+)?"), "<n>"),
+)
+
+
+def normalize(text):
+	"""Lower-case `text` and mask ids, timestamps and other numbers that differ between runs of one failure."""
+	text = " ".join(str(text).lower().split())
+	for pattern, replacement in _VOLATILE:
+		text = pattern.sub(replacement, text)
+	return text
+
+
+def _page(url):
+	parts = urlsplit(url or "")
+	return f"{parts.netloc}{parts.path}" or (url or "")
+
+
+def _shingles(prefix, text, size=3):
+	words = normalize(text).split()
+	if len(words) <= size:
+		return {f"{prefix}:{' '.join(words)}"} if words else set()
+	return {f"{prefix}:{' '.join(words[i:i + size])}" for i in range(len(words) - size + 1)}
+
+
+def is_failed_run(run):
+	return bool(run) and (not run["is_successful"] or bool(run["error"]))
+
+
+def fingerprint(run):
+	"""The set of features that identify how a failed run failed.
+
+	Errors are shingled into word trigrams, so the same error with a different
+	id or count still mostly matches; failing steps add their page and action,
+	and the last step adds the page the run ended on.
+	"""
+	features = set()
+	if run["error"]:
+		features |= _shingles("run_error", run["error"])
+	for step in run["steps"]:
+		if not is_failing(step):
+			continue
+		if step["error"]:
+			features |= _shingles("error", step["error"])
+		features.add(f"page:{_page(step['url'])}")
+		features.add(f"action:{normalize(action_text(step['action']))}")
+		for item in step["action"] or []:
+			features.update(f"action_name:{name}" for name in item)
+	if run["steps"]:
+		last = run["steps"][-1]
+		features.add(f"final_page:{_page(last['url'])}")
+		if last["title"]:
+			features.add(f"final_title:{normalize(last['title'])}")
+	if not any(feature.startswith(("error:", "run_error:")) for feature in features) and run["final_result"]:
+		# Nothing raised: the agent's own account of what went wrong is all there is
+		features |= _shingles("result", run["final_result"])
+	return features
+
+
+def minhash(features):
+	hashes = [int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big") for feature in features]
+	if not hashes:
+		return []
+	return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(a, b):
+	"""Estimated Jaccard similarity of the feature sets behind two MinHash signatures."""
+	if not a or len(a) != len(b):
+		return 0.0
+	return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def _bands(signature):
+	rows = len(signature) // LSH_BANDS
+	return [(band, hash(tuple(signature[band * rows:(band + 1) * rows]))) for band in range(LSH_BANDS)]
+
+
+def _summary(run):
+	for step in run["steps"]:
+		if step["error"]:
+			return f"step {step['step_index']}: {' '.join(step['error'].split())[:300]}"
+	return " ".join((run["error"] or run["final_result"] or "").split())[:300] or None
+
+
+class FailureIndex:
+	"""MinHash/LSH index of known failure clusters, backed by the run store.
+
+	A failed run is matched against the clusters of its task: LSH buckets
+	narrow the clusters down to likely candidates, and the most similar one
+	above FAILURE_SIMILARITY wins. Clusters keep the signature of the run
+	that started them, so they don't drift as runs join.
+
+	Matching and starting a cluster happen in one run store transaction,
+	before the first run's report is written, so runs failing the same way
+	at the same time (a matrix) join one cluster instead of each getting a
+	full report. Its members wait for that report with wait_for_report().
+	If the report can't be written the cluster is released, and the next run
+	that matches it writes the report instead.
+	"""
+
+	def __init__(self, threshold=FAILURE_SIMILARITY):
+		self.threshold = threshold
+		self._clusters = None
+		self._buckets = {}
+		self._max_id = 0
+		self._pending = {}
+
+	def _load(self):
+		if self._clusters is None:
+			self._clusters = {}
+			for cluster in run_store.list_failure_clusters():
+				self._index(cluster)
+		return self._clusters
+
+	def _index(self, cluster):
+		self._clusters[cluster["id"]] = cluster
+		self._max_id = max(self._max_id, cluster["id"])
+		for band in _bands(cluster["signature"]):
+			self._buckets.setdefault((cluster["task"], band), set()).add(cluster["id"])
+
+	def _best(self, task, signature):
+		candidates = set()
+		for band in _bands(signature):
+			candidates |= self._buckets.get((task, band), set())
+		scored = [(similarity(signature, self._clusters[cluster_id]["signature"]), cluster_id) for cluster_id in candidates]
+		return max(scored, default=(0.0, None))
+
+	def match_or_reserve(self, run):
+		"""Return (cluster, reporting) for a failed run, or (None, False) for any other run.
+
+		The run joins the known cluster it matches (the cluster has a
+		"similarity"), or a new cluster is started for it. reporting is True
+		when the run is to write the cluster's report - it started the cluster
+		or the cluster was released - and then set_report() must follow.
+		"""
+		if not is_failed_run(run):
+			return None, False
+		signature = minhash(fingerprint(run))
+		if not signature:
+			return None, False
+		self._load()
+		score = 0.0
+
+		def choose(new_clusters):
+			nonlocal score
+			for cluster in new_clusters:
+				self._index(cluster)
+			score, cluster_id = self._best(run["task"], signature)
+			return cluster_id if score >= self.threshold else None
+
+		summary = _summary(run)
+		cluster_id, reporting = run_store.match_or_reserve_failure_cluster(run["task"], signature, summary, run["id"], self._max_id, choose)
+		if cluster_id not in self._clusters:
+			self._index({
+				"id": cluster_id,
+				"task": run["task"],
+				"signature": signature,
+				"summary": summary,
+				"first_run_id": run["id"],
+				"report_path": None,
+				"run_count": 1,
+			})
+			self._pending[cluster_id] = asyncio.Event()
+			return self._clusters[cluster_id], True
+		cluster = self._clusters[cluster_id]
+		cluster["run_count"] += 1
+		if reporting:
+			self._pending.setdefault(cluster_id, asyncio.Event())
+		return {**cluster, "similarity": score}, reporting
+
+	def claim_report(self, cluster, run_id):
+		"""Take over writing the report of a released cluster; True if `run_id` now has to call set_report()."""
+		if not run_store.claim_failure_cluster_report(cluster["id"], run_id):
+			return False
+		self._pending.setdefault(cluster["id"], asyncio.Event())
+		return True
+
+	def set_report(self, cluster_id, report_path):
+		"""Record the report of a reserved cluster and wake its waiting members.
+
+		With no report_path (the report couldn't be written) the cluster is
+		released instead, for the next matching run to report on.
+		"""
+		if report_path:
+			run_store.set_failure_cluster_report(cluster_id, report_path)
+			self._clusters[cluster_id]["report_path"] = report_path
+		else:
+			run_store.release_failure_cluster(cluster_id)
+		pending = self._pending.pop(cluster_id, None)
+		if pending is not None:
+			pending.set()
+
+	async def wait_for_report(self, cluster, timeout=FAILURE_REPORT_WAIT):
+		"""Wait (up to `timeout` seconds) for the report of a cluster that was reserved but not reported yet."""
+		if cluster["report_path"]:
+			return cluster
+		pending = self._pending.get(cluster["id"])
+		if pending is not None:
+			try:
+				await asyncio.wait_for(pending.wait(), timeout)
+			except asyncio.TimeoutError:
+				pass
+		else:
+			# Reserved by another worker: its report may have landed in the store since
+			stored = run_store.get_failure_cluster(cluster["id"])
+			if stored and stored["report_path"]:
+				self._clusters[cluster["id"]]["report_path"] = stored["report_path"]
+		return {**cluster, "report_path": self._clusters[cluster["id"]]["report_path"]}
+
+
+def duplicate_report(cluster, run, output_dir):
+	"""Write a short report pointing a repeat failure at its cluster's report. Returns ("fail", html)."""
+	steps = "\n".join(render_step(step, FULL) for step in run["steps"] if is_failing(step)) or run["error"] or ""
+	link = ""
+	if cluster["report_path"]:
+		href = os.path.relpath(cluster["report_path"], output_dir)
+		link = f'<p>Full report: <a href="{html.escape(href)}">{html.escape(cluster["report_path"])}</a></p>'
+	html_output = (
+		"<!DOCTYPE html><html><body style=\"font-family:sans-serif;max-width:900px;margin:auto;\">"
+		f"<h1>Same as failure #{cluster['id']}</h1>"
+		f"<p style=\"background:#fee;padding:8px;border-radius:4px;\">{html.escape(run['task'])} on {html.escape(run['device'])} "
+		f"failed the same way as run {html.escape(cluster['first_run_id'])} ({cluster['similarity']:.0%} similar), "
+		f"which has now failed like this {cluster['run_count']} times. No new report was generated.</p>"
+		+ (f"<p><b>Failure:</b> {html.escape(cluster['summary'])}</p>" if cluster["summary"] else "")
+		+ link
+		+ (f"<h2>Failing steps in this run</h2><pre style=\"white-space:pre-wrap;\">{html.escape(steps)}</pre>" if steps else "")
+		+ "</body></html>"
+	)
+	with open(f"{output_dir}/report.html", "w", encoding="utf-8") as f:
+		f.write(html_output)
+	return "fail", html_output
+
+
+failure_index = FailureIndex()
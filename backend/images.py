@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+REPORT_IMAGE_FORMAT = os.getenv("REPORT_IMAGE_FORMAT", "webp").lower()
+REPORT_IMAGE_QUALITY = int(os.getenv("REPORT_IMAGE_QUALITY", "70"))
+REPORT_IMAGE_MAX_SIZE = (400, 800)
+# "inline" embeds data URIs so report.html is self-contained; "link" writes
+# thumbnails next to the report and references them by relative path
+REPORT_IMAGE_MODE = os.getenv("REPORT_IMAGE_MODE", "inline").lower()
+# Mean absolute grey-level difference (0-255) below which a frame counts as a
+# near-duplicate of the previous one; 0 disables duplicate skipping
+REPORT_DUPLICATE_THRESHOLD = float(os.getenv("REPORT_DUPLICATE_THRESHOLD", "1.0"))
+REPORT_IMAGE_WORKERS = int(os.getenv("REPORT_IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg", "png": "png"}
+
+_PLACEHOLDER = re.compile(r"<img\b[^>]*?SCREENSHOT_STEP_(\d+)[^>]*>|SCREENSHOT_STEP_(\d+)")
+_STEP_FILE = re.compile(r"^step_(\d+)\.png$")
+
+_pool = None
+
+
+def encode_thumbnail(path, fmt=REPORT_IMAGE_FORMAT, quality=REPORT_IMAGE_QUALITY, max_size=REPORT_IMAGE_MAX_SIZE):
+	"""Thumbnail and encode one screenshot. Runs in a worker process.
+
+	Returns (encoded bytes, 32x32 greyscale fingerprint) so the caller can
+	spot near-duplicate frames without decoding the image again.
+	"""
+	from PIL import Image
+
+	with Image.open(path) as img:
+		fingerprint = img.convert("L").resize((32, 32), Image.Resampling.BILINEAR).tobytes()
+		img.thumbnail(max_size)
+		buffer = io.BytesIO()
+		if fmt == "jpeg":
+			img.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+		elif fmt == "webp":
+			img.save(buffer, format="WEBP", quality=quality, method=4)
+		else:
+			img.save(buffer, format="PNG", optimize=True)
+	return buffer.getvalue(), fingerprint
+
+
+def _frame_distance(a, b):
+	return sum(abs(x - y) for x, y in zip(a, b)) / len(a)
+
+
+def get_image_pool():
+	global _pool
+	if _pool is None:
+		_pool = ProcessPoolExecutor(
+			max_workers=max(1, REPORT_IMAGE_WORKERS),
+			mp_context=multiprocessing.get_context("spawn"),
+		)
+	return _pool
+
+
+def shutdown_image_pool():
+	global _pool
+	if _pool is not None:
+		_pool.shutdown(wait=False, cancel_futures=True)
+		_pool = None
+
+
+async def encode_file(path, fmt=REPORT_IMAGE_FORMAT, quality=REPORT_IMAGE_QUALITY, max_size=REPORT_IMAGE_MAX_SIZE):
+	"""Thumbnail and encode a single image in the process pool, returning the encoded bytes."""
+	loop = asyncio.get_running_loop()
+	data, _ = await loop.run_in_executor(get_image_pool(), encode_thumbnail, path, fmt, quality, max_size)
+	return data
+
+
+async def encode_screenshots(screenshots_dir, fmt=REPORT_IMAGE_FORMAT, quality=REPORT_IMAGE_QUALITY):
+	"""Encode every step_N.png in `screenshots_dir` concurrently in the process pool.
+
+	Returns {step: (encoded bytes or None, duplicate_of step or None)}; frames
+	that are near-identical to the previous step carry no bytes.
+	"""
+	if not os.path.isdir(screenshots_dir):
+		return {}
+	steps = sorted(
+		int(match.group(1))
+		for match in map(_STEP_FILE.match, os.listdir(screenshots_dir))
+		if match
+	)
+	loop = asyncio.get_running_loop()
+	pool = get_image_pool()
+	encoded = await asyncio.gather(*(
+		loop.run_in_executor(pool, encode_thumbnail, os.path.join(screenshots_dir, f"step_{step}.png"), fmt, quality)
+		for step in steps
+	))
+
+	frames = {}
+	previous_step, previous_fingerprint = None, None
+	for step, (data, fingerprint) in zip(steps, encoded):
+		if (
+			previous_fingerprint is not None
+			and REPORT_DUPLICATE_THRESHOLD > 0
+			and _frame_distance(fingerprint, previous_fingerprint) < REPORT_DUPLICATE_THRESHOLD
+		):
+			original = frames[previous_step][1]
+			frames[step] = (None, previous_step if original is None else original)
+		else:
+			frames[step] = (data, None)
+		previous_step, previous_fingerprint = step, fingerprint
+	return frames
+
+
+async def render_screenshots(html_output, output_dir, fmt=REPORT_IMAGE_FORMAT, quality=REPORT_IMAGE_QUALITY, mode=REPORT_IMAGE_MODE):
+	"""Replace SCREENSHOT_STEP_N placeholders with thumbnails in a single pass over the HTML.
+
+	Near-duplicate frames are replaced by a short note pointing at the
+	earlier step instead of a second copy of the image.
+	"""
+	frames = await encode_screenshots(f"{output_dir}/screenshots", fmt, quality)
+	if not frames:
+		return html_output
+
+	sources = {}
+	if mode == "link":
+		thumbnails_dir = f"{output_dir}/thumbnails"
+		os.makedirs(thumbnails_dir, exist_ok=True)
+	for step, (data, _) in frames.items():
+		if data is None:
+			continue
+		if mode == "link":
+			filename = f"step_{step}.{EXTENSIONS[fmt]}"
+			with open(os.path.join(thumbnails_dir, filename), "wb") as f:
+				f.write(data)
+			sources[step] = f"thumbnails/{filename}"
+		else:
+			sources[step] = f"data:{MIME_TYPES[fmt]};base64,{base64.b64encode(data).decode('utf-8')}"
+
+	def replace(match):
+		step = int(match.group(1) or match.group(2))
+		if step not in frames:
+			return match.group(0)
+		duplicate_of = frames[step][1]
+		if duplicate_of is not None:
+			if match.group(1):
+				return f'<p style="color:#888;font-style:italic;">Step {step}: no visible change from step {duplicate_of}.</p>'
+			step = duplicate_of
+		return match.group(0).replace(f"SCREENSHOT_STEP_{match.group(1) or match.group(2)}", sources[step])
+
+	return _PLACEHOLDER.sub(replace, html_output)
@@ -0,0 +1,172 @@
+import asyncio
+import contextvars
+import os
+import uuid
+from datetime import datetime
+
+from backend.events import current_job
+from backend.watchdog import CANCEL_MESSAGE, RunCancelledError
+
+MAX_CONCURRENT_TESTS = int(os.getenv("MAX_CONCURRENT_TESTS", "2"))
+MAX_QUEUED_TESTS = int(os.getenv("MAX_QUEUED_TESTS", "100"))
+MAX_JOB_HISTORY = int(os.getenv("MAX_JOB_HISTORY", "500"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+	"""Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobQueue:
+	"""Bounded in-process job queue drained by a fixed pool of async workers."""
+
+	def __init__(self, runner, concurrency=MAX_CONCURRENT_TESTS, max_queued=MAX_QUEUED_TESTS, max_history=MAX_JOB_HISTORY):
+		self.runner = runner
+		self.concurrency = max(1, concurrency)
+		self.max_history = max_history
+		self.jobs = {}
+		self._streams = {}
+		self._queue = asyncio.Queue(maxsize=max_queued)
+		self._workers = []
+		self._running = {}
+
+	async def start(self):
+		for i in range(self.concurrency):
+			self._workers.append(asyncio.create_task(self._worker(i)))
+
+	async def stop(self):
+		for worker in self._workers:
+			worker.cancel()
+		await asyncio.gather(*self._workers, return_exceptions=True)
+		self._workers = []
+
+	def submit(self, task, **options):
+		"""Queue a run of `task` and return its job record without waiting for it."""
+		job = {
+			"id": uuid.uuid4().hex[:12],
+			"task": task,
+			"options": options,
+			"status": QUEUED,
+			"created_at": datetime.now().isoformat(),
+			"started_at": None,
+			"finished_at": None,
+			"result": None,
+			"error": None,
+		}
+		try:
+			self._queue.put_nowait(job["id"])
+		except asyncio.QueueFull:
+			raise QueueFullError(f"Test queue is full ({self._queue.maxsize} pending)")
+		self.jobs[job["id"]] = job
+		self._streams[job["id"]] = {"chunks": [], "updated": asyncio.Event()}
+		self._prune()
+		return job
+
+	def get(self, job_id):
+		return self.jobs.get(job_id)
+
+	def cancel(self, job_id):
+		"""Cancel a queued or running job. Returns False if it has already finished."""
+		job = self.jobs[job_id]
+		if job["status"] == QUEUED:
+			# Its queue entry is skipped when a worker gets to it
+			job["status"] = CANCELLED
+			job["error"] = "cancelled"
+			job["finished_at"] = datetime.now().isoformat()
+			self._notify(job_id)
+			return True
+		task = self._running.get(job_id)
+		if task is None or task.done():
+			return False
+		task.cancel(CANCEL_MESSAGE)
+		return True
+
+	def list(self, status=None, task=None, limit=50, offset=0):
+		jobs = [
+			job for job in reversed(self.jobs.values())
+			if (status is None or job["status"] == status) and (task is None or job["task"] == task)
+		]
+		return {"total": len(jobs), "items": jobs[offset:offset + limit]}
+
+	async def stream(self, job_id):
+		"""Yield the job's streamed report output, replaying what was already sent, until it finishes."""
+		sent = 0
+		while True:
+			stream = self._streams.get(job_id)
+			if stream is None:
+				return
+			while sent < len(stream["chunks"]):
+				yield stream["chunks"][sent]
+				sent += 1
+			if self.jobs[job_id]["status"] in FINISHED:
+				return
+			await stream["updated"].wait()
+
+	def _notify(self, job_id):
+		stream = self._streams.get(job_id)
+		if stream is not None:
+			updated, stream["updated"] = stream["updated"], asyncio.Event()
+			updated.set()
+
+	def _append_output(self, job_id, token):
+		stream = self._streams.get(job_id)
+		if stream is not None:
+			stream["chunks"].append(token)
+			self._notify(job_id)
+
+	def stats(self):
+		counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+		for job in self.jobs.values():
+			counts[job["status"]] += 1
+		return {"concurrency": self.concurrency, "capacity": self._queue.maxsize, **counts}
+
+	def _prune(self):
+		# Drop the oldest finished jobs so memory stays bounded on long-lived workers
+		finished = [job_id for job_id, job in self.jobs.items() if job["status"] in FINISHED]
+		for job_id in finished[:max(0, len(self.jobs) - self.max_history)]:
+			del self.jobs[job_id]
+			self._streams.pop(job_id, None)
+
+	async def _worker(self, worker_id):
+		while True:
+			job_id = await self._queue.get()
+			job = self.jobs.get(job_id)
+			if job is None or job["status"] != QUEUED:
+				self._queue.task_done()
+				continue
+			job["status"] = RUNNING
+			job["started_at"] = datetime.now().isoformat()
+			# Its own task, so cancelling the job doesn't stop the worker; the task (and its run events) knows its job
+			job_context = contextvars.copy_context()
+			job_context.run(current_job.set, job_id)
+			self._running[job_id] = asyncio.create_task(self.runner(
+				job["task"],
+				on_token=lambda token: self._append_output(job_id, token),
+				**job["options"],
+			), context=job_context)
+			try:
+				job["result"] = await self._running[job_id]
+				job["status"] = DONE
+			except asyncio.CancelledError:
+				job["status"] = FAILED if asyncio.current_task().cancelling() else CANCELLED
+				job["error"] = "cancelled"
+				if job["status"] == FAILED:
+					raise
+			except RunCancelledError:
+				job["status"] = CANCELLED
+				job["error"] = "cancelled"
+			except Exception as e:
+				print(f"Job {job_id} ({job['task']}) failed on worker {worker_id}: {e}")
+				job["status"] = FAILED
+				job["error"] = str(e)
+			finally:
+				self._running.pop(job_id, None)
+				job["finished_at"] = datetime.now().isoformat()
+				self._notify(job_id)
+				self._queue.task_done()
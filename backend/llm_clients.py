@@ -0,0 +1,65 @@
+import os
+
+from backend.metrics import instrument_llm
+
+# openai, httpx and browser_use are imported on first use: they dominate startup time
+
+AGENT_MODEL = "seed-1-8-251228"
+AGENT_BASE_URL = os.getenv("AGENT_BASE_URL", "https://ark.ap-southeast.bytepluses.com/api/v3")
+
+REPORT_MODEL = "google/gemini-3-flash-preview"
+REPORT_BASE_URL = os.getenv("REPORT_BASE_URL", "https://openrouter.ai/api/v1")
+REPORT_TIMEOUT = float(os.getenv("REPORT_TIMEOUT", "120"))
+REPORT_MAX_RETRIES = int(os.getenv("REPORT_MAX_RETRIES", "3"))
+REPORT_MAX_CONNECTIONS = int(os.getenv("REPORT_MAX_CONNECTIONS", "20"))
+
+_report_client = None
+
+
+def create_agent_llm(vision=None):
+	"""Return a new instrumented chat model for the vision agent.
+
+	`vision` is the run's VisionFilter, applied to every request's screenshots.
+	"""
+	from browser_use.llm.openai.chat import ChatOpenAI
+
+	llm = ChatOpenAI(
+		api_key=os.getenv("BYTEDANCE_API_KEY"),
+		base_url=AGENT_BASE_URL,
+		model=AGENT_MODEL,
+	)
+	instrument_llm(llm, "agent", vision)
+	return llm
+
+
+def get_report_client():
+	"""Return the shared async report LLM client, creating it on first use.
+
+	The client keeps a pooled HTTP connection to OpenRouter across runs and
+	retries failed requests with exponential backoff (honouring Retry-After).
+	"""
+	global _report_client
+	if _report_client is None:
+		import httpx
+		from openai import AsyncOpenAI
+
+		_report_client = AsyncOpenAI(
+			base_url=REPORT_BASE_URL,
+			api_key=os.getenv("OPENROUTER_API_KEY"),
+			timeout=httpx.Timeout(REPORT_TIMEOUT, connect=10.0),
+			max_retries=REPORT_MAX_RETRIES,
+			http_client=httpx.AsyncClient(
+				limits=httpx.Limits(
+					max_connections=REPORT_MAX_CONNECTIONS,
+					max_keepalive_connections=REPORT_MAX_CONNECTIONS,
+				),
+			),
+		)
+	return _report_client
+
+
+async def close_report_client():
+	global _report_client
+	if _report_client is not None:
+		await _report_client.close()
+		_report_client = None
@@ -1,10 +1,71 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+from backend.ai import main as run_ai, run_matrix, MATRIX_BATCH_REPORT, MATRIX_CONCURRENCY, VISUAL_SKIP_UNCHANGED
+from backend.failure_clusters import FAILURE_DEDUPE
+from backend.browser_pool import browser_pool
+from backend.events import event_bus, sse_format
+from backend.images import MIME_TYPES, REPORT_IMAGE_FORMAT, encode_file, shutdown_image_pool
+from backend.jobs import JobQueue, QueueFullError
+from backend.llm_clients import close_report_client
+from backend import metrics
+from backend.report_cache import report_cache
+from backend.run_store import run_store, is_resumable, RESUMABLE_STATUSES
+from backend.scenarios import TASKS, DEVICE_PROFILES, DEFAULT_DEVICE
+from backend.slack import slack_outbox
+from backend.warmup import WARMUP_ON_STARTUP, warmup
+from backend.watchdog import RUN_DEADLINE_SECONDS, active_runs, watchdog
+
+MATRIX_TASK = "matrix"
+THUMBNAIL_SIZE = (160, 320)
+SSE_KEEPALIVE_SECONDS = 15
+STARTED_AT = time.monotonic()
+
+
+async def run_job(task, on_token=None, **options):
+    if task == MATRIX_TASK:
+        return await run_matrix(**options)
+    return await run_ai(task, on_token=on_token, **options)
+
+
+jobs = JobQueue(run_job)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    interrupted = run_store.mark_interrupted()
+    if interrupted:
+        print(f"Marked {interrupted} unfinished run(s) as interrupted, resume them with POST /api/tests/{{id}}/resume")
+    await slack_outbox.start()
+    await jobs.start()
+    await watchdog.start()
+    # Warm up in the background so the API accepts requests (and health checks) right away
+    warming = asyncio.create_task(warmup.run()) if WARMUP_ON_STARTUP else None
+    yield
+    if warming:
+        warming.cancel()
+        await asyncio.gather(warming, return_exceptions=True)
+    await jobs.stop()
+    await slack_outbox.stop()
+    await watchdog.stop()
+    await browser_pool.close()
+    # Anything browser_pool.close() couldn't shut down is killed here rather than outliving the worker
+    await watchdog.reap()
+    await close_report_client()
+    shutdown_image_pool()
+    run_store.close()
 
-from backend.ai import main as run_ai
-from backend.agents import TASKS
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:8001"],
@@ -13,10 +74,316 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class TestConfig(BaseModel):
+    scenario: str
+    device: str = DEFAULT_DEVICE
+    use_cache: bool = True
+    use_replay: bool = True
+    skip_unchanged: bool = VISUAL_SKIP_UNCHANGED
+    dedupe_failures: bool = FAILURE_DEDUPE
+    deadline_seconds: float = RUN_DEADLINE_SECONDS
+    name: Optional[str] = None
+    url: Optional[str] = None
+
+
+class MatrixConfig(BaseModel):
+    tasks: Optional[List[str]] = None
+    devices: Optional[List[str]] = None
+    concurrency: int = MATRIX_CONCURRENCY
+    use_cache: bool = True
+    use_replay: bool = True
+    batch_report: bool = MATRIX_BATCH_REPORT
+    dedupe_failures: bool = FAILURE_DEDUPE
+    deadline_seconds: float = RUN_DEADLINE_SECONDS
+
+
+def invalid_task_error():
+    return JSONResponse(
+        status_code=400,
+        content={"error": f"Invalid task type. Choose from: {', '.join(TASKS.keys())}"},
+    )
+
+
+def invalid_device_error():
+    return JSONResponse(
+        status_code=400,
+        content={"error": f"Invalid device. Choose from: {', '.join(DEVICE_PROFILES.keys())}"},
+    )
+
+
+# Job options that only make sense for the job that was submitted with them, dropped on a rerun
+ONE_SHOT_OPTIONS = ("resume",)
+
+
+def submit(task, **options):
+    try:
+        return jobs.submit(task, **options)
+    except QueueFullError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
+
+
 @app.get("/api/test/{task_type}")
-async def test(task_type: str):
+async def test(
+    task_type: str,
+    device: str = DEFAULT_DEVICE,
+    use_cache: bool = True,
+    use_replay: bool = True,
+    skip_unchanged: bool = VISUAL_SKIP_UNCHANGED,
+    dedupe_failures: bool = FAILURE_DEDUPE,
+    deadline_seconds: float = RUN_DEADLINE_SECONDS,
+):
     if task_type not in TASKS:
-        return {"error": f"Invalid task type. Choose from: {', '.join(TASKS.keys())}"}
+        return invalid_task_error()
+    if device not in DEVICE_PROFILES:
+        return invalid_device_error()
+
+    return submit(
+        task_type,
+        device=device,
+        use_cache=use_cache,
+        use_replay=use_replay,
+        skip_unchanged=skip_unchanged,
+        dedupe_failures=dedupe_failures,
+        deadline=deadline_seconds,
+    )
+
+
+@app.post("/api/tests")
+async def start_test(config: TestConfig):
+    if config.scenario not in TASKS:
+        return invalid_task_error()
+    if config.device not in DEVICE_PROFILES:
+        return invalid_device_error()
+
+    return submit(
+        config.scenario,
+        device=config.device,
+        use_cache=config.use_cache,
+        use_replay=config.use_replay,
+        skip_unchanged=config.skip_unchanged,
+        dedupe_failures=config.dedupe_failures,
+        deadline=config.deadline_seconds,
+    )
+
+
+@app.post("/api/tests/matrix")
+async def start_matrix(config: MatrixConfig):
+    if any(task not in TASKS for task in config.tasks or []):
+        return invalid_task_error()
+    if any(device not in DEVICE_PROFILES for device in config.devices or []):
+        return invalid_device_error()
+
+    return submit(
+        MATRIX_TASK,
+        tasks=config.tasks,
+        devices=config.devices,
+        concurrency=config.concurrency,
+        use_cache=config.use_cache,
+        use_replay=config.use_replay,
+        batch_report=config.batch_report,
+        dedupe_failures=config.dedupe_failures,
+        deadline=config.deadline_seconds,
+    )
+
+
+@app.get("/api/tests")
+async def list_tests(
+    task: Optional[str] = None,
+    device: Optional[str] = None,
+    status: Optional[str] = None,
+    report_state: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    has_errors: Optional[bool] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    return run_store.list_runs(
+        task=task,
+        device=device,
+        status=status,
+        report_state=report_state,
+        since=since,
+        until=until,
+        has_errors=has_errors,
+        limit=limit,
+        offset=offset,
+    )
+
+
+@app.get("/api/failures")
+async def list_failures(task: Optional[str] = None):
+    """Known failure clusters, most recently seen first."""
+    clusters = run_store.list_failure_clusters(task=task)
+    return {"items": [{key: value for key, value in cluster.items() if key != "signature"} for cluster in clusters]}
+
+
+@app.get("/api/jobs")
+async def list_jobs(status: Optional[str] = None, task: Optional[str] = None, limit: int = 50, offset: int = 0):
+    return jobs.list(status=status, task=task, limit=limit, offset=offset)
+
+
+@app.get("/api/tests/{test_id}")
+async def get_test(test_id: str):
+    test = jobs.get(test_id) or run_store.get_run(test_id)
+    if test is None:
+        return JSONResponse(status_code=404, content={"error": f"Test {test_id} not found"})
+    return test
+
+
+@app.post("/api/tests/{test_id}/rerun")
+async def rerun_test(test_id: str):
+    job = jobs.get(test_id)
+    if job is not None:
+        # A rerun starts a fresh run; it doesn't resume the run its job resumed
+        options = {name: value for name, value in job["options"].items() if name not in ONE_SHOT_OPTIONS}
+        return submit(job["task"], **options)
+    run = run_store.get_run(test_id)
+    if run is not None:
+        return submit(run["task"], device=run["device"])
+    return JSONResponse(status_code=404, content={"error": f"Test {test_id} not found"})
+
+
+@app.post("/api/tests/{test_id}/cancel")
+async def cancel_test(test_id: str):
+    """Cancel a queued or running job, or a single run in progress (e.g. one run of a matrix)."""
+    job = jobs.get(test_id)
+    if job is not None:
+        if not jobs.cancel(test_id):
+            return JSONResponse(status_code=409, content={"error": f"Job {test_id} is already {job['status']}"})
+        return jobs.get(test_id)
+    if active_runs.cancel(test_id):
+        return {"id": test_id, "status": "cancelling"}
+    run = run_store.get_run(test_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"error": f"Test {test_id} not found"})
+    return JSONResponse(status_code=409, content={"error": f"Run {test_id} is {run['status']} and not running here"})
+
+
+@app.post("/api/tests/{run_id}/resume")
+async def resume_test(run_id: str):
+    run = run_store.get_run(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"error": f"Run {run_id} not found"})
+    if not is_resumable(run):
+        state = "still running" if run["status"] == "running" else run["status"]
+        return JSONResponse(status_code=409, content={"error": f"Run {run_id} is {state} and cannot be resumed"})
+    return submit(run["task"], device=run["device"], resume=run_id)
+
+
+@app.post("/api/tests/{run_id}/baseline")
+async def bless_baseline(run_id: str):
+    run = run_store.get_run(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"error": f"Run {run_id} not found"})
+    if run["status"] in RESUMABLE_STATUSES:
+        return JSONResponse(status_code=409, content={"error": f"Run {run_id} is {run['status']} and cannot be a baseline"})
+    run_store.set_baseline(run["task"], run["device"], run_id)
+    return {"task": run["task"], "device": run["device"], "run_id": run_id}
+
+
+@app.get("/api/tests/{run_id}/visual-diff")
+async def visual_diff(run_id: str):
+    run = run_store.get_run(run_id)
+    path = f"{run['output_dir']}/visual_diff/summary.json" if run else None
+    if path is None or not os.path.exists(path):
+        return JSONResponse(status_code=404, content={"error": f"No visual diff for run {run_id}"})
+    with open(path) as f:
+        return json.load(f)
+
+
+@app.get("/api/tests/{job_id}/report/stream")
+async def stream_report(job_id: str):
+    if jobs.get(job_id) is None:
+        return JSONResponse(status_code=404, content={"error": f"Test {job_id} not found"})
+    return StreamingResponse(jobs.stream(job_id), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/api/tests/{run_id}/steps/{step}/thumbnail")
+async def step_thumbnail(run_id: str, step: int):
+    run = run_store.get_run(run_id)
+    path = f"{run['output_dir']}/screenshots/step_{step}.png" if run else None
+    if path is None or not os.path.exists(path):
+        return JSONResponse(status_code=404, content={"error": f"No screenshot for step {step} of run {run_id}"})
+    data = await encode_file(path, max_size=THUMBNAIL_SIZE)
+    return Response(content=data, media_type=MIME_TYPES[REPORT_IMAGE_FORMAT], headers={"Cache-Control": "max-age=86400"})
+
+
+@app.get("/api/events")
+async def stream_events(run_id: Optional[str] = None, job_id: Optional[str] = None):
+    """Server-Sent Events feed of test_started / test_progress / issue_found / test_completed."""
+    subscription = event_bus.subscribe(run_id, job_id=job_id)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_format(event)
+        finally:
+            subscription.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.websocket("/ws/events")
+async def websocket_events(websocket: WebSocket, run_id: Optional[str] = None, job_id: Optional[str] = None):
+    await websocket.accept()
+    subscription = event_bus.subscribe(run_id, job_id=job_id)
+
+    async def forward():
+        async for event in subscription:
+            await websocket.send_json(event)
+
+    # Forward events in the background and watch the socket, so an idle client's disconnect is noticed
+    sender = asyncio.create_task(forward())
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        subscription.close()
+
+
+@app.get("/api/health")
+async def health():
+    """Liveness and warm-up state; never loads or starts anything itself."""
+    return {
+        "status": "ok",
+        "uptime_seconds": round(time.monotonic() - STARTED_AT, 1),
+        **warmup.status(),
+    }
+
+
+@app.post("/api/warmup")
+async def warm_up():
+    """Import the run dependencies, create the LLM and Slack clients and launch the browser pool.
+
+    Idempotent: returns immediately once everything is warm, and waits for a
+    warm-up already in progress instead of starting a second one.
+    """
+    status = await warmup.run()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/api/stats")
+async def stats():
+    return {
+        "jobs": jobs.stats(),
+        "browser_pool": browser_pool.stats(),
+        "report_cache": report_cache.stats(),
+        "slack": slack_outbox.stats(),
+        "events": event_bus.stats(),
+        "watchdog": await asyncio.to_thread(watchdog.stats),
+    }
+
 
-    result = await run_ai(task_type)
-    return result
\ No newline at end of file
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render(jobs.stats(), browser_pool.stats())
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Optional JSON-lines file that every span is appended to, for offline analysis
+METRICS_SPAN_FILE = os.getenv("METRICS_SPAN_FILE")
+
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+PHASE_SECONDS = Histogram(
+	"mystery_shopper_phase_seconds",
+	"Wall time of each pipeline phase",
+	["phase"],
+	buckets=PHASE_BUCKETS,
+)
+PHASE_ERRORS = Counter(
+	"mystery_shopper_phase_errors_total",
+	"Pipeline phases that raised",
+	["phase"],
+)
+LLM_REQUEST_SECONDS = Histogram(
+	"mystery_shopper_llm_request_seconds",
+	"Latency of each LLM call",
+	["purpose", "model"],
+	buckets=PHASE_BUCKETS,
+)
+LLM_TOKENS = Counter(
+	"mystery_shopper_llm_tokens_total",
+	"Tokens used by LLM calls",
+	["purpose", "model", "kind"],
+)
+LLM_IMAGE_TOKENS_SAVED = Counter(
+	"mystery_shopper_llm_image_tokens_saved_total",
+	"Image tokens avoided by downscaling and cropping screenshots before an LLM call",
+	["purpose", "model"],
+)
+REPORT_PAYLOAD_TOKENS = Histogram(
+	"mystery_shopper_report_payload_tokens",
+	"Estimated tokens of test data sent to the report LLM per run",
+	buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+RUNS = Counter(
+	"mystery_shopper_runs_total",
+	"Completed test runs by verdict",
+	["task", "device", "state"],
+)
+REPORT_CACHE_LOOKUPS = Counter(
+	"mystery_shopper_report_cache_lookups_total",
+	"Report cache lookups",
+	["result"],
+)
+FAILURE_CLUSTER_LOOKUPS = Counter(
+	"mystery_shopper_failure_cluster_lookups_total",
+	"Reported failures by whether they started a new failure cluster or repeated a known one",
+	["result"],
+)
+RUNS_STOPPED = Counter(
+	"mystery_shopper_runs_stopped_total",
+	"Browser runs that didn't finish, by why: timed_out, cancelled or interrupted",
+	["status"],
+)
+BROWSERS_REAPED = Counter(
+	"mystery_shopper_browsers_reaped_total",
+	"Leaked browser processes killed by the watchdog",
+	["reason"],
+)
+JOBS = Gauge("mystery_shopper_jobs", "Jobs in the test queue by status", ["status"])
+BROWSERS = Gauge("mystery_shopper_browsers", "Pooled browsers by state", ["state"])
+
+_span_lock = threading.Lock()
+
+
+def _export_span(phase, started_at, duration, attributes, error):
+	if not METRICS_SPAN_FILE:
+		return
+	record = {"phase": phase, "start": started_at, "duration": duration, "error": error, **attributes}
+	with _span_lock:
+		with open(METRICS_SPAN_FILE, "a") as f:
+			f.write(json.dumps(record, default=str) + "\n")
+
+
+def observe_phase(phase, seconds, **attributes):
+	"""Record a phase duration that was measured elsewhere (e.g. by browser-use)."""
+	PHASE_SECONDS.labels(phase).observe(seconds)
+	_export_span(phase, time.time() - seconds, seconds, attributes, None)
+
+
+@contextmanager
+def span(phase, **attributes):
+	"""Time the enclosed block as `phase`; callers may add attributes to the yielded dict."""
+	started_at = time.time()
+	start = time.perf_counter()
+	error = None
+	try:
+		yield attributes
+	except BaseException as e:
+		error = type(e).__name__
+		PHASE_ERRORS.labels(phase).inc()
+		raise
+	finally:
+		duration = time.perf_counter() - start
+		PHASE_SECONDS.labels(phase).observe(duration)
+		_export_span(phase, started_at, duration, attributes, error)
+
+
+def record_llm_call(purpose, model, seconds, usage=None, image_tokens=None, image_tokens_full=None):
+	"""Record one LLM call's latency and, when the provider reports it, its token usage.
+
+	`image_tokens` is our own estimate, used when the provider does not report
+	image tokens; `image_tokens_full` is what the images would have cost
+	before they were downscaled or cropped.
+	"""
+	LLM_REQUEST_SECONDS.labels(purpose, model).observe(seconds)
+	attributes = {"purpose": purpose, "model": model}
+	counts = {kind: getattr(usage, kind, None) for kind in ("prompt_tokens", "completion_tokens", "prompt_image_tokens")}
+	counts["prompt_image_tokens"] = counts["prompt_image_tokens"] or image_tokens
+	for kind, value in counts.items():
+		if value:
+			LLM_TOKENS.labels(purpose, model, kind.replace("_tokens", "")).inc(value)
+			attributes[kind] = value
+	if image_tokens_full:
+		LLM_IMAGE_TOKENS_SAVED.labels(purpose, model).inc(max(0, image_tokens_full - (counts["prompt_image_tokens"] or 0)))
+		attributes["prompt_image_tokens_full"] = image_tokens_full
+	_export_span("llm_call", time.time() - seconds, seconds, attributes, None)
+
+
+def instrument_llm(llm, purpose, vision=None):
+	"""Wrap a browser-use chat model's ainvoke to record latency and tokens per call.
+
+	With a `vision` filter (backend.vision.VisionFilter) the request's images
+	are shrunk before the call and their token counts recorded with it.
+	"""
+	original_ainvoke = llm.ainvoke
+
+	async def timed_ainvoke(messages, output_format=None, **kwargs):
+		image_tokens = image_tokens_full = None
+		if vision is not None:
+			messages, image_tokens, image_tokens_full = await vision.prepare(messages)
+		start = time.perf_counter()
+		result = await original_ainvoke(messages, output_format, **kwargs)
+		record_llm_call(purpose, llm.model, time.perf_counter() - start, result.usage, image_tokens, image_tokens_full)
+		return result
+
+	# Same runtime patch browser-use applies for its own token accounting
+	object.__setattr__(llm, "ainvoke", timed_ainvoke)
+	return llm
+
+
+def render(job_stats=None, pool_stats=None):
+	"""Return (body, content_type) for the Prometheus scrape endpoint."""
+	if job_stats:
+		for status in ("queued", "running", "done", "failed", "cancelled"):
+			JOBS.labels(status).set(job_stats.get(status, 0))
+	if pool_stats:
+		BROWSERS.labels("in_use").set(pool_stats["in_use"])
+		BROWSERS.labels("idle").set(sum(pool_stats["idle"].values()))
+	return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,284 @@
+import asyncio
+import html
+import os
+
+# Capture Web Vitals, long tasks, JS heap and request timings of the target page after every step
+PERF_CAPTURE = os.getenv("PERF_CAPTURE", "1").lower() in ("1", "true", "yes")
+# Entries the page buffers per kind between two samples; when full the oldest are dropped
+PERF_BUFFER_SIZE = int(os.getenv("PERF_BUFFER_SIZE", "200"))
+# Slowest requests kept per step
+PERF_MAX_REQUESTS = int(os.getenv("PERF_MAX_REQUESTS", "5"))
+# A sample that takes longer is skipped; a slow page must not stall the run
+PERF_TIMEOUT = float(os.getenv("PERF_TIMEOUT", "2"))
+
+# (needs improvement above, poor above), as published for Core Web Vitals
+THRESHOLDS = {
+	"lcp_ms": (2500, 4000),
+	"cls": (0.1, 0.25),
+	"inp_ms": (200, 500),
+}
+LONG_TASK_MS = 50
+
+# Installed before any page script runs; everything is observed with buffered: true,
+# so the script also catches up on entries from before it was evaluated
+OBSERVER_JS = """(() => {
+	if (window.__mysteryShopperPerf) return;
+	const max = %d;
+	const perf = window.__mysteryShopperPerf = {lcp: null, cls: 0, longTasks: [], interactions: [], resources: [], dropped: 0, navigationSent: false};
+	const push = (list, item) => {
+		list.push(item);
+		if (list.length > max) { list.shift(); perf.dropped++; }
+	};
+	const observe = (type, handle, options) => {
+		try {
+			new PerformanceObserver(list => list.getEntries().forEach(handle)).observe({type, buffered: true, ...options});
+		} catch (e) {}
+	};
+	observe('largest-contentful-paint', e => { perf.lcp = e.startTime; });
+	observe('layout-shift', e => { if (!e.hadRecentInput) perf.cls += e.value; });
+	observe('longtask', e => push(perf.longTasks, e.duration));
+	observe('event', e => { if (e.interactionId) push(perf.interactions, e.duration); }, {durationThreshold: 16});
+	observe('resource', e => push(perf.resources, {
+		url: e.name,
+		type: e.initiatorType,
+		duration: e.duration,
+		ttfb: e.responseStart > 0 ? e.responseStart - e.requestStart : null,
+		size: e.transferSize,
+		status: e.responseStatus || null,
+	}));
+})();"""
+
+# Drains what the page buffered since the previous sample
+READ_JS = """(() => {
+	const perf = window.__mysteryShopperPerf;
+	if (!perf) return null;
+	const nav = performance.getEntriesByType('navigation')[0];
+	const sample = {
+		url: location.href,
+		lcp: perf.lcp,
+		cls: perf.cls,
+		longTasks: perf.longTasks.splice(0),
+		interactions: perf.interactions.splice(0),
+		resources: perf.resources.splice(0),
+		dropped: perf.dropped,
+		navigation: nav && !perf.navigationSent && nav.loadEventEnd > 0
+			? {ttfb: nav.responseStart, dom_content_loaded: nav.domContentLoadedEventEnd, load: nav.loadEventEnd, size: nav.transferSize}
+			: null,
+	};
+	perf.dropped = 0;
+	if (sample.navigation) perf.navigationSent = true;
+	return sample;
+})()"""
+
+
+def _ms(value):
+	return None if value is None else round(value)
+
+
+def rate(metric, value):
+	"""Rate a Web Vital as "good", "needs improvement" or "poor" (None if it wasn't measured)."""
+	if value is None or metric not in THRESHOLDS:
+		return None
+	improve, poor = THRESHOLDS[metric]
+	return "poor" if value > poor else "needs improvement" if value > improve else "good"
+
+
+def summarize_sample(raw, heap_bytes=None, max_requests=PERF_MAX_REQUESTS):
+	"""Turn one raw in-page sample into the per-step record stored with the run."""
+	resources = raw.get("resources") or []
+	long_tasks = raw.get("longTasks") or []
+	interactions = raw.get("interactions") or []
+	slowest = sorted(resources, key=lambda r: r.get("duration") or 0, reverse=True)[:max_requests]
+	return {
+		"url": raw.get("url"),
+		"lcp_ms": _ms(raw.get("lcp")),
+		"cls": round(raw.get("cls") or 0, 4),
+		"inp_ms": _ms(max(interactions)) if interactions else None,
+		"long_tasks": len(long_tasks),
+		"long_task_ms": _ms(sum(long_tasks)),
+		"blocking_ms": _ms(sum(max(0, duration - LONG_TASK_MS) for duration in long_tasks)),
+		"heap_mb": round(heap_bytes / 2**20, 1) if heap_bytes else None,
+		"requests": len(resources),
+		"request_bytes": sum(r.get("size") or 0 for r in resources),
+		"slowest_requests": [
+			{
+				"url": (r.get("url") or "")[:200],
+				"type": r.get("type"),
+				"ms": _ms(r.get("duration")),
+				"ttfb_ms": _ms(r.get("ttfb")),
+				"bytes": r.get("size"),
+				"status": r.get("status"),
+			}
+			for r in slowest
+		],
+		"navigation": {key: _ms(value) for key, value in raw["navigation"].items()} if raw.get("navigation") else None,
+		"dropped": raw.get("dropped") or 0,
+	}
+
+
+def summarize_run(samples):
+	"""Worst Web Vitals, peak heap and request totals over a run's step records, or None."""
+	samples = [perf for perf in samples if perf]
+	if not samples:
+		return None
+
+	def worst(key):
+		values = [perf[key] for perf in samples if perf.get(key) is not None]
+		return max(values) if values else None
+
+	return {
+		"lcp_ms": worst("lcp_ms"),
+		"cls": worst("cls"),
+		"inp_ms": worst("inp_ms"),
+		"long_tasks": sum(perf["long_tasks"] for perf in samples),
+		"long_task_ms": sum(perf["long_task_ms"] or 0 for perf in samples),
+		"heap_mb": worst("heap_mb"),
+		"requests": sum(perf["requests"] for perf in samples),
+		"request_bytes": sum(perf["request_bytes"] for perf in samples),
+	}
+
+
+class PagePerformance:
+	"""Samples the target page's performance over CDP after every step of one run.
+
+	An observer script installed on each page target buffers LCP, layout
+	shifts, long tasks, interaction latencies and resource timings in bounded
+	in-page ring buffers of PERF_BUFFER_SIZE entries; sample() drains them and
+	adds the JS heap size from Performance.getMetrics, so each step gets what
+	happened since the previous one, however long the step took. close()
+	removes the script again, so a pooled browser goes back to the next run
+	unchanged.
+	"""
+
+	def __init__(self, browser_session, buffer_size=PERF_BUFFER_SIZE):
+		self.browser_session = browser_session
+		self.observer_js = OBSERVER_JS % max(1, buffer_size)
+		self._installed = {}
+
+	async def _install(self, cdp_session):
+		send, session_id = cdp_session.cdp_client.send, cdp_session.session_id
+		await send.Performance.enable(session_id=session_id)
+		added = await send.Page.addScriptToEvaluateOnNewDocument(params={"source": self.observer_js}, session_id=session_id)
+		self._installed[session_id] = (cdp_session, added.get("identifier"))
+		# The current document was loaded before the script existed
+		await send.Runtime.evaluate(params={"expression": self.observer_js}, session_id=session_id)
+
+	async def _sample(self):
+		cdp_session = await self.browser_session.get_or_create_cdp_session()
+		if cdp_session.session_id not in self._installed:
+			await self._install(cdp_session)
+		send, session_id = cdp_session.cdp_client.send, cdp_session.session_id
+		result = await send.Runtime.evaluate(params={"expression": READ_JS, "returnByValue": True}, session_id=session_id)
+		raw = result.get("result", {}).get("value")
+		if not raw:
+			return None
+		metrics = await send.Performance.getMetrics(session_id=session_id)
+		heap = next((m["value"] for m in metrics.get("metrics", []) if m["name"] == "JSHeapUsedSize"), None)
+		return summarize_sample(raw, heap)
+
+	async def sample(self):
+		"""Return the performance record for the step that just finished, or None if it couldn't be taken."""
+		try:
+			return await asyncio.wait_for(self._sample(), PERF_TIMEOUT)
+		except Exception as e:
+			print(f"Page performance sample skipped: {type(e).__name__}: {e}")
+			return None
+
+	async def close(self):
+		for session_id, (cdp_session, identifier) in self._installed.items():
+			try:
+				if identifier:
+					await cdp_session.cdp_client.send.Page.removeScriptToEvaluateOnNewDocument(
+						params={"identifier": identifier}, session_id=session_id,
+					)
+			except Exception as e:
+				print(f"Could not remove the performance observer from a page: {e}")
+		self._installed.clear()
+
+
+def _seconds(ms):
+	return f"{ms / 1000:.2f}s" if ms >= 1000 else f"{ms}ms"
+
+
+def _rated(metric, label, value, text):
+	rating = rate(metric, value)
+	return f"{label} {text}" + (f" ({rating})" if rating and rating != "good" else "")
+
+
+def perf_text(perf, step_seconds=None):
+	"""One-line rendering of a step's performance record for the report LLM."""
+	parts = []
+	if perf.get("lcp_ms") is not None:
+		parts.append(_rated("lcp_ms", "LCP", perf["lcp_ms"], _seconds(perf["lcp_ms"])))
+	parts.append(_rated("cls", "CLS", perf.get("cls"), f"{perf.get('cls') or 0:.2f}"))
+	if perf.get("inp_ms") is not None:
+		parts.append(_rated("inp_ms", "INP", perf["inp_ms"], _seconds(perf["inp_ms"])))
+	if perf.get("long_tasks"):
+		parts.append(f"{perf['long_tasks']} long tasks {_seconds(perf['long_task_ms'])}")
+	if perf.get("heap_mb") is not None:
+		parts.append(f"heap {perf['heap_mb']}MB")
+	if perf.get("requests"):
+		parts.append(f"{perf['requests']} requests {perf['request_bytes'] / 2**10:.0f}KB")
+	if perf.get("slowest_requests"):
+		slowest = perf["slowest_requests"][0]
+		if slowest["ms"] is not None:
+			parts.append(f"slowest {slowest['url']} {_seconds(slowest['ms'])}")
+	if step_seconds is not None:
+		parts.append(f"agent step {step_seconds:.1f}s")
+	return ", ".join(parts)
+
+
+def is_slow(perf):
+	return any(rate(metric, perf.get(metric)) == "poor" for metric in THRESHOLDS)
+
+
+def perf_table_html(steps):
+	"""An HTML section with each step's page performance, or "" if none was captured."""
+	rows = []
+	for step in steps:
+		perf = step.get("perf")
+		if not perf:
+			continue
+		cells = []
+		for metric, text in (
+			("lcp_ms", _seconds(perf["lcp_ms"]) if perf.get("lcp_ms") is not None else "–"),
+			("cls", f"{perf.get('cls') or 0:.2f}"),
+			("inp_ms", _seconds(perf["inp_ms"]) if perf.get("inp_ms") is not None else "–"),
+		):
+			color = {"needs improvement": "#b58900", "poor": "#c0392b"}.get(rate(metric, perf.get(metric)), "inherit")
+			cells.append(f'<td style="color:{color};">{text}</td>')
+		slowest = perf["slowest_requests"][0] if perf.get("slowest_requests") else None
+		if slowest and slowest["ms"] is not None:
+			cells.append(f"<td>{html.escape(slowest['url'][-80:])} {_seconds(slowest['ms'])}</td>")
+		else:
+			cells.append("<td>–</td>")
+		duration = step.get("duration_seconds")
+		rows.append(
+			f"<tr><td>{step['step_index']}</td>{''.join(cells[:3])}"
+			f"<td>{_seconds(perf['long_task_ms'] or 0)}</td>"
+			f"<td>{perf['heap_mb'] if perf.get('heap_mb') is not None else '–'}</td>"
+			f"<td>{perf['requests']} ({perf['request_bytes'] / 2**10:.0f}KB)</td>"
+			f"{cells[3]}<td>{f'{duration:.1f}s' if duration is not None else '–'}</td></tr>"
+		)
+	if not rows:
+		return ""
+	header = "".join(
+		f'<th style="text-align:left;padding:4px;">{name}</th>'
+		for name in ("Step", "LCP", "CLS", "INP", "Long tasks", "Heap (MB)", "Requests", "Slowest request", "Agent step")
+	)
+	return (
+		'<h2>Page Performance</h2><p>Measured in the browser after each step, next to the time the test agent itself took. '
+		"Amber and red mark Web Vitals that need improvement or are poor.</p>"
+		f'<table style="border-collapse:collapse;font-size:13px;"><tr>{header}</tr>{"".join(rows)}</table>'
+	)
+
+
+def append_perf_section(html_output, steps):
+	"""Insert the page performance table before </body>."""
+	section = perf_table_html(steps)
+	if not section:
+		return html_output
+	body_end = html_output.rfind("</body>")
+	if body_end == -1:
+		return html_output + section
+	return html_output[:body_end] + section + html_output[body_end:]
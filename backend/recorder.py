@@ -0,0 +1,140 @@
+import base64
+import os
+
+from backend.blob_store import Manifest, blob_store
+from backend.events import ISSUE_FOUND, TEST_PROGRESS, event_bus
+from backend.metrics import observe_phase, span
+from backend.run_store import run_store
+
+
+def format_step(index, step, screenshot_path):
+	"""Render one history item in the result.txt step format."""
+	output = f"\n--- Step {index} ---\n"
+	output += f"url: {step.state.url}\n"
+	output += f"page_title: {step.state.title}\n"
+	output += f"tabs: {[{'url': t.url, 'title': t.title} for t in step.state.tabs]}\n"
+	if step.model_output:
+		output += f"thinking: {step.model_output.evaluation_previous_goal}\n"
+		output += f"next_goal: {step.model_output.next_goal}\n"
+	for r in step.result:
+		output += f"success: {r.success}\n"
+		output += f"error: {r.error}\n"
+		output += f"extracted_content: {r.extracted_content}\n"
+		output += f"is_done: {r.is_done}\n"
+	output += f"screenshot: {screenshot_path}\n"
+	if step.metadata:
+		output += f"duration_seconds: {step.metadata.duration_seconds}\n"
+	return output
+
+
+def step_record(step):
+	"""Flatten one history item into the columns stored by the run store."""
+	results = step.result or []
+	errors = [r.error for r in results if r.error]
+	extracted = [r.extracted_content for r in results if r.extracted_content]
+	return {
+		"url": step.state.url,
+		"title": step.state.title,
+		"action": [a.model_dump(exclude_none=True) for a in step.model_output.action] if step.model_output else None,
+		"evaluation": step.model_output.evaluation_previous_goal if step.model_output else None,
+		"next_goal": step.model_output.next_goal if step.model_output else None,
+		"success": all(r.success is not False for r in results) and not errors,
+		"error": "\n".join(errors) or None,
+		"extracted_content": "\n".join(extracted) or None,
+		"is_done": any(r.is_done for r in results),
+		"duration_seconds": step.metadata.duration_seconds if step.metadata else None,
+	}
+
+
+def _release_screenshot(state):
+	# Older browser-use versions keep the base64 screenshot on the state; newer
+	# ones keep a path. Dropping the inline copy keeps memory flat per run.
+	if getattr(state, "screenshot", None):
+		state.screenshot = None
+
+
+class StepRecorder:
+	"""Persists every step of a run to disk and the run store as soon as it finishes.
+
+	Each step's screenshot is stored in the shared blob store, linked as
+	screenshots/step_N.png and dropped from the in-memory history; its text
+	section is appended to steps.txt, its row is inserted into the run store
+	and a test_progress event is published. A run killed midway therefore
+	keeps everything up to its last finished step and can be resumed from
+	`next_index`. With the run's VisionFilter as `vision`, each step also
+	records the image tokens its LLM calls sent and would have sent unfiltered,
+	and with a PagePerformance as `perf`, the page's performance during it.
+	"""
+
+	def __init__(self, run_id, output_dir, start_index=0, vision=None):
+		self.run_id = run_id
+		self.vision = vision
+		self.perf = None
+		self.screenshots_dir = f"{output_dir}/screenshots"
+		self.steps_path = f"{output_dir}/steps.txt"
+		self.next_index = start_index
+		self._synced = 0
+		os.makedirs(self.screenshots_dir, exist_ok=True)
+		self.manifest = Manifest(self.screenshots_dir)
+
+	def record(self, step, screenshot_b64=None, perf=None):
+		index = self.next_index
+		screenshot_b64 = screenshot_b64 or step.state.get_screenshot()
+		screenshot_path = None
+		if screenshot_b64:
+			screenshot_path = os.path.abspath(f"{self.screenshots_dir}/step_{index}.png")
+			with span("screenshot_persist", run_id=self.run_id, step=index):
+				self.manifest.set(index, blob_store.link(base64.b64decode(screenshot_b64), screenshot_path))
+		_release_screenshot(step.state)
+
+		with open(self.steps_path, "a") as f:
+			f.write(format_step(index, step, screenshot_path))
+		record = step_record(step)
+		image_tokens, image_tokens_full = self.vision.take_usage() if self.vision else (0, 0)
+		run_store.add_step(
+			self.run_id, index, screenshot=screenshot_path,
+			image_tokens=image_tokens or None, image_tokens_full=image_tokens_full or None, perf=perf, **record,
+		)
+		self.next_index += 1
+
+		event_bus.publish(
+			TEST_PROGRESS,
+			self.run_id,
+			step=index,
+			url=record["url"],
+			title=record["title"],
+			next_goal=record["next_goal"],
+			success=record["success"],
+			thumbnail=f"/api/tests/{self.run_id}/steps/{index}/thumbnail" if screenshot_path else None,
+			perf={key: perf[key] for key in ("lcp_ms", "cls", "inp_ms", "long_task_ms", "heap_mb")} if perf else None,
+		)
+		if record["error"] or not record["success"]:
+			event_bus.publish(ISSUE_FOUND, self.run_id, step=index, url=record["url"], error=record["error"])
+
+	def follow(self):
+		"""Start syncing a new agent's history from its first item."""
+		self._synced = 0
+
+	def sync(self, history, perf=None):
+		"""Record every item of `history` not recorded yet; `perf` belongs to the latest one."""
+		pending = history.history[self._synced:]
+		for i, step in enumerate(pending):
+			if step.metadata:
+				observe_phase("agent_step", step.metadata.duration_seconds, run_id=self.run_id, step=self.next_index)
+			self.record(step, perf=perf if i == len(pending) - 1 else None)
+		self._synced = len(history.history)
+
+	async def _sample_perf(self):
+		return await self.perf.sample() if self.perf else None
+
+	async def on_step_end(self, agent):
+		self.sync(agent.history, await self._sample_perf())
+
+	async def on_replayed_step(self, step, screenshot_b64):
+		self.record(step, screenshot_b64, await self._sample_perf())
+
+	def steps_text(self):
+		if not os.path.exists(self.steps_path):
+			return ""
+		with open(self.steps_path) as f:
+			return f.read()
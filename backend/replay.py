@@ -0,0 +1,137 @@
+"""Recorded traces of successful runs, replayed on the next run without the LLM.
+
+Replay stops before the first step that needs a model: the recorded `done`,
+whose verdict is the agent's to give again, and `extract` actions, which read
+the page through the extraction LLM. The agent takes over from there, so
+extracted content always comes from this run's page, never from the recording.
+"""
+import os
+import time
+from urllib.parse import urlparse
+
+from browser_use.agent.views import AgentHistory, AgentHistoryList, StepMetadata
+from browser_use.browser.views import BrowserStateHistory
+
+from backend.metrics import span
+
+REPLAY_DIR = os.getenv("REPLAY_DIR", "results/replays")
+REPLAY_DISABLED = os.getenv("REPLAY_DISABLED", "").lower() in ("1", "true", "yes")
+# Actions that call the extraction LLM when executed
+LLM_ACTIONS = ("extract",)
+
+
+def trace_path(task, device):
+	return os.path.join(REPLAY_DIR, f"{task}_{device}.json")
+
+
+def save_trace(task, device, result):
+	"""Record a successful run's action history as the replay script for task/device."""
+	if not result or not result.is_successful():
+		return None
+	os.makedirs(REPLAY_DIR, exist_ok=True)
+	path = trace_path(task, device)
+	result.save_to_file(path)
+	return path
+
+
+def load_trace(task, device, agent):
+	"""Load the recorded trace for task/device using the agent's output model, or None."""
+	path = trace_path(task, device)
+	if REPLAY_DISABLED or not os.path.exists(path):
+		return None
+	try:
+		return AgentHistoryList.load_from_file(path, agent.AgentOutput)
+	except Exception as e:
+		print(f"Ignoring unreadable replay trace {path}: {e}")
+		return None
+
+
+def _actions(step):
+	return [action.model_dump(exclude_unset=True) for action in step.model_output.action] if step.model_output else []
+
+
+def _is_terminal(step):
+	"""A step that ended the recorded run: its verdict is the agent's to give again, not the recording's."""
+	return any("done" in action for action in _actions(step)) or any(r.is_done for r in step.result)
+
+
+def _needs_llm(step):
+	"""A step with an action that calls the LLM when executed, such as `extract`."""
+	return any(name in action for action in _actions(step) for name in LLM_ACTIONS)
+
+
+def _same_page(current, recorded):
+	"""Whether the page looks like the one the step was recorded on: same URL (with its #route) and title."""
+	url, title = current
+	now, then = urlparse(url or ""), urlparse(recorded.url or "")
+	return (
+		(now.scheme, now.netloc, now.path.rstrip("/"), now.fragment) == (then.scheme, then.netloc, then.path.rstrip("/"), then.fragment)
+		and (title or "") == (recorded.title or "")
+	)
+
+
+async def _page_snapshot(browser_session):
+	"""Return ((url, title), base64 PNG screenshot) of the current page via CDP."""
+	cdp_session = await browser_session.get_or_create_cdp_session()
+	send = cdp_session.cdp_client.send
+	location = await send.Runtime.evaluate(
+		params={"expression": "[location.href, document.title]", "returnByValue": True},
+		session_id=cdp_session.session_id,
+	)
+	screenshot = await send.Page.captureScreenshot(params={"format": "png"}, session_id=cdp_session.session_id)
+	url, title = location.get("result", {}).get("value") or (None, None)
+	return (url, title), screenshot.get("data")
+
+
+async def replay_trace(agent, trace, on_step=None):
+	"""Re-execute a recorded trace on the agent's browser without calling the LLM.
+
+	Each step is replayed only while the current page matches the page the
+	step was recorded on and its actions still resolve to the recorded
+	elements. The step that finished the recording (its `done`) is never
+	replayed: the agent takes over there and judges the final state itself.
+	It also takes over before a step that would call the LLM (LLM_ACTIONS).
+	Replay also stops after a step whose actions report an error.
+
+	Returns the replayed steps as new history items, holding the page state
+	they ran on and the results they returned this time, not the recorded
+	ones. Each is awaited with `on_step(item, screenshot)` as it finishes,
+	with a capture of the page taken before the step ran.
+	"""
+	replayed = []
+	for i, step in enumerate(trace.history):
+		if not step.model_output or _is_terminal(step):
+			break
+		if _needs_llm(step):
+			print(f"Replay stopped at step {i}: it extracts page content, the agent takes over")
+			break
+		page, screenshot = await _page_snapshot(agent.browser_session)
+		if not _same_page(page, step.state):
+			print(f"Replay diverged at step {i}: expected {step.state.url} ({step.state.title}), found {page[0]} ({page[1]})")
+			break
+		try:
+			tabs = await agent.browser_session.get_tabs()
+		except Exception:
+			tabs = []
+		started = time.time()
+		try:
+			# Agent.rerun_history() would also ask the LLM for a summary and close
+			# the agent after every call, so drive the per-step executor directly
+			with span("replay_step", step=i):
+				results = await agent._execute_history_step(step, 0)
+		except Exception as e:
+			print(f"Replay diverged at step {i}: {e}")
+			break
+		item = AgentHistory(
+			model_output=step.model_output,
+			result=results,
+			state=BrowserStateHistory(url=page[0], title=page[1] or "", tabs=tabs, interacted_element=step.state.interacted_element),
+			metadata=StepMetadata(step_start_time=started, step_end_time=time.time(), step_number=i + 1),
+		)
+		replayed.append(item)
+		if on_step:
+			await on_step(item, screenshot)
+		if any(r.error or r.success is False for r in results):
+			print(f"Replay stopped after step {i}: {next((r.error for r in results if r.error), 'action failed')}")
+			break
+	return replayed
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "results/.report_cache")
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "1000"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+REPORT_CACHE_MAX_AGE_DAYS = float(os.getenv("REPORT_CACHE_MAX_AGE_DAYS", "14"))
+REPORT_CACHE_DISABLED = os.getenv("REPORT_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# Bump when the reports generated from an unchanged run change (e.g. the payload format or post-processing)
+REPORT_CACHE_VERSION = 3
+
+# Values that change between otherwise identical runs
+_RESULT_DIR = re.compile(r"\S*results/[\w.-]+")
+_TIMESTAMP = re.compile(r"\d{4}-?\d{2}-?\d{2}[T _]\d{2}:?\d{2}:?\d{2}(?:[.,_]\d+)?(?:Z|[+-]\d{2}:?\d{2})?")
+_FLOAT_SECONDS = re.compile(r"(?<=[\"' ])\d+\.\d+(?= ?s(?:ec(?:ond)?s?)?\b)")
+
+
+def _normalize_text(text):
+	if not text:
+		return text
+	text = _RESULT_DIR.sub("<results>", text)
+	text = _TIMESTAMP.sub("<timestamp>", text)
+	return _FLOAT_SECONDS.sub("<seconds>", text).strip()
+
+
+def normalize_run(run):
+	"""The parts of a run record that decide its report: what happened, not how long it took.
+
+	Durations, page performance, output paths and the agent's narration
+	differ on every run and are left out, so two runs of a scenario that end
+	the same way normalize identically.
+	"""
+	return {
+		"task": run["task"],
+		"device": run["device"],
+		"is_done": run["is_done"],
+		"is_successful": run["is_successful"],
+		"error": _normalize_text(run["error"]),
+		"final_result": _normalize_text(run["final_result"]),
+		"steps": [
+			[
+				step["url"], step["title"],
+				_normalize_text(json.dumps(step["action"], sort_keys=True, default=str)), _normalize_text(step["error"]),
+			]
+			for step in run["steps"]
+		],
+	}
+
+
+class ReportCache:
+	"""Persistent content-addressed cache of generated reports.
+
+	Entries are JSON files named by the SHA-256 of the model, the system
+	prompts and the normalized run (see normalize_run), so repeated runs of
+	a scenario that end the same way share a report.
+	The HTML is stored with its SCREENSHOT_STEP_N placeholders intact so a
+	hit can embed the current run's screenshots. Entries past `max_age` are
+	dropped, and the least recently used entries are evicted once
+	`max_entries` or `max_bytes` is exceeded.
+	"""
+
+	def __init__(
+		self,
+		directory=REPORT_CACHE_DIR,
+		max_entries=REPORT_CACHE_MAX_ENTRIES,
+		max_bytes=REPORT_CACHE_MAX_BYTES,
+		max_age_days=REPORT_CACHE_MAX_AGE_DAYS,
+		enabled=not REPORT_CACHE_DISABLED,
+	):
+		self.directory = directory
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.max_age = max_age_days * 24 * 60 * 60
+		self.enabled = enabled
+		self.hits = 0
+		self.misses = 0
+		self.bypassed = 0
+
+	@staticmethod
+	def key(model, prompts, run):
+		"""Key of the report `model` writes for `run` under `prompts` (the system prompts and anything else fixed per report)."""
+		payload = json.dumps([REPORT_CACHE_VERSION, model, prompts, normalize_run(run)])
+		return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.directory, f"{key}.json")
+
+	def get(self, key):
+		"""Return the cached (state, html) for `key`, or None on a miss."""
+		path = self._path(key)
+		try:
+			if time.time() - os.path.getmtime(path) > self.max_age:
+				os.remove(path)
+				raise FileNotFoundError(path)
+			with open(path, encoding="utf-8") as f:
+				entry = json.load(f)
+			os.utime(path)
+		except (OSError, ValueError):
+			self.misses += 1
+			return None
+		self.hits += 1
+		return entry["state"], entry["html"]
+
+	def put(self, key, state, html_output):
+		os.makedirs(self.directory, exist_ok=True)
+		path = self._path(key)
+		tmp_path = f"{path}.{os.getpid()}.tmp"
+		with open(tmp_path, "w", encoding="utf-8") as f:
+			json.dump({"state": state, "html": html_output, "created_at": time.time()}, f)
+		os.replace(tmp_path, path)
+		self.evict()
+
+	def _entries(self):
+		entries = []
+		if not os.path.isdir(self.directory):
+			return entries
+		for filename in os.listdir(self.directory):
+			if filename.endswith(".json"):
+				path = os.path.join(self.directory, filename)
+				try:
+					stat = os.stat(path)
+				except OSError:
+					continue
+				entries.append((stat.st_mtime, stat.st_size, path))
+		return entries
+
+	def evict(self):
+		"""Drop expired entries, then least recently used ones until under the size limits."""
+		now = time.time()
+		entries = []
+		for mtime, size, path in self._entries():
+			if now - mtime > self.max_age:
+				self._remove(path)
+			else:
+				entries.append((mtime, size, path))
+
+		entries.sort()
+		total_bytes = sum(size for _, size, _ in entries)
+		while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+			_, size, path = entries.pop(0)
+			self._remove(path)
+			total_bytes -= size
+
+	@staticmethod
+	def _remove(path):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+	def stats(self):
+		entries = self._entries()
+		lookups = self.hits + self.misses
+		return {
+			"enabled": self.enabled,
+			"hits": self.hits,
+			"misses": self.misses,
+			"bypassed": self.bypassed,
+			"hit_rate": round(self.hits / lookups, 3) if lookups else None,
+			"entries": len(entries),
+			"bytes": sum(size for _, size, _ in entries),
+		}
+
+
+report_cache = ReportCache()
@@ -0,0 +1,136 @@
+import asyncio
+import html
+import json
+import os
+import time
+
+from backend.llm_clients import REPORT_MODEL, get_report_client
+from backend.metrics import record_llm_call, span
+from backend.report_payload import REPORT_TOKEN_BUDGET, estimate_tokens, fit_steps, render_header, render_steps
+
+# "auto" map-reduces runs with more than REPORT_CHUNK_STEPS steps, "always" every run, "off" none
+REPORT_MAP_REDUCE = os.getenv("REPORT_MAP_REDUCE", "auto").lower()
+REPORT_CHUNK_STEPS = int(os.getenv("REPORT_CHUNK_STEPS", "6"))
+# Concurrent map calls per report; each one writes the details of one chunk or run
+REPORT_MAP_CONCURRENCY = int(os.getenv("REPORT_MAP_CONCURRENCY", "4"))
+REPORT_MAP_MAX_TOKENS = int(os.getenv("REPORT_MAP_MAX_TOKENS", "2000"))
+
+DETAILS_MARKER = "<!--REPORT_DETAILS-->"
+
+MAP_SYSTEM_PROMPT = """You are a Senior QA Engineer reviewing one part of an automated UI test: a range of its steps, or one run of a batch of runs.
+Write the "The Details" part of the QA report for this part only, and summarize it for the colleague who writes the rest of the report.
+
+Return JSON with:
+- verdict: "pass" if everything in this part worked as the test expected, otherwise "fail"
+- summary: 2-4 plain sentences on what happened in this part
+- issues: one short entry per problem, starting with its severity (Critical/High/Medium/Low) and the step it happened at; empty if there were none
+- details_html: an HTML fragment (no <html> or <body>) telling the story of these steps - what was done, what worked, what didn't, with exact error messages. Use an <h3> per step or group of steps, inline CSS, green for good and red for problems, and embed each step's screenshot as <img src="SCREENSHOT_STEP_N" style="max-width:100%;" /> (N is the step number) with a caption
+
+Write naturally, as if explaining to a colleague. Don't make stuff up - only report what the data actually shows."""
+
+REDUCE_NOTE = f"""
+The test was reviewed in parts, and the "The Details" section with all screenshots has already been written from them.
+Write every other section from the part summaries in the data. Put the exact marker {DETAILS_MARKER} on its own line where
+The Details section belongs instead of writing it, and don't embed any screenshots yourself."""
+
+PART_RESPONSE_FORMAT = {
+	"type": "json_schema",
+	"json_schema": {
+		"name": "report_part",
+		"strict": True,
+		"schema": {
+			"type": "object",
+			"properties": {
+				"verdict": {"type": "string", "enum": ["pass", "fail"]},
+				"summary": {"type": "string"},
+				"issues": {"type": "array", "items": {"type": "string"}},
+				"details_html": {"type": "string"},
+			},
+			"required": ["verdict", "summary", "issues", "details_html"],
+			"additionalProperties": False,
+		},
+	},
+}
+
+
+def use_map_reduce(run, mode=REPORT_MAP_REDUCE):
+	if not run or not run["steps"] or mode == "off":
+		return False
+	return mode == "always" or len(run["steps"]) > REPORT_CHUNK_STEPS
+
+
+def step_parts(run, chunk_steps=REPORT_CHUNK_STEPS, budget=REPORT_TOKEN_BUDGET):
+	"""Split a run into (label, payload) parts of `chunk_steps` steps, each with the run header for context."""
+	header = render_header(run)
+	parts = []
+	for i in range(0, len(run["steps"]), max(1, chunk_steps)):
+		steps = run["steps"][i:i + chunk_steps]
+		levels = fit_steps(header, steps, budget)
+		label = f"steps {steps[0]['step_index']}-{steps[-1]['step_index']}"
+		parts.append((label, f"{header}\n\n{label}:\n{render_steps(steps, levels)}"))
+	return header, parts
+
+
+async def _summarize(client, semaphore, topic, label, payload):
+	async with semaphore:
+		start = time.perf_counter()
+		try:
+			response = await client.chat.completions.create(
+				model=REPORT_MODEL,
+				messages=[
+					{"role": "system", "content": MAP_SYSTEM_PROMPT},
+					{"role": "user", "content": f"Test: {topic}\nPart: {label}\n\nData:\n{payload}"},
+				],
+				max_tokens=REPORT_MAP_MAX_TOKENS,
+				temperature=0.3,
+				response_format=PART_RESPONSE_FORMAT,
+			)
+			record_llm_call("report_map", REPORT_MODEL, time.perf_counter() - start, response.usage)
+			part = json.loads(response.choices[0].message.content)
+			prompt_tokens = response.usage.prompt_tokens if response.usage else None
+		except Exception as e:
+			# A part that cannot be summarized still shows up, as its raw data
+			print(f"Summarizing {label} of {topic} failed, using its raw data instead: {e}")
+			part = {
+				"verdict": "fail",
+				"summary": f"This part could not be summarized ({type(e).__name__}); its raw data is shown in the details.",
+				"issues": [],
+				"details_html": f"<h3>{html.escape(label)}</h3><pre style=\"white-space:pre-wrap;\">{html.escape(payload)}</pre>",
+			}
+			prompt_tokens = None
+	return {"label": label, "payload_tokens": estimate_tokens(payload), "prompt_tokens": prompt_tokens, **part}
+
+
+async def map_parts(topic, parts, concurrency=REPORT_MAP_CONCURRENCY):
+	"""Summarize every (label, payload) part concurrently; returns one dict per part, in order."""
+	client = get_report_client()
+	semaphore = asyncio.Semaphore(max(1, concurrency))
+	with span("report_map", topic=topic, parts=len(parts)):
+		return await asyncio.gather(*(_summarize(client, semaphore, topic, label, payload) for label, payload in parts))
+
+
+def reduce_data(header, summaries):
+	"""The data for the final pass: the header plus each part's verdict, summary and issues."""
+	sections = [header, "", "parts:"]
+	for part in summaries:
+		sections.append(f"[{part['label']}] verdict: {part['verdict']}")
+		sections.append(f"summary: {part['summary']}")
+		sections.extend(f"issue: {issue}" for issue in part["issues"])
+	return "\n".join(sections)
+
+
+def merge_details(html_output, summaries):
+	"""Put the parts' details where the final pass left DETAILS_MARKER (or before </body> if it didn't)."""
+	details = "\n".join(part["details_html"] for part in summaries)
+	if DETAILS_MARKER in html_output:
+		return html_output.replace(DETAILS_MARKER, details, 1)
+	body_end = html_output.rfind("</body>")
+	if body_end == -1:
+		return html_output + details
+	return html_output[:body_end] + details + html_output[body_end:]
+
+
+def usage_totals(summaries):
+	"""(payload tokens, provider prompt tokens or None) summed over the map calls."""
+	prompt_tokens = [part["prompt_tokens"] for part in summaries if part["prompt_tokens"]]
+	return sum(part["payload_tokens"] for part in summaries), sum(prompt_tokens) if prompt_tokens else None
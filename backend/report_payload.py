@@ -0,0 +1,170 @@
+import json
+import math
+import os
+
+from backend.page_perf import is_slow, perf_text
+
+# Approximate budget for the test data sent to the report LLM; the system prompt comes on top
+REPORT_TOKEN_BUDGET = int(os.getenv("REPORT_TOKEN_BUDGET", "6000"))
+# Extracted page content and errors longer than this are cut, keeping their start and end
+REPORT_EXTRACT_CHARS = int(os.getenv("REPORT_EXTRACT_CHARS", "600"))
+REPORT_FINAL_RESULT_CHARS = int(os.getenv("REPORT_FINAL_RESULT_CHARS", "2000"))
+# Rough size of a token for English text and URLs; good enough to budget with
+CHARS_PER_TOKEN = 4
+
+OMITTED, BRIEF, FULL = 0, 1, 2
+
+
+def estimate_tokens(text):
+	return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate(text, limit):
+	"""Cut `text` to about `limit` characters, keeping its start and end."""
+	if text is None or len(text) <= limit:
+		return text
+	head = limit * 2 // 3
+	return f"{text[:head]} …[{len(text) - limit} chars cut]… {text[len(text) - (limit - head):]}"
+
+
+def _one_line(text, limit=REPORT_EXTRACT_CHARS):
+	return truncate(" ".join(str(text).split()), limit)
+
+
+def is_failing(step):
+	return bool(step["error"]) or step["success"] == 0
+
+
+def action_text(action):
+	"""Render [{"click": {"index": 3}}] as click(index=3), shortening long arguments."""
+	calls = []
+	for item in action or []:
+		for name, params in item.items():
+			if isinstance(params, dict):
+				args = ", ".join(f"{key}={_one_line(json.dumps(value, ensure_ascii=False), 200)}" for key, value in params.items())
+			else:
+				args = _one_line(json.dumps(params, ensure_ascii=False), 200)
+			calls.append(f"{name}({args})")
+	return "; ".join(calls) or "no action"
+
+
+def render_step(step, level, previous_url=None):
+	"""One step in the compact format; BRIEF keeps what happened, FULL adds what the agent saw and read.
+
+	Page performance is shown in full, or briefly when a Web Vital is poor.
+	"""
+	lines = [f"[step {step['step_index']}] {'FAIL' if is_failing(step) else 'ok'} {action_text(step['action'])}"]
+	if step["url"] != previous_url:
+		lines.append(f"  page: {step['url']}" + (f" ({_one_line(step['title'], 120)})" if step["title"] else ""))
+	if level == FULL:
+		if step["evaluation"]:
+			lines.append(f"  saw: {_one_line(step['evaluation'])}")
+		if step["next_goal"]:
+			lines.append(f"  goal: {_one_line(step['next_goal'])}")
+	if step["error"]:
+		lines.append(f"  error: {_one_line(step['error'])}")
+	if level == FULL and step["extracted_content"]:
+		lines.append(f"  extracted: {_one_line(step['extracted_content'])}")
+	perf = step.get("perf")
+	if perf and (level == FULL or is_slow(perf)):
+		lines.append(f"  perf: {perf_text(perf, step['duration_seconds'])}")
+	return "\n".join(lines)
+
+
+def render_header(run):
+	steps = run["steps"]
+	failing = [str(step["step_index"]) for step in steps if is_failing(step)]
+	urls = []
+	for step in steps:
+		if step["url"] and (not urls or urls[-1] != step["url"]):
+			urls.append(step["url"])
+	lines = [
+		f"test: {run['task']} on {run['device']}",
+		f"outcome: done={bool(run['is_done'])} successful={bool(run['is_successful'])}"
+		+ (f", failing steps: {', '.join(failing)}" if failing else ", no failing steps"),
+		f"steps: {len(steps)}" + (f" ({run['replayed_steps']} replayed from a recorded trace)" if run["replayed_steps"] else "")
+		+ (f", {run['duration_seconds']:.0f}s" if run["duration_seconds"] else ""),
+	]
+	if run["visual_verdict"]:
+		lines.append(f"visual check against baseline: {run['visual_verdict']}")
+	if run.get("perf"):
+		lines.append(f"page performance (worst step): {perf_text(run['perf'])}")
+	if run["error"]:
+		lines.append(f"run error: {_one_line(run['error'])}")
+	lines.append(f"pages: {' -> '.join(urls) or 'none'}")
+	if run["final_result"]:
+		lines.append(f"final result: {truncate(run['final_result'], REPORT_FINAL_RESULT_CHARS)}")
+	shots = [step["step_index"] for step in steps if step["screenshot"]]
+	if shots:
+		lines.append(f"screenshots: one per step, SCREENSHOT_STEP_{shots[0]} to SCREENSHOT_STEP_{shots[-1]}")
+	return "\n".join(lines)
+
+
+def render_steps(steps, levels):
+	"""Render steps at their levels, collapsing runs of omitted steps into one line."""
+	lines, previous_url, skipped = [], None, []
+
+	def flush():
+		if skipped:
+			span = f"{skipped[0]}" if len(skipped) == 1 else f"{skipped[0]}-{skipped[-1]}"
+			lines.append(f"[steps {span} omitted: all succeeded]")
+			skipped.clear()
+
+	for step, level in zip(steps, levels):
+		if level == OMITTED:
+			skipped.append(step["step_index"])
+			continue
+		flush()
+		lines.append(render_step(step, level, previous_url))
+		previous_url = step["url"]
+	flush()
+	return "\n".join(lines)
+
+
+def fit_steps(header, steps, budget):
+	"""Choose a level per step so header + steps fit in `budget` tokens.
+
+	Failing steps are always shown in full. The other steps are first added
+	briefly, then in full, in priority order: the last step (the outcome),
+	the first step, then the rest from the end backwards.
+	"""
+	levels = [FULL if is_failing(step) else OMITTED for step in steps]
+	rest = [i for i in range(len(steps)) if levels[i] == OMITTED]
+	order = rest[-1:] + rest[:1] + rest[-2:0:-1]
+
+	def cost():
+		return estimate_tokens(header) + estimate_tokens(render_steps(steps, levels))
+
+	for level in (BRIEF, FULL):
+		for i in order:
+			previous = levels[i]
+			levels[i] = level
+			if cost() > budget:
+				levels[i] = previous
+	return levels
+
+
+def build_report_payload(run, task_result, budget=REPORT_TOKEN_BUDGET):
+	"""Return (payload, stats): the run serialized for the report LLM within `budget` tokens.
+
+	`run` is the run store record with its steps. Without one (a run that was
+	never indexed) the raw `task_result` text is cut to the budget instead.
+	"""
+	raw_tokens = estimate_tokens(task_result)
+	if not run or not run["steps"]:
+		payload = truncate(task_result, budget * CHARS_PER_TOKEN)
+		return payload, {"tokens": estimate_tokens(payload), "raw_tokens": raw_tokens, "steps": 0, "steps_full": 0, "steps_omitted": 0}
+
+	header = render_header(run)
+	levels = fit_steps(header, run["steps"], budget)
+	payload = f"{header}\n\nsteps:\n{render_steps(run['steps'], levels)}"
+	if estimate_tokens(payload) > budget:
+		# Failing steps alone are over budget
+		payload = truncate(payload, budget * CHARS_PER_TOKEN)
+	return payload, {
+		"tokens": estimate_tokens(payload),
+		"raw_tokens": raw_tokens,
+		"steps": len(levels),
+		"steps_full": levels.count(FULL),
+		"steps_omitted": levels.count(OMITTED),
+	}
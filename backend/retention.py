@@ -0,0 +1,210 @@
+"""Retention and compaction of results/.
+
+    python -m backend.retention [--pack-after-days 7] [--max-bytes 5e9]
+                                [--delete-archives-after-days 90] [--dry-run]
+
+1. Screenshots written before the blob store existed are moved into it, so
+   identical frames across runs are stored once.
+2. Runs older than --pack-after-days, then the oldest remaining runs while
+   live storage exceeds --max-bytes, are packed into
+   results/archive/{run_id}.tar.gz (self-contained, screenshots included)
+   and their directories removed. Baseline runs and runs that can still be
+   resumed are never packed.
+3. Archives older than --delete-archives-after-days are deleted.
+4. Blobs no longer referenced by any run directory are garbage-collected.
+"""
+import argparse
+import os
+import re
+import shutil
+import tarfile
+import time
+
+from backend.blob_store import Manifest, blob_store, read_manifest
+from backend.run_store import run_store, RESULTS_DIR
+
+ARCHIVE_DIR = os.getenv("RESULTS_ARCHIVE_DIR", "results/archive")
+RETENTION_PACK_AFTER_DAYS = float(os.getenv("RETENTION_PACK_AFTER_DAYS", "7"))
+# Upper bound on unpacked runs plus blobs; 0 disables the size policy
+RETENTION_MAX_BYTES = int(float(os.getenv("RETENTION_MAX_BYTES", "0")))
+# Archives older than this are deleted; 0 keeps them forever
+RETENTION_ARCHIVE_MAX_AGE_DAYS = float(os.getenv("RETENTION_ARCHIVE_MAX_AGE_DAYS", "0"))
+# Unreferenced blobs younger than this are kept, in case a running step is about to link them
+BLOB_GC_GRACE_HOURS = float(os.getenv("BLOB_GC_GRACE_HOURS", "1"))
+
+_STEP_FILE = re.compile(r"^step_(\d+)\.png$")
+RUN_MARKERS = ("steps.txt", "result.txt", "screenshots")
+
+
+def find_run_dirs(results_dir=RESULTS_DIR):
+	"""Return [(run_id, path, last_modified)] for every run directory, oldest first."""
+	runs = []
+	if not os.path.isdir(results_dir):
+		return runs
+	for name in os.listdir(results_dir):
+		path = os.path.join(results_dir, name)
+		if not os.path.isdir(path) or not any(os.path.exists(os.path.join(path, m)) for m in RUN_MARKERS):
+			continue
+		last_modified = max(
+			(os.path.getmtime(os.path.join(path, entry)) for entry in os.listdir(path)),
+			default=os.path.getmtime(path),
+		)
+		runs.append((name, path, last_modified))
+	return sorted(runs, key=lambda run: run[2])
+
+
+def adopt_screenshots(run_dir, dry_run=False):
+	"""Move a run's plain screenshot files into the blob store. Returns how many were (or would be) adopted."""
+	screenshots_dir = os.path.join(run_dir, "screenshots")
+	if not os.path.isdir(screenshots_dir):
+		return 0
+	manifest = Manifest(screenshots_dir)
+	adopted = 0
+	for name in os.listdir(screenshots_dir):
+		match = _STEP_FILE.match(name)
+		if not match or match.group(1) in manifest.steps:
+			continue
+		if not dry_run:
+			manifest.set(match.group(1), blob_store.adopt(os.path.join(screenshots_dir, name)))
+		adopted += 1
+	return adopted
+
+
+def _unique_bytes(paths):
+	"""Disk used by the files under `paths`, counting hard-linked files once."""
+	seen, total = set(), 0
+	for root in paths:
+		for dirpath, _, filenames in os.walk(root):
+			for name in filenames:
+				stat = os.lstat(os.path.join(dirpath, name))
+				if (stat.st_dev, stat.st_ino) not in seen:
+					seen.add((stat.st_dev, stat.st_ino))
+					total += stat.st_size
+	return total
+
+
+def _freeable_bytes(run_dir):
+	"""Bytes released by removing a run: its own files plus blobs no other run links to."""
+	total = 0
+	for dirpath, _, filenames in os.walk(run_dir):
+		for name in filenames:
+			stat = os.lstat(os.path.join(dirpath, name))
+			# One link is the run's own; a second is the blob store's copy
+			if stat.st_nlink <= 2:
+				total += stat.st_size
+	return total
+
+
+def pack_run(run_id, run_dir, archive_dir=ARCHIVE_DIR):
+	"""Write the run directory to a gzipped tarball, remove it and record the archive."""
+	os.makedirs(archive_dir, exist_ok=True)
+	archive_path = os.path.join(archive_dir, f"{run_id}.tar.gz")
+	tmp_path = f"{archive_path}.tmp"
+	with tarfile.open(tmp_path, "w:gz") as tar:
+		tar.add(run_dir, arcname=run_id)
+	os.replace(tmp_path, archive_path)
+	shutil.rmtree(run_dir)
+	run_store.set_archived(run_id, archive_path)
+	return archive_path
+
+
+def collect_garbage(run_dirs, grace_seconds, dry_run=False):
+	"""Delete blobs that no run manifest references. Returns (count, bytes)."""
+	referenced = set()
+	for path in run_dirs:
+		referenced.update(read_manifest(os.path.join(path, "screenshots")).values())
+	now = time.time()
+	count = size = 0
+	for digest, path in blob_store.iter_blobs():
+		stat = os.stat(path)
+		# st_nlink > 1 means some run still links the blob even if its manifest is missing
+		if digest in referenced or stat.st_nlink > 1 or now - stat.st_mtime < grace_seconds:
+			continue
+		count += 1
+		size += stat.st_size
+		if not dry_run:
+			os.remove(path)
+	return count, size
+
+
+def apply_retention(
+	pack_after_days=RETENTION_PACK_AFTER_DAYS,
+	max_bytes=RETENTION_MAX_BYTES,
+	archive_max_age_days=RETENTION_ARCHIVE_MAX_AGE_DAYS,
+	grace_hours=BLOB_GC_GRACE_HOURS,
+	dry_run=False,
+	results_dir=RESULTS_DIR,
+	archive_dir=ARCHIVE_DIR,
+):
+	"""Run every retention step and return a summary of what was (or would be) done."""
+	now = time.time()
+	runs = find_run_dirs(results_dir)
+	summary = {"adopted_screenshots": 0, "packed_runs": [], "deleted_archives": [], "collected_blobs": 0, "collected_bytes": 0}
+
+	for _, path, _ in runs:
+		summary["adopted_screenshots"] += adopt_screenshots(path, dry_run)
+
+	pinned = run_store.pinned_run_ids()
+	candidates = [run for run in runs if run[0] not in pinned]
+	to_pack = {run_id for run_id, _, last_modified in candidates if now - last_modified > pack_after_days * 86400}
+	if max_bytes:
+		live_bytes = _unique_bytes([path for _, path, _ in runs] + [blob_store.root])
+		live_bytes -= sum(_freeable_bytes(path) for run_id, path, _ in candidates if run_id in to_pack)
+		for run_id, path, _ in candidates:
+			if live_bytes <= max_bytes:
+				break
+			if run_id not in to_pack:
+				to_pack.add(run_id)
+				live_bytes -= _freeable_bytes(path)
+		summary["live_bytes"] = live_bytes
+
+	for run_id, path, _ in runs:
+		if run_id in to_pack:
+			summary["packed_runs"].append(run_id)
+			if not dry_run:
+				pack_run(run_id, path, archive_dir)
+
+	if archive_max_age_days and os.path.isdir(archive_dir):
+		for name in sorted(os.listdir(archive_dir)):
+			path = os.path.join(archive_dir, name)
+			if name.endswith(".tar.gz") and now - os.path.getmtime(path) > archive_max_age_days * 86400:
+				summary["deleted_archives"].append(name)
+				if not dry_run:
+					os.remove(path)
+
+	remaining = [path for run_id, path, _ in runs if run_id not in to_pack]
+	summary["collected_blobs"], summary["collected_bytes"] = collect_garbage(remaining, grace_hours * 3600, dry_run)
+	return summary
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Pack old runs, expire archives and garbage-collect screenshot blobs")
+	parser.add_argument("--pack-after-days", type=float, default=RETENTION_PACK_AFTER_DAYS, help="Pack runs older than this")
+	parser.add_argument("--max-bytes", type=float, default=RETENTION_MAX_BYTES, help="Pack the oldest runs until unpacked runs and blobs fit (0: no limit)")
+	parser.add_argument("--delete-archives-after-days", type=float, default=RETENTION_ARCHIVE_MAX_AGE_DAYS, help="Delete archives older than this (0: keep)")
+	parser.add_argument("--gc-grace-hours", type=float, default=BLOB_GC_GRACE_HOURS, help="Keep unreferenced blobs younger than this")
+	parser.add_argument("--dry-run", action="store_true", help="Report what would be done without changing anything")
+	args = parser.parse_args()
+
+	try:
+		summary = apply_retention(
+			pack_after_days=args.pack_after_days,
+			max_bytes=int(args.max_bytes),
+			archive_max_age_days=args.delete_archives_after_days,
+			grace_hours=args.gc_grace_hours,
+			dry_run=args.dry_run,
+		)
+	finally:
+		run_store.close()
+
+	prefix = "Would have " if args.dry_run else ""
+	print(f"{prefix}adopted {summary['adopted_screenshots']} screenshots into the blob store")
+	print(f"{prefix}packed {len(summary['packed_runs'])} runs into {ARCHIVE_DIR}/")
+	for run_id in summary["packed_runs"]:
+		print(f"  {run_id}")
+	print(f"{prefix}deleted {len(summary['deleted_archives'])} expired archives")
+	print(f"{prefix}collected {summary['collected_blobs']} unreferenced blobs ({summary['collected_bytes'] / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+	main()
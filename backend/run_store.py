@@ -0,0 +1,402 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+
+import psutil
+
+# Run output directories (screenshots, result.txt, report.html) are created under this
+RESULTS_DIR = os.getenv("RESULTS_DIR", "results")
+RUN_STORE_PATH = os.getenv("RUN_STORE_PATH", "results/runs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+	id TEXT PRIMARY KEY,
+	task TEXT NOT NULL,
+	device TEXT NOT NULL,
+	status TEXT NOT NULL,
+	started_at TEXT NOT NULL,
+	finished_at TEXT,
+	duration_seconds REAL,
+	number_of_steps INTEGER,
+	replayed_steps INTEGER,
+	is_done INTEGER,
+	is_successful INTEGER,
+	has_errors INTEGER,
+	final_result TEXT,
+	error TEXT,
+	output_dir TEXT NOT NULL,
+	report_path TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS runs_task_started_at ON runs (task, started_at);
+CREATE INDEX IF NOT EXISTS runs_device_started_at ON runs (device, started_at);
+CREATE INDEX IF NOT EXISTS runs_status_started_at ON runs (status, started_at);
+
+CREATE TABLE IF NOT EXISTS steps (
+	run_id TEXT NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+	step_index INTEGER NOT NULL,
+	url TEXT,
+	title TEXT,
+	action TEXT,
+	next_goal TEXT,
+	success INTEGER,
+	error TEXT,
+	extracted_content TEXT,
+	is_done INTEGER,
+	duration_seconds REAL,
+	screenshot TEXT,
+	PRIMARY KEY (run_id, step_index)
+);
+CREATE INDEX IF NOT EXISTS steps_error ON steps (run_id) WHERE error IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS baselines (
+	task TEXT NOT NULL,
+	device TEXT NOT NULL,
+	run_id TEXT NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+	blessed_at TEXT NOT NULL,
+	PRIMARY KEY (task, device)
+);
+
+CREATE TABLE IF NOT EXISTS failure_clusters (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	task TEXT NOT NULL,
+	signature TEXT NOT NULL,
+	summary TEXT,
+	first_run_id TEXT NOT NULL,
+	report_path TEXT,
+	run_count INTEGER NOT NULL,
+	first_seen TEXT NOT NULL,
+	last_seen TEXT NOT NULL
+);
+"""
+
+# Columns added after the first release, applied to databases created before them
+COLUMN_MIGRATIONS = (
+	("runs", "visual_verdict", "TEXT"),
+	("runs", "archive_path", "TEXT"),
+	("steps", "image_tokens", "INTEGER"),
+	("steps", "image_tokens_full", "INTEGER"),
+	("steps", "evaluation", "TEXT"),
+	("runs", "report_payload_tokens", "INTEGER"),
+	("runs", "report_prompt_tokens", "INTEGER"),
+	("runs", "failure_cluster", "INTEGER"),
+	("steps", "perf", "TEXT"),
+	("runs", "perf", "TEXT"),
+	("runs", "report_state", "TEXT"),
+	("failure_clusters", "reporter_run_id", "TEXT"),
+	("runs", "owner_host", "TEXT"),
+	("runs", "owner_pid", "INTEGER"),
+	("runs", "owner_started", "REAL"),
+)
+
+RUN_FILTERS = ("task", "device", "status", "report_state")
+RESUMABLE_STATUSES = ("running", "interrupted")
+
+
+def _bool(value):
+	return None if value is None else int(bool(value))
+
+
+_owner = None
+
+
+def current_owner():
+	"""(host, pid, process start time) of this process, recorded on the runs it executes."""
+	global _owner
+	if _owner is None:
+		_owner = (socket.gethostname(), os.getpid(), psutil.Process().create_time())
+	return _owner
+
+
+def owner_alive(run):
+	"""Whether the process that executes `run` is still alive.
+
+	The start time tells a live owner from another process that reused its
+	pid. Owners on another host can't be checked and count as alive; runs
+	recorded before owners were (no owner_pid) count as dead.
+	"""
+	if run["owner_pid"] is None:
+		return False
+	host, _, _ = current_owner()
+	if run["owner_host"] != host:
+		return True
+	try:
+		return abs(psutil.Process(run["owner_pid"]).create_time() - run["owner_started"]) < 1
+	except psutil.Error:
+		return False
+
+
+def is_resumable(run):
+	"""Interrupted runs, and runs still marked running whose process is gone."""
+	return run["status"] == "interrupted" or (run["status"] == "running" and not owner_alive(run))
+
+
+def _run_record(row):
+	return dict(row, perf=json.loads(row["perf"]) if row["perf"] else None)
+
+
+class RunStore:
+	"""SQLite index of every run and its steps, queried by the dashboard history."""
+
+	def __init__(self, path=RUN_STORE_PATH):
+		self.path = path
+		self._conn = None
+		self._lock = threading.Lock()
+
+	def _connect(self):
+		if self._conn is None:
+			os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+			self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+			self._conn.row_factory = sqlite3.Row
+			self._conn.execute("PRAGMA journal_mode=WAL")
+			self._conn.execute("PRAGMA synchronous=NORMAL")
+			self._conn.execute("PRAGMA foreign_keys=ON")
+			self._conn.executescript(SCHEMA)
+			self._migrate()
+		return self._conn
+
+	def _migrate(self):
+		"""Add the COLUMN_MIGRATIONS columns a database is missing, all or none."""
+		# IMMEDIATE takes the write lock first, so two workers opening the same database can't both add a column
+		self._conn.execute("BEGIN IMMEDIATE")
+		try:
+			for table, column, column_type in COLUMN_MIGRATIONS:
+				columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+				if column not in columns:
+					self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+			self._conn.execute("COMMIT")
+		except BaseException:
+			self._conn.execute("ROLLBACK")
+			raise
+
+	def _execute(self, sql, params=()):
+		with self._lock:
+			return self._connect().execute(sql, params)
+
+	def close(self):
+		with self._lock:
+			if self._conn is not None:
+				self._conn.close()
+				self._conn = None
+
+	def start_run(self, run_id, task, device, output_dir):
+		self._execute(
+			"INSERT INTO runs (id, task, device, status, started_at, output_dir, owner_host, owner_pid, owner_started) "
+			"VALUES (?, ?, ?, 'running', ?, ?, ?, ?, ?)",
+			(run_id, task, device, datetime.now().isoformat(), output_dir, *current_owner()),
+		)
+
+	def add_step(self, run_id, step_index, url=None, title=None, action=None, evaluation=None, next_goal=None, success=None,
+			error=None, extracted_content=None, is_done=None, duration_seconds=None, screenshot=None,
+			image_tokens=None, image_tokens_full=None, perf=None):
+		self._execute(
+			"INSERT OR REPLACE INTO steps (run_id, step_index, url, title, action, evaluation, next_goal, success, error, "
+			"extracted_content, is_done, duration_seconds, screenshot, image_tokens, image_tokens_full, perf) "
+			"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+			(
+				run_id, step_index, url, title,
+				json.dumps(action, default=str) if action is not None else None,
+				evaluation, next_goal, _bool(success), error, extracted_content, _bool(is_done), duration_seconds, screenshot,
+				image_tokens, image_tokens_full, json.dumps(perf) if perf is not None else None,
+			),
+		)
+
+	def finish_run(self, run_id, status, duration_seconds=None, number_of_steps=None, replayed_steps=None,
+			is_done=None, is_successful=None, has_errors=None, final_result=None, error=None):
+		self._execute(
+			"UPDATE runs SET status = ?, finished_at = ?, duration_seconds = ?, number_of_steps = ?, replayed_steps = ?, "
+			"is_done = ?, is_successful = ?, has_errors = ?, final_result = ?, error = ? WHERE id = ?",
+			(
+				status, datetime.now().isoformat(), duration_seconds, number_of_steps, replayed_steps,
+				_bool(is_done), _bool(is_successful), _bool(has_errors), final_result, error, run_id,
+			),
+		)
+
+	def resume_run(self, run):
+		"""Take over a resumable run (as read with get_run) in this process; False if someone else got there first."""
+		cursor = self._execute(
+			"UPDATE runs SET status = 'running', finished_at = NULL, error = NULL, owner_host = ?, owner_pid = ?, owner_started = ? "
+			"WHERE id = ? AND status = ? AND owner_pid IS ? AND owner_started IS ?",
+			(*current_owner(), run["id"], run["status"], run["owner_pid"], run["owner_started"]),
+		)
+		return cursor.rowcount == 1
+
+	def mark_interrupted(self):
+		"""Flag runs left 'running' by a process that is gone so they can be resumed.
+
+		Runs of other live workers sharing the store are left alone.
+		"""
+		rows = self._execute(
+			"SELECT id, owner_host, owner_pid, owner_started FROM runs WHERE status = 'running'"
+		).fetchall()
+		interrupted = 0
+		for row in rows:
+			if owner_alive(row):
+				continue
+			cursor = self._execute(
+				"UPDATE runs SET status = 'interrupted' WHERE id = ? AND status = 'running' AND owner_pid IS ? AND owner_started IS ?",
+				(row["id"], row["owner_pid"], row["owner_started"]),
+			)
+			interrupted += cursor.rowcount
+		return interrupted
+
+	def set_report(self, run_id, report_path):
+		self._execute("UPDATE runs SET report_path = ? WHERE id = ?", (report_path, run_id))
+
+	def set_report_state(self, run_id, state):
+		"""Record the report's verdict on the run ('pass' or 'fail'); `status` keeps the run's own outcome."""
+		self._execute("UPDATE runs SET report_state = ? WHERE id = ?", (state, run_id))
+
+	def set_report_tokens(self, run_id, payload_tokens, prompt_tokens=None):
+		"""Record the estimated size of the test data sent to the report LLM and the prompt tokens it billed."""
+		self._execute(
+			"UPDATE runs SET report_payload_tokens = ?, report_prompt_tokens = ? WHERE id = ?",
+			(payload_tokens, prompt_tokens, run_id),
+		)
+
+	def set_perf(self, run_id, perf):
+		"""Record the run-level page performance summary (see page_perf.summarize_run)."""
+		self._execute("UPDATE runs SET perf = ? WHERE id = ?", (json.dumps(perf) if perf is not None else None, run_id))
+
+	def set_visual_verdict(self, run_id, verdict):
+		self._execute("UPDATE runs SET visual_verdict = ? WHERE id = ?", (verdict, run_id))
+
+	def set_baseline(self, task, device, run_id):
+		"""Bless `run_id` as the reference run that later runs of task/device are compared against."""
+		self._execute(
+			"INSERT OR REPLACE INTO baselines (task, device, run_id, blessed_at) VALUES (?, ?, ?, ?)",
+			(task, device, run_id, datetime.now().isoformat()),
+		)
+
+	def get_baseline(self, task, device):
+		"""Return the blessed baseline run for task/device (with its steps), or None."""
+		row = self._execute("SELECT run_id FROM baselines WHERE task = ? AND device = ?", (task, device)).fetchone()
+		return self.get_run(row["run_id"]) if row else None
+
+	def set_archived(self, run_id, archive_path):
+		self._execute("UPDATE runs SET archive_path = ? WHERE id = ?", (archive_path, run_id))
+
+	def pinned_run_ids(self):
+		"""Ids of runs that must stay unpacked: blessed baselines and runs that can still be resumed."""
+		rows = self._execute(
+			f"SELECT run_id FROM baselines UNION SELECT id FROM runs WHERE status IN ({','.join('?' * len(RESUMABLE_STATUSES))})",
+			RESUMABLE_STATUSES,
+		).fetchall()
+		return {row[0] for row in rows}
+
+	def match_or_reserve_failure_cluster(self, task, signature, summary, run_id, after_id, choose):
+		"""Atomically join `run_id` to a failure cluster, or start one for it whose report is still to come.
+
+		In one write transaction, `choose(new_clusters)` is called with the clusters
+		added after `after_id` (e.g. by another worker) and returns the id of the
+		cluster to join, or None to start a new one with no report_path yet.
+		Returns (cluster_id, reporting): reporting is True when `run_id` is to write
+		the cluster's report, because it started the cluster or joined one whose
+		report was released by a run that failed to write it.
+		"""
+		now = datetime.now().isoformat()
+		with self._lock:
+			conn = self._connect()
+			conn.execute("BEGIN IMMEDIATE")
+			try:
+				rows = conn.execute("SELECT * FROM failure_clusters WHERE id > ? ORDER BY id", (after_id,)).fetchall()
+				cluster_id = choose([dict(row, signature=json.loads(row["signature"])) for row in rows])
+				reporting = cluster_id is None
+				if reporting:
+					cluster_id = conn.execute(
+						"INSERT INTO failure_clusters (task, signature, summary, first_run_id, report_path, run_count, first_seen, last_seen, "
+						"reporter_run_id) VALUES (?, ?, ?, ?, NULL, 1, ?, ?, ?)",
+						(task, json.dumps(signature), summary, run_id, now, now, run_id),
+					).lastrowid
+				else:
+					conn.execute(
+						"UPDATE failure_clusters SET run_count = run_count + 1, last_seen = ? WHERE id = ?",
+						(now, cluster_id),
+					)
+					reporting = self._claim_failure_cluster(conn, cluster_id, run_id)
+				conn.execute("UPDATE runs SET failure_cluster = ? WHERE id = ?", (cluster_id, run_id))
+				conn.execute("COMMIT")
+			except BaseException:
+				conn.execute("ROLLBACK")
+				raise
+		return cluster_id, reporting
+
+	@staticmethod
+	def _claim_failure_cluster(conn, cluster_id, run_id):
+		cursor = conn.execute(
+			"UPDATE failure_clusters SET reporter_run_id = ? WHERE id = ? AND report_path IS NULL AND reporter_run_id IS NULL",
+			(run_id, cluster_id),
+		)
+		return cursor.rowcount == 1
+
+	def claim_failure_cluster_report(self, cluster_id, run_id):
+		"""Make `run_id` the writer of a released cluster's report; False if it has a report or another writer."""
+		with self._lock:
+			return self._claim_failure_cluster(self._connect(), cluster_id, run_id)
+
+	def set_failure_cluster_report(self, cluster_id, report_path):
+		self._execute("UPDATE failure_clusters SET report_path = ?, reporter_run_id = NULL WHERE id = ?", (report_path, cluster_id))
+
+	def release_failure_cluster(self, cluster_id):
+		"""Give up writing a cluster's report, so the next run that matches it writes one instead."""
+		self._execute("UPDATE failure_clusters SET reporter_run_id = NULL WHERE id = ? AND report_path IS NULL", (cluster_id,))
+
+	def get_failure_cluster(self, cluster_id):
+		row = self._execute("SELECT * FROM failure_clusters WHERE id = ?", (cluster_id,)).fetchone()
+		return dict(row, signature=json.loads(row["signature"])) if row else None
+
+	def list_failure_clusters(self, task=None):
+		"""Return failure clusters, most recently seen first, with their MinHash signatures decoded."""
+		rows = self._execute(
+			"SELECT * FROM failure_clusters" + (" WHERE task = ?" if task else "") + " ORDER BY last_seen DESC",
+			(task,) if task else (),
+		).fetchall()
+		return [dict(row, signature=json.loads(row["signature"])) for row in rows]
+
+	def get_run(self, run_id):
+		"""Return the run with its steps, or None."""
+		run = self._execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+		if run is None:
+			return None
+		steps = self._execute("SELECT * FROM steps WHERE run_id = ? ORDER BY step_index", (run_id,)).fetchall()
+		result = _run_record(run)
+		result["steps"] = [
+			dict(
+				step,
+				action=json.loads(step["action"]) if step["action"] else None,
+				perf=json.loads(step["perf"]) if step["perf"] else None,
+			)
+			for step in steps
+		]
+		return result
+
+	def list_runs(self, limit=50, offset=0, since=None, until=None, has_errors=None, **filters):
+		"""Return a page of runs, newest first, matching the given column filters."""
+		where, params = [], []
+		for column in RUN_FILTERS:
+			if filters.get(column):
+				where.append(f"{column} = ?")
+				params.append(filters[column])
+		if since:
+			where.append("started_at >= ?")
+			params.append(since)
+		if until:
+			where.append("started_at < ?")
+			params.append(until)
+		if has_errors is not None:
+			where.append("has_errors = ?")
+			params.append(_bool(has_errors))
+		clause = f"WHERE {' AND '.join(where)}" if where else ""
+
+		total = self._execute(f"SELECT COUNT(*) FROM runs {clause}", params).fetchone()[0]
+		rows = self._execute(
+			f"SELECT * FROM runs {clause} ORDER BY started_at DESC LIMIT ? OFFSET ?",
+			(*params, limit, offset),
+		).fetchall()
+		return {"total": total, "items": [_run_record(row) for row in rows]}
+
+
+run_store = RunStore()
@@ -0,0 +1,68 @@
+BASE_URL = "http://localhost:8002"
+
+DEFAULT_DEVICE = "mobile"
+DEVICE_PROFILES = {
+	"mobile": {
+		"viewport": {"width": 390, "height": 844},
+		"user_agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+		"device_scale_factor": 2.0,
+	},
+	"tablet": {
+		"viewport": {"width": 820, "height": 1180},
+		"user_agent": "Mozilla/5.0 (iPad; CPU OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+		"device_scale_factor": 2.0,
+	},
+	"desktop": {
+		"viewport": {"width": 1440, "height": 900},
+		"user_agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+		"device_scale_factor": 1.0,
+	},
+}
+
+TASKS = {
+	"login": (
+		f"1. Go to {BASE_URL}\n"
+		"2. Find the login form on the page\n"
+		"3. Enter email: testuser@example.com and password: TestPass123!\n"
+		"4. Click the login/submit button. Solve any reCAPTCHA if present\n"
+		"5. Observe the result - did login succeed or fail?\n"
+		"6. Return what happened at each step"
+	),
+	"signup": (
+		f"1. Go to {BASE_URL}\n"
+		"2. Find the sign-up/register form or link on the page and click it\n"
+		"3. If you cannot find a sign-up/register form or link after checking the page, STOP and report that no signup option was found\n"
+		"4. Fill in the registration form with a random name, email, and password\n"
+		"5. Click the sign-up/register button\n"
+		"6. Observe the result - did registration succeed or fail?\n"
+		"7. Whether it succeeded or failed, STOP immediately and return what happened at each step. Do NOT retry or try alternative approaches"
+	),
+	"forget-password": (
+		f"1. Go to {BASE_URL}\n"
+		"2. Find and click the 'Forgot Password' or 'Reset Password' link on the page\n"
+		"3. Enter email: testuser@example.com\n"
+		"4. Click the submit/reset button\n"
+		"5. Observe the result - was a reset email sent? Any confirmation message?\n"
+		"6. Return what happened at each step"
+	),
+	"recaptcha": (
+		f"1. Go to {BASE_URL}\n"
+		"2. Check if there is a reCAPTCHA or CAPTCHA challenge on the page\n"
+		"3. If present, describe the type of CAPTCHA (checkbox, image, invisible, etc.)\n"
+		"4. Use the solve_recaptcha action to solve it - do NOT try to click the reCAPTCHA checkbox manually\n"
+		"5. Observe what happens - does it pass?\n"
+		"6. Return what happened at each step including CAPTCHA details"
+	),
+}
+
+# Screenshots sent to the vision model, per scenario: `scale` relative to the
+# captured frame (device pixels) and `roi` to crop each frame to the region
+# that changed since the previous step. See backend/vision.py for the defaults.
+VISION_SETTINGS = {
+	# Form flows: text is legible at CSS-pixel resolution and most steps only change one field
+	"login": {"scale": 0.5, "roi": True},
+	"signup": {"scale": 0.5, "roi": True},
+	"forget-password": {"scale": 0.5, "roi": True},
+	# CAPTCHA tiles need full detail and the whole widget in view
+	"recaptcha": {"scale": 1.0, "roi": False},
+}
@@ -0,0 +1,344 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from backend.metrics import span
+
+SLACK_OUTBOX_PATH = os.getenv("SLACK_OUTBOX_PATH", "results/slack_outbox.db")
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+SLACK_MAX_ATTEMPTS = int(os.getenv("SLACK_MAX_ATTEMPTS", "8"))
+SLACK_RETRY_BASE = float(os.getenv("SLACK_RETRY_BASE", "5"))
+SLACK_RETRY_MAX = float(os.getenv("SLACK_RETRY_MAX", "900"))
+# Minimum spacing between Slack API calls; file uploads are rate limited to ~20/min
+SLACK_MIN_INTERVAL = float(os.getenv("SLACK_MIN_INTERVAL", "3"))
+# When > 0, single-run notifications are collected and posted as one digest
+# message at most this many seconds after the first one arrived
+SLACK_DIGEST_INTERVAL = float(os.getenv("SLACK_DIGEST_INTERVAL", "0"))
+SLACK_DIGEST_MAX_LINES = 40
+# A worker's claim on a delivery; another worker may take the delivery over once it expires
+SLACK_CLAIM_SECONDS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	kind TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	status TEXT NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	next_attempt_at REAL NOT NULL,
+	last_error TEXT,
+	created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt_at);
+"""
+
+# Columns added after the first release, applied to outboxes created before them
+COLUMN_MIGRATIONS = (
+	("deliveries", "claimed_by", "TEXT"),
+	("deliveries", "claimed_until", "REAL"),
+)
+
+PENDING = "pending"
+DIGEST = "digest"
+SENT = "sent"
+MERGED = "merged"
+FAILED = "failed"
+
+
+def message_title(state):
+	if state == "pass":
+		return "🎉 Test passed! 🎉"
+	elif state == "fail":
+		return "🚨 Test failed! 🚨"
+	return "🤷‍♀️ Test unknown! 🤷‍♀️"
+
+
+def is_retryable(error):
+	"""Whether a failed Slack call may succeed later: rate limits, Slack server errors and network trouble.
+
+	Everything else (invalid_auth, not_in_channel, channel_not_found, missing
+	settings, a deleted report file) will fail the same way every time.
+	"""
+	from slack_sdk.errors import SlackApiError
+
+	if isinstance(error, SlackApiError):
+		status = error.response.status_code if error.response is not None else None
+		return status == 429 or (status is not None and status >= 500)
+	if isinstance(error, (FileNotFoundError, IsADirectoryError, PermissionError)):
+		return False
+	return isinstance(error, (OSError, TimeoutError))
+
+
+def digest_text(title, items):
+	"""Summarise many run results in one message, failures first.
+
+	Report paths are local to the worker, so they are not listed; a digest
+	with a combined report uploads that file instead.
+	"""
+	counts = {}
+	for item in items:
+		counts[item["state"]] = counts.get(item["state"], 0) + 1
+	summary = ", ".join(f"{count} {state}" for state, count in sorted(counts.items()))
+	lines = [f"📋 *{title}*: {len(items)} runs ({summary})"]
+
+	ordered = sorted(items, key=lambda item: item["state"] == "pass")
+	for item in ordered[:SLACK_DIGEST_MAX_LINES]:
+		icon = {"pass": "✅", "fail": "🚨"}.get(item["state"], "🤷")
+		note = f" ({item['note']})" if item.get("note") else ""
+		lines.append(f"{icon} {item['run_name']}{note}")
+	if len(ordered) > SLACK_DIGEST_MAX_LINES:
+		lines.append(f"…and {len(ordered) - SLACK_DIGEST_MAX_LINES} more")
+	return "\n".join(lines)
+
+
+class SlackOutbox:
+	"""Persistent, rate-limited Slack delivery queue drained by a background task.
+
+	Deliveries are stored in SQLite before anything is sent, so a crash or a
+	Slack outage only delays them. Failed calls are retried with exponential
+	backoff and jitter, honouring Retry-After on rate limits, and calls are
+	spaced `min_interval` apart. Blocking slack_sdk calls run in a thread so
+	the event loop is never stalled.
+
+	Workers sharing the outbox claim a delivery in a write transaction
+	before sending it, so each is posted once; a claim held by a worker
+	that died expires after SLACK_CLAIM_SECONDS.
+	"""
+
+	def __init__(self, path=SLACK_OUTBOX_PATH, min_interval=SLACK_MIN_INTERVAL, digest_interval=SLACK_DIGEST_INTERVAL):
+		self.path = path
+		self.min_interval = min_interval
+		self.digest_interval = digest_interval
+		self._conn = None
+		self._lock = threading.Lock()
+		self._client = None
+		self._worker = None
+		self._wakeup = None
+		self._last_call = 0.0
+		self._worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+	def _connect(self):
+		if self._conn is None:
+			os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+			self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+			self._conn.row_factory = sqlite3.Row
+			self._conn.execute("PRAGMA journal_mode=WAL")
+			self._conn.executescript(SCHEMA)
+			with self._transaction(self._conn) as conn:
+				for table, column, column_type in COLUMN_MIGRATIONS:
+					columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+					if column not in columns:
+						conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+		return self._conn
+
+	@staticmethod
+	@contextmanager
+	def _transaction(conn):
+		# IMMEDIATE takes the write lock up front, so workers sharing the outbox serialize here
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			yield conn
+			conn.execute("COMMIT")
+		except BaseException:
+			conn.execute("ROLLBACK")
+			raise
+
+	def _execute(self, sql, params=()):
+		with self._lock:
+			return self._connect().execute(sql, params)
+
+	@staticmethod
+	def _insert_row(conn, kind, payload, status):
+		now = time.time()
+		conn.execute(
+			"INSERT INTO deliveries (kind, payload, status, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+			(kind, json.dumps(payload), status, now, now),
+		)
+
+	def _insert(self, kind, payload, status):
+		with self._lock:
+			self._insert_row(self._connect(), kind, payload, status)
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	def enqueue_report(self, run_name, state, file_path, channel_id=None):
+		"""Queue a report upload.
+
+		In digest mode a passing run is only held for the next digest, which
+		lists it without its report; failures are still uploaded with theirs.
+		"""
+		payload = {"run_name": run_name, "state": state, "file_path": file_path, "channel_id": channel_id}
+		self._insert("report", payload, DIGEST if self.digest_interval > 0 and state == "pass" else PENDING)
+
+	def enqueue_digest(self, title, items, channel_id=None, file_path=None):
+		"""Queue one message summarising many runs (dicts with run_name, state and an optional note).
+
+		With `file_path` (e.g. a matrix's combined report) the file is uploaded
+		and the summary becomes its comment.
+		"""
+		self._insert("digest", {"title": title, "items": items, "channel_id": channel_id, "file_path": file_path}, PENDING)
+
+	def stats(self):
+		rows = self._execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall()
+		return {status: count for status, count in rows}
+
+	def _get_client(self):
+		if self._client is None:
+			from slack_sdk import WebClient
+
+			self._client = WebClient(os.getenv("SLACK_TOKEN"), base_url=SLACK_API_URL)
+		return self._client
+
+	async def start(self):
+		if self._worker is None:
+			self._wakeup = asyncio.Event()
+			self._worker = asyncio.create_task(self._run())
+
+	async def stop(self):
+		if self._worker is not None:
+			self._worker.cancel()
+			await asyncio.gather(self._worker, return_exceptions=True)
+			self._worker = None
+
+	async def drain(self, timeout=120):
+		"""Wait until nothing is due (used by the CLI before exiting); digests are flushed first."""
+		self._flush_digest(force=True)
+		deadline = time.time() + timeout
+		while time.time() < deadline:
+			due = self._execute(
+				"SELECT COUNT(*) FROM deliveries WHERE status = ? AND next_attempt_at <= ?",
+				(PENDING, time.time()),
+			).fetchone()[0]
+			if not due:
+				return
+			if self._wakeup is not None:
+				self._wakeup.set()
+			await asyncio.sleep(0.5)
+
+	def _flush_digest(self, force=False):
+		"""Fold held single-run notifications into one digest delivery once the window has passed.
+
+		Reading the held rows, queueing the digest and marking them merged is
+		one transaction, so no notification is lost or posted twice.
+		"""
+		with self._lock, self._transaction(self._connect()) as conn:
+			rows = conn.execute("SELECT id, payload, created_at FROM deliveries WHERE status = ? ORDER BY id", (DIGEST,)).fetchall()
+			if not rows or (not force and time.time() - rows[0]["created_at"] < self.digest_interval):
+				return
+			items = [json.loads(row["payload"]) for row in rows]
+			self._insert_row(conn, "digest", {"title": "Test run digest", "items": items, "channel_id": None, "file_path": None}, PENDING)
+			ids = [row["id"] for row in rows]
+			conn.execute(f"UPDATE deliveries SET status = ? WHERE id IN ({','.join('?' * len(ids))})", (MERGED, *ids))
+
+	def _claim_next(self):
+		"""Claim the next due delivery for this worker: returns (row, None), or (None, seconds until one is due)."""
+		now = time.time()
+		with self._lock, self._transaction(self._connect()) as conn:
+			row = conn.execute(
+				"SELECT * FROM deliveries WHERE status = ? AND (claimed_until IS NULL OR claimed_until < ?) "
+				"ORDER BY next_attempt_at LIMIT 1",
+				(PENDING, now),
+			).fetchone()
+			if row is None:
+				return None, None
+			if row["next_attempt_at"] > now:
+				return None, row["next_attempt_at"] - now
+			conn.execute(
+				"UPDATE deliveries SET claimed_by = ?, claimed_until = ? WHERE id = ?",
+				(self._worker_id, now + SLACK_CLAIM_SECONDS, row["id"]),
+			)
+		return row, None
+
+	async def _run(self):
+		failures = 0
+		while True:
+			try:
+				self._wakeup.clear()
+				if self.digest_interval > 0:
+					await asyncio.to_thread(self._flush_digest)
+				row, wait = await asyncio.to_thread(self._claim_next)
+				if row is not None:
+					await self._deliver(row)
+				else:
+					timeout = min(wait or self.digest_interval or 60, self.digest_interval or 60)
+					try:
+						await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.1, timeout))
+					except asyncio.TimeoutError:
+						pass
+				failures = 0
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				# E.g. the outbox database is locked or unreadable; keep the queue alive and try again
+				failures += 1
+				delay = min(SLACK_RETRY_MAX, SLACK_RETRY_BASE * 2 ** (failures - 1))
+				print(f"Slack outbox error, retrying in {delay:.0f}s: {e}")
+				await asyncio.sleep(delay)
+
+	async def _deliver(self, row):
+		pause = self._last_call + self.min_interval - time.time()
+		if pause > 0:
+			await asyncio.sleep(pause)
+		self._last_call = time.time()
+
+		try:
+			payload = json.loads(row["payload"])
+			with span("slack_upload", kind=row["kind"]):
+				await asyncio.to_thread(self._send, row["kind"], payload)
+		except Exception as e:
+			from slack_sdk.errors import SlackApiError
+
+			attempts = row["attempts"] + 1
+			retry_after = None
+			if isinstance(e, SlackApiError) and e.response is not None and e.response.status_code == 429:
+				retry_after = float(e.response.headers.get("Retry-After", 0) or 0)
+			delay = retry_after or min(SLACK_RETRY_MAX, SLACK_RETRY_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+			if not is_retryable(e):
+				status = FAILED
+				print(f"Error sending to Slack, not retrying: {e}")
+			else:
+				status = FAILED if attempts >= SLACK_MAX_ATTEMPTS else PENDING
+				print(f"Error sending to Slack (attempt {attempts}/{SLACK_MAX_ATTEMPTS}, retry in {delay:.0f}s): {e}")
+			self._execute(
+				"UPDATE deliveries SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL, "
+				"claimed_until = NULL WHERE id = ?",
+				(status, attempts, time.time() + delay, str(e), row["id"]),
+			)
+			return
+
+		self._execute(
+			"UPDATE deliveries SET status = ?, attempts = attempts + 1, claimed_by = NULL, claimed_until = NULL WHERE id = ?",
+			(SENT, row["id"]),
+		)
+		print("Slack message sent")
+
+	def _send(self, kind, payload):
+		channel_id = payload.get("channel_id") or os.getenv("SLACK_CHANNEL_ID")
+		if not os.getenv("SLACK_TOKEN") or not channel_id:
+			raise ValueError("SLACK_TOKEN and SLACK_CHANNEL_ID must be set")
+		client = self._get_client()
+		if kind == "digest" and payload.get("file_path"):
+			client.files_upload_v2(
+				file=payload["file_path"],
+				title=payload["title"],
+				channel=channel_id,
+				initial_comment=digest_text(payload["title"], payload["items"]),
+			)
+		elif kind == "digest":
+			client.chat_postMessage(channel=channel_id, text=digest_text(payload["title"], payload["items"]))
+		else:
+			client.files_upload_v2(
+				file=payload["file_path"],
+				title="Report",
+				channel=channel_id,
+				initial_comment=f"{message_title(payload['state'])}\n\nView report here for {payload['run_name']}",
+			)
+
+
+slack_outbox = SlackOutbox()
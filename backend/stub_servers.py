@@ -0,0 +1,224 @@
+import http.server
+import json
+import re
+import threading
+import time
+import uuid
+
+# Scripted stand-ins for the external services a run talks to, used by the
+# offline benchmark. Both speak just enough of the real wire protocol for the
+# OpenAI and Slack SDKs used by the backend.
+
+_STEP_INFO = re.compile(r"Step(\d+) maximum:")
+# backend.report_mapreduce.DETAILS_MARKER; not imported, as that would load the
+# LLM clients before the benchmark has pointed them at these stubs
+DETAILS_MARKER = "<!--REPORT_DETAILS-->"
+
+
+def _message_text(message):
+	content = message.get("content")
+	if isinstance(content, list):
+		return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+	return content or ""
+
+
+def _current_step(messages):
+	"""The 1-based agent step browser-use announces in its <step_info> block."""
+	for message in reversed(messages):
+		matches = _STEP_INFO.findall(_message_text(message))
+		if matches:
+			return int(matches[-1])
+	return 1
+
+
+def agent_action(step, target_url, steps):
+	"""Scripted agent output: navigate to the target `steps` times, then finish."""
+	if step <= steps:
+		action = {"navigate": {"url": target_url, "new_tab": False}}
+		next_goal = f"Load {target_url}"
+	else:
+		action = {"done": {"text": "Benchmark run finished: the page loaded and no action failed.", "success": True}}
+		next_goal = "Report the result"
+	return {
+		"thinking": "Following the benchmark script.",
+		"evaluation_previous_goal": "Success",
+		"memory": f"Benchmark step {step}",
+		"next_goal": next_goal,
+		"action": [action],
+	}
+
+
+def report_content(topic, screenshots=3, details=None):
+	"""A fixed report (verdict line, then HTML) that references the first few step screenshots.
+
+	`details` replaces The Details section, e.g. with DETAILS_MARKER for a map-reduce final pass.
+	"""
+	images = details if details is not None else "".join(
+		f'<h3>Step {i}</h3><img src="SCREENSHOT_STEP_{i}" style="max-width:100%;" /><p>Step {i} of the benchmark run.</p>'
+		for i in range(screenshots)
+	)
+	html = (
+		"<!DOCTYPE html><html><body style=\"font-family:sans-serif;\">"
+		f"<h1>Benchmark report: {topic}</h1>"
+		"<h2>Executive Summary</h2><p style=\"color:green;\">The scripted run passed. ✅</p>"
+		f"<h2>The Details</h2>{images}"
+		"<h2>Conclusion</h2><p>Generated by the offline stub LLM.</p>"
+		"</body></html>"
+	)
+	return f"pass\n{html}"
+
+
+def report_part(label):
+	"""A scripted map-step write-up of one part of a run."""
+	first_step = re.search(r"\d+", label)
+	step = first_step.group(0) if first_step else "0"
+	return {
+		"verdict": "pass",
+		"summary": f"The scripted steps in {label} all worked.",
+		"issues": [],
+		"details_html": f'<h3>{label}</h3><img src="SCREENSHOT_STEP_{step}" style="max-width:100%;" /><p>{label} of the benchmark run.</p>',
+	}
+
+
+def _usage(prompt_text, completion_text):
+	# Rough 4-characters-per-token estimate so token counters move realistically
+	prompt_tokens = max(1, len(prompt_text) // 4)
+	completion_tokens = max(1, len(completion_text) // 4)
+	return {
+		"prompt_tokens": prompt_tokens,
+		"completion_tokens": completion_tokens,
+		"total_tokens": prompt_tokens + completion_tokens,
+	}
+
+
+def make_llm_handler(target_url, agent_steps=1, latency=0.0, chunk_size=64):
+	"""OpenAI-compatible /chat/completions endpoint answering both the agent and the report LLM.
+
+	Structured-output requests are agent (or judge) calls and get the scripted
+	action for the announced step, or map-reduce report parts and get a
+	scripted write-up; streaming requests get the fixed report, split into
+	`chunk_size`-character SSE deltas. Every call sleeps `latency` seconds
+	first to stand in for model time.
+	"""
+	class Handler(http.server.BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+
+		def log_message(self, format, *args):
+			pass
+
+		def _send_json(self, body, status=200):
+			data = json.dumps(body).encode("utf-8")
+			self.send_response(status)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+		def do_POST(self):
+			length = int(self.headers.get("Content-Length") or 0)
+			request = json.loads(self.rfile.read(length) or b"{}")
+			if not self.path.endswith("/chat/completions"):
+				self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+				return
+			if latency:
+				time.sleep(latency)
+
+			messages = request.get("messages", [])
+			prompt_text = "\n".join(_message_text(m) for m in messages)
+			if request.get("stream"):
+				topic = re.search(r"Generate a professional report on: (.*)", prompt_text)
+				details = DETAILS_MARKER if DETAILS_MARKER in prompt_text else None
+				self._stream(request, report_content(topic.group(1) if topic else "benchmark", details=details), prompt_text)
+				return
+
+			schema = ((request.get("response_format") or {}).get("json_schema") or {}).get("schema") or {}
+			properties = schema.get("properties", {})
+			if "action" in properties:
+				content = agent_action(_current_step(messages), target_url, agent_steps)
+			elif "details_html" in properties:
+				part = re.search(r"Part: (.*)", prompt_text)
+				content = report_part(part.group(1) if part else "part")
+			elif "verdict" in properties:
+				content = {"reasoning": "Scripted benchmark run.", "verdict": True, "failure_reason": "", "impossible_task": False}
+			else:
+				content = {name: None for name in properties}
+			content = json.dumps(content)
+
+			self._send_json({
+				"id": f"chatcmpl-{uuid.uuid4().hex}",
+				"object": "chat.completion",
+				"created": int(time.time()),
+				"model": request.get("model", "stub"),
+				"choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+				"usage": _usage(prompt_text, content),
+			})
+
+		def _stream(self, request, content, prompt_text):
+			self.send_response(200)
+			self.send_header("Content-Type", "text/event-stream")
+			self.send_header("Cache-Control", "no-cache")
+			self.send_header("Connection", "close")
+			self.end_headers()
+			self.close_connection = True
+
+			chunk = {
+				"id": f"chatcmpl-{uuid.uuid4().hex}",
+				"object": "chat.completion.chunk",
+				"created": int(time.time()),
+				"model": request.get("model", "stub"),
+			}
+			for i in range(0, len(content), chunk_size):
+				delta = {"index": 0, "delta": {"content": content[i:i + chunk_size]}, "finish_reason": None}
+				self.wfile.write(f"data: {json.dumps({**chunk, 'choices': [delta]})}\n\n".encode("utf-8"))
+			done = {"index": 0, "delta": {}, "finish_reason": "stop"}
+			self.wfile.write(f"data: {json.dumps({**chunk, 'choices': [done]})}\n\n".encode("utf-8"))
+			if (request.get("stream_options") or {}).get("include_usage"):
+				usage = {**chunk, "choices": [], "usage": _usage(prompt_text, content)}
+				self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+			self.wfile.write(b"data: [DONE]\n\n")
+			self.wfile.flush()
+
+	return Handler
+
+
+def make_slack_handler(calls):
+	"""Fake Slack Web API that accepts any method; every call's method name is appended to `calls`."""
+	class Handler(http.server.BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+
+		def log_message(self, format, *args):
+			pass
+
+		def do_POST(self):
+			length = int(self.headers.get("Content-Length") or 0)
+			self.rfile.read(length)
+			method = "upload" if self.path.startswith("/upload/") else self.path.rsplit("/", 1)[-1]
+			calls.append(method)
+
+			file_id = f"F{uuid.uuid4().hex[:10].upper()}"
+			host = f"http://{self.headers.get('Host')}"
+			body = {
+				"ok": True,
+				"ts": f"{time.time():.6f}",
+				"channel": "CBENCHMARK",
+				"upload_url": f"{host}/upload/{file_id}",
+				"file_id": file_id,
+				"file": {"id": file_id},
+				"files": [{"id": file_id}],
+			}
+			data = json.dumps(body).encode("utf-8")
+			self.send_response(200)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+	return Handler
+
+
+def serve_in_background(handler, port=0, host="127.0.0.1"):
+	"""Start a threaded HTTP server on a daemon thread; port 0 picks a free port (see server_address)."""
+	httpd = http.server.ThreadingHTTPServer((host, port), handler)
+	httpd.daemon_threads = True
+	threading.Thread(target=httpd.serve_forever, daemon=True).start()
+	return httpd
@@ -0,0 +1,182 @@
+import asyncio
+import base64
+import io
+import math
+import os
+import re
+
+from PIL import Image, ImageChops
+
+from backend.scenarios import VISION_SETTINGS
+
+# Defaults for scenarios without their own VISION_SETTINGS entry. The scale is
+# relative to the captured frame, which is in device pixels (x2 on mobile/tablet)
+VISION_SCALE = float(os.getenv("VISION_SCALE", "0.5"))
+VISION_ROI = os.getenv("VISION_ROI", "0").lower() in ("1", "true", "yes")
+# A frame is cropped to the full-width band of rows that changed, padded by
+# VISION_ROI_PADDING pixels (of the image sent) and at least VISION_ROI_MIN_HEIGHT
+# tall, unless that band covers more than VISION_ROI_MAX_FRACTION of its height
+VISION_ROI_PADDING = int(os.getenv("VISION_ROI_PADDING", "48"))
+VISION_ROI_MIN_HEIGHT = int(os.getenv("VISION_ROI_MIN_HEIGHT", "240"))
+VISION_ROI_MAX_FRACTION = float(os.getenv("VISION_ROI_MAX_FRACTION", "0.5"))
+# Grey-level difference (0-255) below which a pixel counts as unchanged
+VISION_ROI_TOLERANCE = int(os.getenv("VISION_ROI_TOLERANCE", "24"))
+# Side of the square patch the vision model bills as one image token
+VISION_TOKEN_PATCH = int(os.getenv("VISION_TOKEN_PATCH", "28"))
+
+CURRENT_SCREENSHOT_LABEL = "Current screenshot:"
+_DATA_URL = re.compile(r"^data:(image/[\w.+-]+);base64,(.*)$", re.S)
+# Frames are diffed at this width, which is plenty to locate a change
+_DIFF_WIDTH = 256
+
+
+def vision_settings(task):
+	"""Return {"scale", "roi"} for a scenario, falling back to VISION_SCALE/VISION_ROI."""
+	return {"scale": VISION_SCALE, "roi": VISION_ROI, **VISION_SETTINGS.get(task, {})}
+
+
+def estimate_image_tokens(width, height, patch=VISION_TOKEN_PATCH):
+	"""Image tokens a patch-based vision model charges for a width x height image."""
+	return math.ceil(width / patch) * math.ceil(height / patch)
+
+
+def changed_region(previous, current, tolerance=VISION_ROI_TOLERANCE):
+	"""Bounding box (left, top, right, bottom) of what changed between two same-sized frames, or None."""
+	width = min(_DIFF_WIDTH, current.width)
+	size = (width, max(1, round(current.height * width / current.width)))
+	a = previous.convert("L").resize(size, Image.Resampling.BILINEAR)
+	b = current.convert("L").resize(size, Image.Resampling.BILINEAR)
+	box = ImageChops.difference(a, b).point(lambda p: 255 if p > tolerance else 0).getbbox()
+	if box is None:
+		return None
+	sx, sy = current.width / size[0], current.height / size[1]
+	return (
+		math.floor(box[0] * sx), math.floor(box[1] * sy),
+		min(current.width, math.ceil(box[2] * sx)), min(current.height, math.ceil(box[3] * sy)),
+	)
+
+
+def _band(box, height, padding, min_height):
+	"""Rows (top, bottom) covering `box` plus padding, at least min_height tall, inside the frame."""
+	top, bottom = box[1] - padding, box[3] + padding
+	grow = max(0, min(min_height, height) - (bottom - top))
+	top, bottom = top - grow // 2, bottom + grow - grow // 2
+	shift = max(0, -top) - max(0, bottom - height)
+	return max(0, top + shift), min(height, bottom + shift)
+
+
+class VisionFilter:
+	"""Shrinks the screenshots of one run before they reach the vision model.
+
+	Every image in a request is downscaled by `scale`. With `roi`, the current
+	screenshot is additionally cropped to the band of rows that changed since
+	the previous step when that band is small, and its label tells the model
+	which part of the viewport it is looking at. Only the copy sent to the
+	model changes; the captured frames (and so the report) stay full size.
+
+	Image tokens sent, and what the unfiltered images would have cost, are
+	accumulated until take_usage() so they can be attributed to steps.
+	"""
+
+	def __init__(self, scale=VISION_SCALE, roi=VISION_ROI):
+		self.scale = min(1.0, max(0.05, scale))
+		self.roi = roi
+		self._previous = None
+		self._current = None
+		self._cache = {}
+		self._tokens = 0
+		self._tokens_full = 0
+
+	def take_usage(self):
+		"""Return (image_tokens, image_tokens_full) sent since the last call, and reset them."""
+		usage = (self._tokens, self._tokens_full)
+		self._tokens = self._tokens_full = 0
+		return usage
+
+	def _scaled(self, img):
+		if self.scale >= 1.0:
+			return img
+		size = (max(1, round(img.width * self.scale)), max(1, round(img.height * self.scale)))
+		return img.resize(size, Image.Resampling.LANCZOS)
+
+	def _crop(self, img):
+		"""Crop `img` to the region changed since the previous current screenshot. Returns (img, label)."""
+		previous, self._previous = self._previous, img
+		if previous is None or previous.size != img.size:
+			return img, None
+		box = changed_region(previous, img)
+		if box is None:
+			return img, None
+		top, bottom = _band(box, img.height, math.ceil(VISION_ROI_PADDING / self.scale), math.ceil(VISION_ROI_MIN_HEIGHT / self.scale))
+		if (bottom - top) / img.height > VISION_ROI_MAX_FRACTION:
+			return img, None
+		label = (
+			f"{CURRENT_SCREENSHOT_LABEL} (cropped to the part of the viewport that changed since the previous step, "
+			f"{top / img.height:.0%}-{bottom / img.height:.0%} of its height from the top; everything else is unchanged)"
+		)
+		return img.crop((0, top, img.width, bottom)), label
+
+	def _process(self, url, current):
+		"""Filter one data URL. Returns (url, label or None, tokens sent, tokens at full size)."""
+		match = _DATA_URL.match(url)
+		if not match:
+			return url, None, 0, 0
+		if not current and url in self._cache:
+			return self._cache[url]
+		if current and self._current and self._current[0] == url:
+			# Same frame again (a retried step): don't diff it against itself
+			return self._current[1]
+
+		media_type, data = match.groups()
+		original = Image.open(io.BytesIO(base64.b64decode(data)))
+		original.load()
+		full_tokens = estimate_image_tokens(original.width, original.height)
+		img, label = self._crop(original) if current and self.roi else (original, None)
+		out = self._scaled(img)
+		if out is original:
+			result = url, None, full_tokens, full_tokens
+		else:
+			buffer = io.BytesIO()
+			out.save(buffer, format="JPEG" if media_type == "image/jpeg" else "PNG")
+			encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+			result = f"data:{media_type};base64,{encoded}", label, estimate_image_tokens(out.width, out.height), full_tokens
+
+		if current:
+			self._current = url, result
+		else:
+			# Earlier screenshots come back in later requests; keep only the latest few
+			if len(self._cache) >= 8:
+				self._cache.pop(next(iter(self._cache)))
+			self._cache[url] = result
+		return result
+
+	def _filter(self, messages):
+		tokens = tokens_full = 0
+		filtered = []
+		for message in messages:
+			content = getattr(message, "content", None)
+			if not isinstance(content, list) or not any(getattr(part, "type", None) == "image_url" for part in content):
+				filtered.append(message)
+				continue
+			parts = list(content)
+			for i, part in enumerate(parts):
+				if getattr(part, "type", None) != "image_url":
+					continue
+				label_part = parts[i - 1] if i and getattr(parts[i - 1], "type", None) == "text" else None
+				current = label_part is not None and label_part.text == CURRENT_SCREENSHOT_LABEL
+				url, label, sent, full = self._process(part.image_url.url, current)
+				tokens += sent
+				tokens_full += full
+				if url != part.image_url.url:
+					parts[i] = part.model_copy(update={"image_url": part.image_url.model_copy(update={"url": url})})
+				if label:
+					parts[i - 1] = label_part.model_copy(update={"text": label})
+			filtered.append(message.model_copy(update={"content": parts}))
+		return filtered, tokens, tokens_full
+
+	async def prepare(self, messages):
+		"""Return (messages with filtered images, image tokens sent, image tokens at full size)."""
+		messages, tokens, tokens_full = await asyncio.to_thread(self._filter, messages)
+		self._tokens += tokens
+		self._tokens_full += tokens_full
+		return messages, tokens, tokens_full
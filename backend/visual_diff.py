@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from backend.blob_store import read_manifest
+from backend.images import get_image_pool
+from backend.metrics import span
+from backend.run_store import run_store
+
+# A step counts as changed when its structural similarity drops below this...
+VISUAL_SSIM_THRESHOLD = float(os.getenv("VISUAL_SSIM_THRESHOLD", "0.98"))
+# ...or when more than this fraction of pixels moved by over VISUAL_PIXEL_TOLERANCE grey levels
+VISUAL_PIXEL_THRESHOLD = float(os.getenv("VISUAL_PIXEL_THRESHOLD", "0.002"))
+VISUAL_PIXEL_TOLERANCE = int(os.getenv("VISUAL_PIXEL_TOLERANCE", "16"))
+# Frames whose 64-bit difference hashes differ in more bits than this changed for sure; SSIM is skipped for them
+VISUAL_HASH_THRESHOLD = int(os.getenv("VISUAL_HASH_THRESHOLD", "10"))
+# Screenshots are compared at this width; DPR-2 frames carry no extra signal for a diff
+VISUAL_DIFF_WIDTH = int(os.getenv("VISUAL_DIFF_WIDTH", "512"))
+VISUAL_SSIM_WINDOW = 7
+
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+
+_STEP_FILE = re.compile(r"^step_(\d+)\.png$")
+
+
+def _file_digest(path):
+	with open(path, "rb") as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+
+def _load_grey(path, width=VISUAL_DIFF_WIDTH, size=None):
+	with Image.open(path) as img:
+		grey = img.convert("L")
+	if size is None and grey.width > width:
+		size = (width, max(1, round(grey.height * width / grey.width)))
+	if size is not None and grey.size != size:
+		grey = grey.resize(size, Image.Resampling.BILINEAR)
+	return grey
+
+
+def dhash(grey, hash_size=8):
+	"""64-bit difference hash: whether each pixel is brighter than its right neighbour."""
+	small = np.asarray(grey.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR), dtype=np.int16)
+	return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), "big")
+
+
+def _box_mean(a, size):
+	"""Mean over a size x size window around every pixel, via a summed-area table."""
+	pad = size // 2
+	table = np.pad(np.pad(a, pad, mode="edge").cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+	total = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+	return total / (size * size)
+
+
+def ssim_map(x, y, size=VISUAL_SSIM_WINDOW):
+	"""Per-pixel structural similarity of two greyscale arrays (0-255)."""
+	c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+	mx, my = _box_mean(x, size), _box_mean(y, size)
+	sxx = _box_mean(x * x, size) - mx * mx
+	syy = _box_mean(y * y, size) - my * my
+	sxy = _box_mean(x * y, size) - mx * my
+	return ((2 * mx * my + c1) * (2 * sxy + c2)) / ((mx * mx + my * my + c1) * (sxx + syy + c2))
+
+
+def compare_step(baseline_path, current_path, heatmap_path):
+	"""Compare one pair of screenshots. Runs in a worker process.
+
+	Returns the step's metrics and verdict; when the step changed, a heatmap
+	of where it changed (red over the dimmed baseline) is written to
+	`heatmap_path`. Frames whose difference hashes are far apart are changed
+	without computing SSIM (reported as None).
+	"""
+	if _file_digest(baseline_path) == _file_digest(current_path):
+		return {"verdict": UNCHANGED, "identical": True, "hash_distance": 0, "ssim": 1.0, "changed_pixels": 0.0, "heatmap": None}
+
+	baseline = _load_grey(baseline_path)
+	current = _load_grey(current_path, size=baseline.size)
+	hash_distance = bin(dhash(baseline) ^ dhash(current)).count("1")
+
+	x = np.asarray(baseline, dtype=np.float64)
+	y = np.asarray(current, dtype=np.float64)
+	diff = np.abs(x - y)
+	changed_pixels = float((diff > VISUAL_PIXEL_TOLERANCE).mean())
+	if hash_distance > VISUAL_HASH_THRESHOLD:
+		similarity, ssim, verdict = None, None, CHANGED
+	else:
+		similarity = ssim_map(x, y)
+		ssim = float(similarity.mean())
+		verdict = CHANGED if ssim < VISUAL_SSIM_THRESHOLD or changed_pixels > VISUAL_PIXEL_THRESHOLD else UNCHANGED
+
+	heatmap = None
+	if verdict == CHANGED:
+		heat = np.clip((diff / 255 if similarity is None else np.maximum(diff / 255, 1 - similarity)) * 2, 0, 1)
+		background = x * 0.35
+		rgb = np.stack([np.maximum(background, heat * 255), background * (1 - heat), background * (1 - heat)], axis=-1)
+		os.makedirs(os.path.dirname(heatmap_path), exist_ok=True)
+		Image.fromarray(rgb.astype(np.uint8), "RGB").save(heatmap_path, optimize=True)
+		heatmap = heatmap_path
+
+	return {
+		"verdict": verdict,
+		"identical": False,
+		"hash_distance": hash_distance,
+		"ssim": round(ssim, 5) if ssim is not None else None,
+		"changed_pixels": round(changed_pixels, 5),
+		"heatmap": heatmap,
+	}
+
+
+def _step_files(screenshots_dir):
+	if not os.path.isdir(screenshots_dir):
+		return {}
+	return {
+		int(match.group(1)): os.path.join(screenshots_dir, match.group(0))
+		for match in map(_STEP_FILE.match, os.listdir(screenshots_dir))
+		if match
+	}
+
+
+async def compare_runs(baseline, run):
+	"""Diff every step screenshot of `run` against the same step of `baseline` (run store records).
+
+	Writes heatmaps and summary.json to the run's visual_diff/ directory and
+	returns the summary. The run is unchanged only when every step matches,
+	the step counts agree and both runs ended with the same outcome.
+	"""
+	diff_dir = f"{run['output_dir']}/visual_diff"
+	baseline_files = _step_files(f"{baseline['output_dir']}/screenshots")
+	current_files = _step_files(f"{run['output_dir']}/screenshots")
+
+	# Frames stored as the same blob are identical without opening either file
+	baseline_blobs = read_manifest(f"{baseline['output_dir']}/screenshots")
+	current_blobs = read_manifest(f"{run['output_dir']}/screenshots")
+	shared = sorted(set(baseline_files) & set(current_files))
+	same_blob = [step for step in shared if baseline_blobs.get(str(step)) and baseline_blobs.get(str(step)) == current_blobs.get(str(step))]
+	pairs = [step for step in shared if step not in same_blob]
+
+	loop = asyncio.get_running_loop()
+	pool = get_image_pool()
+	results = await asyncio.gather(*(
+		loop.run_in_executor(pool, compare_step, baseline_files[step], current_files[step], f"{diff_dir}/step_{step}.png")
+		for step in pairs
+	))
+
+	steps = [{"step": step, **result} for step, result in zip(pairs, results)]
+	steps += [{"step": step, "verdict": UNCHANGED, "identical": True} for step in same_blob]
+	steps += [{"step": step, "verdict": "missing"} for step in sorted(set(baseline_files) - set(current_files))]
+	steps += [{"step": step, "verdict": "added"} for step in sorted(set(current_files) - set(baseline_files))]
+	steps.sort(key=lambda step: step["step"])
+
+	changed_steps = [step["step"] for step in steps if step["verdict"] != UNCHANGED]
+	same_outcome = baseline["is_successful"] == run["is_successful"] and baseline["number_of_steps"] == run["number_of_steps"]
+	summary = {
+		"run_id": run["id"],
+		"baseline_run_id": baseline["id"],
+		"verdict": UNCHANGED if not changed_steps and same_outcome else CHANGED,
+		"same_outcome": same_outcome,
+		"changed_steps": changed_steps,
+		"steps": steps,
+	}
+	os.makedirs(diff_dir, exist_ok=True)
+	with open(f"{diff_dir}/summary.json", "w") as f:
+		json.dump(summary, f, indent=2)
+	return summary
+
+
+async def compare_to_baseline(run_id):
+	"""Compare a finished run with the blessed baseline of its task/device and record the verdict.
+
+	Returns the summary, or None when no other run has been blessed for it.
+	"""
+	run = run_store.get_run(run_id)
+	baseline = run_store.get_baseline(run["task"], run["device"]) if run else None
+	if baseline is None or baseline["id"] == run_id:
+		return None
+	with span("visual_diff", run_id=run_id, baseline=baseline["id"]):
+		summary = await compare_runs(baseline, run)
+	run_store.set_visual_verdict(run_id, summary["verdict"])
+	return summary
+
+
+def reuse_baseline_report(summary, output_dir):
+	"""Copy the baseline's report into an unchanged run's output_dir and return (state, html).
+
+	Returns None when the baseline has no usable report, in which case the
+	caller generates one as usual.
+	"""
+	baseline = run_store.get_run(summary["baseline_run_id"])
+	if baseline is None or baseline["report_state"] not in ("pass", "fail") or not baseline["report_path"]:
+		return None
+	if not os.path.exists(baseline["report_path"]):
+		return None
+	with open(baseline["report_path"], encoding="utf-8") as f:
+		html_output = f.read()
+
+	note = (
+		'<p style="background:#eef;padding:8px;border-radius:4px;">'
+		f"Visually unchanged from baseline run {baseline['id']}: this report was reused from it without a new LLM call.</p>"
+	)
+	body = re.search(r"<body[^>]*>", html_output)
+	html_output = html_output[:body.end()] + note + html_output[body.end():] if body else note + html_output
+
+	thumbnails_dir = os.path.join(os.path.dirname(baseline["report_path"]), "thumbnails")
+	if os.path.isdir(thumbnails_dir):
+		shutil.copytree(thumbnails_dir, f"{output_dir}/thumbnails", dirs_exist_ok=True)
+	with open(f"{output_dir}/report.html", "w", encoding="utf-8") as f:
+		f.write(html_output)
+	return baseline["report_state"], html_output
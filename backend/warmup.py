@@ -0,0 +1,118 @@
+import asyncio
+import importlib
+import os
+import sys
+import time
+
+from backend.browser_pool import browser_pool
+from backend.images import REPORT_IMAGE_WORKERS, get_image_pool
+from backend.llm_clients import create_agent_llm, get_report_client
+from backend.metrics import span
+from backend.scenarios import DEFAULT_DEVICE, DEVICE_PROFILES
+from backend.slack import slack_outbox
+
+# Warm up in the background as soon as the API starts; 0 leaves it to POST /api/warmup
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1").lower() in ("1", "true", "yes")
+# Per-component limit, so a browser that never comes up cannot hold /api/warmup forever
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "120"))
+
+# Modules whose import is deferred until a run (or Slack delivery) needs them
+HEAVY_MODULES = ("backend.agents", "backend.visual_diff", "openai", "slack_sdk")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _import_heavy_modules():
+	for name in HEAVY_MODULES:
+		importlib.import_module(name)
+
+
+async def _import_modules():
+	# Importing browser_use takes over a second; keep it off the event loop so requests are still served
+	await asyncio.to_thread(_import_heavy_modules)
+
+
+async def _create_llm_clients():
+	get_report_client()
+	create_agent_llm()
+
+
+async def _create_slack_client():
+	slack_outbox._get_client()
+
+
+async def _launch_browsers():
+	"""Pre-launch the default device profile so the first run skips the Chromium cold start."""
+	await browser_pool.warm(DEFAULT_DEVICE, DEVICE_PROFILES[DEFAULT_DEVICE])
+
+
+async def _start_image_workers():
+	# Spawned workers start on demand; one no-op per worker brings them all up
+	loop = asyncio.get_running_loop()
+	pool = get_image_pool()
+	await asyncio.gather(*(loop.run_in_executor(pool, os.getpid) for _ in range(max(1, REPORT_IMAGE_WORKERS))))
+
+
+class Warmup:
+	"""Loads and starts everything the first run would otherwise pay for.
+
+	Components are warmed at most once: a repeated or concurrent run() waits
+	for the one in progress and only retries components that failed. status()
+	only reports what has happened and never triggers any of it.
+	"""
+
+	COMPONENTS = {
+		"imports": _import_modules,
+		"llm_clients": _create_llm_clients,
+		"slack_client": _create_slack_client,
+		"browser": _launch_browsers,
+		"image_workers": _start_image_workers,
+	}
+
+	def __init__(self):
+		self.components = {name: {"status": PENDING, "seconds": None, "error": None} for name in self.COMPONENTS}
+		self._lock = asyncio.Lock()
+
+	@property
+	def ready(self):
+		return all(component["status"] == DONE for component in self.components.values())
+
+	async def _warm(self, name):
+		component = self.components[name]
+		component.update(status=RUNNING, error=None)
+		start = time.perf_counter()
+		try:
+			with span("warmup", component=name):
+				await asyncio.wait_for(self.COMPONENTS[name](), WARMUP_TIMEOUT)
+			component["status"] = DONE
+		except asyncio.TimeoutError:
+			print(f"Warm-up of {name} timed out after {WARMUP_TIMEOUT:.0f}s, it will be initialized on first use")
+			component.update(status=FAILED, error=f"timed out after {WARMUP_TIMEOUT:.0f}s")
+		except Exception as e:
+			print(f"Warm-up of {name} failed, it will be initialized on first use: {e}")
+			component.update(status=FAILED, error=str(e))
+		component["seconds"] = round(time.perf_counter() - start, 3)
+
+	async def run(self):
+		"""Warm every component not yet warm and return status()."""
+		async with self._lock:
+			todo = [name for name, component in self.components.items() if component["status"] != DONE]
+			# The clients come from the imported modules; the browser and image workers are independent
+			for name in ("imports", "llm_clients", "slack_client"):
+				if name in todo:
+					await self._warm(name)
+			await asyncio.gather(*(self._warm(name) for name in ("browser", "image_workers") if name in todo))
+		return self.status()
+
+	def status(self):
+		return {
+			"ready": self.ready,
+			"components": {name: dict(component) for name, component in self.components.items()},
+			"loaded_modules": {name: name in sys.modules for name in HEAVY_MODULES},
+		}
+
+
+warmup = Warmup()
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import time
+
+import psutil
+
+from backend.browser_pool import browser_pool, kill_process_tree
+from backend.metrics import BROWSERS_REAPED, span
+
+# Wall-clock limit of the browser part of a run; 0 disables it
+RUN_DEADLINE_SECONDS = float(os.getenv("RUN_DEADLINE_SECONDS", "600"))
+# New runs wait while this process and its children (browsers, image workers) use more than this; 0 disables it
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "0"))
+# ...or while the host has less than this available
+MEMORY_MIN_AVAILABLE_MB = int(os.getenv("MEMORY_MIN_AVAILABLE_MB", "512"))
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "30"))
+# Browsers younger than this are never reaped, so a launch in progress is not mistaken for a leak
+WATCHDOG_GRACE_SECONDS = float(os.getenv("WATCHDOG_GRACE_SECONDS", "60"))
+
+# Passed to Task.cancel() by the cancel endpoint, so a cancelled run can be told apart from a shutdown
+CANCEL_MESSAGE = "cancelled through the API"
+
+# browser-use launches every browser with a temporary profile directory named like this
+BROWSER_PROFILE_MARKER = "browser-use-user-data-dir-"
+
+
+class RunCancelledError(Exception):
+	"""Raised by a run that was cancelled through the API."""
+
+
+class RunDeadlineError(Exception):
+	"""Raised by a run that exceeded its wall-clock deadline."""
+
+
+class ActiveRuns:
+	"""The browser tasks of runs in progress, by run id, so one can be cancelled on its own."""
+
+	def __init__(self):
+		self._tasks = {}
+
+	def register(self, run_id, task):
+		self._tasks[run_id] = task
+
+	def unregister(self, run_id):
+		self._tasks.pop(run_id, None)
+
+	def cancel(self, run_id):
+		"""Cancel the run's browser task; returns False if it isn't running here."""
+		task = self._tasks.get(run_id)
+		if task is None or task.done():
+			return False
+		task.cancel(CANCEL_MESSAGE)
+		return True
+
+	def __contains__(self, run_id):
+		return run_id in self._tasks
+
+	def __len__(self):
+		return len(self._tasks)
+
+
+def _is_browser_root(proc):
+	"""A browser-use Chromium main process (not one of its renderer/GPU/utility children)."""
+	cmdline = proc.info.get("cmdline") or []
+	return (
+		any(BROWSER_PROFILE_MARKER in arg for arg in cmdline if arg.startswith("--user-data-dir"))
+		and not any(arg.startswith("--type=") for arg in cmdline)
+	)
+
+
+def tree_rss_mb(pid=None):
+	"""Resident memory of a process and all its descendants, in MB."""
+	proc = psutil.Process(pid or os.getpid())
+	total = 0
+	for p in [proc] + proc.children(recursive=True):
+		try:
+			total += p.memory_info().rss
+		except psutil.Error:
+			pass
+	return total / 2**20
+
+
+class ResourceWatchdog:
+	"""Reaps leaked browsers and holds back new runs while memory is short.
+
+	Every `interval` seconds it looks for browser-use Chromium processes that
+	nobody owns any more: orphans of a crashed or killed worker (re-parented
+	to init) and children of this process that the browser pool no longer
+	tracks, e.g. after a failed close. Both are killed with their renderers.
+	admit() makes a new run wait while this process tree uses more than
+	`budget_mb` or the host has less than `min_available_mb` available;
+	idle pooled browsers are closed first to make room.
+	"""
+
+	def __init__(self, pool=browser_pool, budget_mb=MEMORY_BUDGET_MB, min_available_mb=MEMORY_MIN_AVAILABLE_MB,
+			interval=WATCHDOG_INTERVAL, grace=WATCHDOG_GRACE_SECONDS):
+		self.pool = pool
+		self.budget_mb = budget_mb
+		self.min_available_mb = min_available_mb
+		self.interval = interval
+		self.grace = grace
+		self.reaped = 0
+		self.held = 0
+		self.waiting = 0
+		self._task = None
+
+	def memory(self):
+		return {
+			"used_mb": round(tree_rss_mb()),
+			"available_mb": round(psutil.virtual_memory().available / 2**20),
+			"budget_mb": self.budget_mb or None,
+			"min_available_mb": self.min_available_mb or None,
+		}
+
+	def over_budget(self, memory=None):
+		memory = memory or self.memory()
+		return bool(
+			(self.budget_mb and memory["used_mb"] > self.budget_mb)
+			or (self.min_available_mb and memory["available_mb"] < self.min_available_mb)
+		)
+
+	def find_leaked(self):
+		"""Return [(psutil.Process, reason)] for browser-use browsers that no run or pool owns."""
+		me = os.getpid()
+		owned = self.pool.pids()
+		# Without every pooled browser's pid, our own children can't be told apart from leaks
+		know_all = None not in owned
+		now = time.time()
+		leaked = []
+		for proc in psutil.process_iter(["pid", "ppid", "cmdline", "create_time"]):
+			try:
+				if not _is_browser_root(proc) or now - proc.info["create_time"] < self.grace or proc.pid in owned:
+					continue
+				ppid = proc.info["ppid"]
+				if ppid == me:
+					# Ours - or, when this worker is PID 1 as in a container, reparented to us - but not the pool's
+					if know_all:
+						leaked.append((proc, "untracked"))
+				elif ppid in (0, 1) or not psutil.pid_exists(ppid):
+					leaked.append((proc, "orphaned"))
+			except psutil.Error:
+				continue
+		return leaked
+
+	async def reap(self):
+		"""Kill leaked browsers; returns how many were killed."""
+		leaked = await asyncio.to_thread(self.find_leaked)
+		for proc, reason in leaked:
+			print(f"Watchdog: killing {reason} browser process {proc.pid}")
+			await asyncio.to_thread(kill_process_tree, proc)
+			BROWSERS_REAPED.labels(reason).inc()
+		self.reaped += len(leaked)
+		return len(leaked)
+
+	async def sweep(self):
+		with span("watchdog_sweep"):
+			await self.reap()
+			if self.over_budget(await asyncio.to_thread(self.memory)):
+				closed = await self.pool.close_idle()
+				if closed:
+					print(f"Watchdog: over the memory budget, closed {closed} idle browser(s)")
+
+	async def admit(self, poll=2.0):
+		"""Wait until there is memory for another run."""
+		memory = await asyncio.to_thread(self.memory)
+		if not self.over_budget(memory):
+			return
+		self.held += 1
+		self.waiting += 1
+		print(f"Watchdog: holding a new run back, memory {memory}")
+		try:
+			with span("memory_wait"):
+				await self.pool.close_idle()
+				while self.over_budget(await asyncio.to_thread(self.memory)):
+					await asyncio.sleep(poll)
+		finally:
+			self.waiting -= 1
+
+	async def _run(self):
+		while True:
+			try:
+				await self.sweep()
+			except Exception as e:
+				print(f"Watchdog sweep failed: {e}")
+			await asyncio.sleep(self.interval)
+
+	async def start(self):
+		if self._task is None and self.interval > 0:
+			self._task = asyncio.create_task(self._run())
+
+	async def stop(self):
+		if self._task is not None:
+			self._task.cancel()
+			await asyncio.gather(self._task, return_exceptions=True)
+			self._task = None
+
+	def stats(self):
+		return {
+			"active_runs": len(active_runs),
+			"reaped": self.reaped,
+			"held": self.held,
+			"waiting": self.waiting,
+			"memory": self.memory(),
+		}
+
+
+active_runs = ActiveRuns()
+watchdog = ResourceWatchdog()
@@ -1,7 +1,10 @@
 // API Integration 
+// The backend API runs next to the dashboard server (see README)
+export const API_ORIGIN = 'http://localhost:8000';
+
 export const API = {
     // Base URL for backend API
-    baseUrl: '/api',
+    baseUrl: `${API_ORIGIN}/api`,
     
     // Start new test
     async startTest(config) {
@@ -54,14 +57,40 @@ export const API = {
             console.error('Error rerunning test:', error);
             throw error;
         }
+    },
+
+    // Stream a job's report as it is written, calling onChunk with the HTML so far
+    async streamReport(jobId, onChunk) {
+        const response = await fetch(`${this.baseUrl}/tests/${jobId}/report/stream`);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let html = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            html += decoder.decode(value, { stream: true });
+            onChunk(html);
+        }
+        return html;
     }
 };
 
 // WebSocket connection for real-time updates
-export function initializeWebSocket() {
-    // Uncomment and configure when you have a WebSocket server
-    /*
-    const ws = new WebSocket('ws://localhost:8081/ws');
+export const EVENTS_URL = `${API_ORIGIN.replace(/^http/, 'ws')}/ws/events`;
+
+// filters: { run_id, job_id } to only receive one run's or one job's events.
+// Returns the connection; close() it to stop receiving (and reconnecting).
+export function initializeWebSocket(filters = {}, connection = null) {
+    connection = connection || {
+        closed: false,
+        close() {
+            this.closed = true;
+            this.socket.close();
+        }
+    };
+    const query = new URLSearchParams(Object.entries(filters).filter(([, value]) => value)).toString();
+    const ws = new WebSocket(query ? `${EVENTS_URL}?${query}` : EVENTS_URL);
+    connection.socket = ws;
     
     ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
@@ -69,27 +98,56 @@ export function initializeWebSocket() {
         // Handle different types of updates
         switch(data.type) {
             case 'test_started':
-                console.log('Test started:', data.testId);
+                console.log('Test started:', data.run_id, data.task, data.device);
                 break;
             case 'test_progress':
-                updateTestProgress(data.testId, data.progress);
+                updateTestProgress(data.run_id, data);
                 break;
             case 'test_completed':
-                console.log('Test completed:', data.testId);
+                console.log('Test completed:', data.run_id, data.status);
                 refreshDashboard();
                 break;
             case 'issue_found':
-                console.log('Issue found:', data.issue);
+                console.log('Issue found:', data.run_id, `step ${data.step}`, data.error);
                 break;
         }
+        // Let any view react to run events without importing this module
+        window.dispatchEvent(new CustomEvent('test-event', { detail: data }));
     };
     
     ws.onerror = (error) => {
         console.error('WebSocket error:', error);
     };
     
-    return ws;
-    */
+    // Reconnect after the backend restarts, unless the subscriber is done with it
+    ws.onclose = () => {
+        if (!connection.closed) {
+            setTimeout(() => initializeWebSocket(filters, connection), 3000);
+        }
+    };
+    
+    return connection;
+}
+
+// Show each finished agent step in the card of the test that ran it
+export function updateTestProgress(runId, progress) {
+    const card = document.querySelector(`[data-job-id="${progress.job_id}"]`);
+    if (!card) return;
+    card.dataset.runId = runId;
+    card.querySelector('.live-test-detail').textContent =
+        `Step ${progress.step + 1}: ${progress.next_goal || progress.title || progress.url || ''}`;
+    if (progress.thumbnail) {
+        const thumbnail = card.querySelector('.live-test-thumbnail');
+        thumbnail.src = `${API_ORIGIN}${progress.thumbnail}`;
+        thumbnail.style.display = 'block';
+    }
+    // A step can arrive on more than one socket (the dashboard's and the test's own)
+    if (progress.success === false) {
+        card.failedSteps = card.failedSteps || new Set();
+        card.failedSteps.add(progress.step);
+        const issues = card.failedSteps.size;
+        card.querySelector('.live-test-issues').textContent = ` • ${issues} issue${issues === 1 ? '' : 's'}`;
+    }
 }
 
 // Helper function to update dashboard with real data
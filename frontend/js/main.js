@@ -18,5 +18,8 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize charts
     initCharts();
     
+    // Subscribe to live test run events
+    initializeWebSocket();
+    
     console.log('✅ All modules loaded successfully');
 });
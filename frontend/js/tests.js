@@ -3,7 +3,7 @@
 import { switchTab } from './navigation.js';
 import { closeModal, closeDetailsModal } from './modals.js';
 import { showNewTestModal } from './modals.js';
-// import { API } from './api.js';
+import { API, initializeWebSocket } from './api.js';
 
 export function quickTest(scenario) {
     const scenarioSelect = document.getElementById('quick-scenario');
@@ -52,15 +52,103 @@ export function startQuickTest(e) {
     }, 2000);
 }
 
-export function runTest(e) {
-    const testType = document.getElementById("new-test-form-scenario").value;
+function setCardStatus(card, status, label) {
+    const badge = card.querySelector('.status-badge');
+    badge.className = `status-badge status-${status}`;
+    badge.textContent = label;
+}
+
+// A card in Recent Test Runs that follows a submitted job live
+function createLiveTestCard(job, name) {
+    const card = document.createElement('div');
+    card.className = 'p-4 rounded-lg';
+    card.style.background = 'var(--surface-light)';
+    card.dataset.jobId = job.id;
+    card.innerHTML = `
+        <div class="flex items-center justify-between">
+            <div class="flex items-center gap-4 flex-1 min-w-0">
+                <div class="status-badge status-running">Queued</div>
+                <div class="flex-1 min-w-0">
+                    <div class="font-semibold truncate"></div>
+                    <div class="text-sm" style="color: var(--text-muted);"><span class="live-test-detail">Waiting for a free worker...</span><span class="live-test-issues"></span></div>
+                </div>
+            </div>
+            <img class="live-test-thumbnail" alt="" style="display: none; height: 48px; border-radius: 4px;">
+        </div>
+        <iframe class="live-test-report" title="Report" style="display: none; width: 100%; height: 320px; margin-top: 1rem; border: 0; border-radius: 8px; background: #fff;"></iframe>
+    `;
+    card.querySelector('.font-semibold').textContent = name;
+    document.getElementById('recent-tests-list').prepend(card);
+    return card;
+}
 
-    fetch('http://localhost:8000/api/test/' + testType)
-    .then(response => response.json())
-    .then(data => console.log(data));
+function followTestRun(job, card) {
+    const events = initializeWebSocket({ job_id: job.id });
+    const listener = (event) => {
+        const data = event.detail;
+        if (data.job_id !== job.id) return;
+        if (data.type === 'test_started') {
+            setCardStatus(card, 'running', 'Running');
+            card.querySelector('.live-test-detail').textContent = 'Starting the browser...';
+        } else if (data.type === 'test_completed') {
+            card.querySelector('.live-test-detail').textContent = data.status === 'done'
+                ? `${data.number_of_steps} steps done, writing the report...`
+                : `Stopped: ${data.error || data.status}`;
+        }
+    };
+    window.addEventListener('test-event', listener);
 
-    console.log('Test started');
-    alert('Test started!');
+    // Render the report as it streams; the stream ends when the job finishes
+    const report = card.querySelector('.live-test-report');
+    let pending = null;
+    API.streamReport(job.id, (html) => {
+        pending = html;
+        requestAnimationFrame(() => {
+            if (pending === null) return;
+            report.style.display = 'block';
+            report.srcdoc = pending;
+            pending = null;
+        });
+    })
+        .then(() => API.getTest(job.id))
+        .then((finished) => {
+            const state = finished.result && finished.result.state;
+            if (state === 'pass') {
+                setCardStatus(card, 'passed', 'Passed');
+            } else if (state === 'fail' || finished.status !== 'done') {
+                setCardStatus(card, 'failed', finished.status === 'done' ? 'Failed' : finished.status);
+            }
+            if (finished.error) {
+                card.querySelector('.live-test-detail').textContent = finished.error;
+            }
+        })
+        .catch((error) => console.error('Error following test:', error))
+        .finally(() => {
+            window.removeEventListener('test-event', listener);
+            events.close();
+        });
+}
+
+export async function runTest(e) {
+    e.preventDefault();
+    const scenario = document.getElementById('new-test-form-scenario').value;
+    const name = document.getElementById('new-test-form-test-name').value;
+    const url = document.getElementById('new-test-form-url').value;
+
+    let job;
+    try {
+        job = await API.startTest({ scenario, name, url });
+    } catch (error) {
+        alert('Could not start the test, is the backend running?');
+        return;
+    }
+    if (!job.id) {
+        alert(job.error || 'Could not start the test');
+        return;
+    }
+
+    switchTab('dashboard');
+    followTestRun(job, createLiveTestCard(job, name || scenario));
 
     // console.log({
     //     name: document.getElementById('name').value,
@@ -1,8 +1,16 @@
+import argparse
+import email.utils
+import gzip
+import hashlib
 import http.server
-import socketserver
+import io
 import os
+import random
+import socketserver
 import sys
 import threading
+import time
+from collections import OrderedDict
 
 # Configuration
 DASHBOARD_PORT = 8001
@@ -10,10 +18,83 @@ DASHBOARD_DIR = "frontend"
 
 BUGGY_UI_PORT = 8002
 BUGGY_UI_DIR = "."  # mokeBuggyUI.html is in the project root
-
-
-def make_handler(directory, default_file=None):
+# Only these files are served from it; everything else in the repo root is a 404
+BUGGY_UI_FILES = ("mokeBuggyUI.html", "derivBackground.png")
+
+# Artificial delay added to every buggy UI response, to test the UI under a slow network
+BUGGY_UI_LATENCY_MS = float(os.getenv("BUGGY_UI_LATENCY_MS", "0"))
+BUGGY_UI_JITTER_MS = float(os.getenv("BUGGY_UI_JITTER_MS", "0"))
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+GZIP_MIN_SIZE = 512
+# In-memory static file cache: total size (LRU-evicted) and the largest file kept in it
+FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+FILE_CACHE_MAX_FILE_BYTES = int(os.getenv("FILE_CACHE_MAX_FILE_BYTES", str(4 * 1024 * 1024)))
+
+
+class CachedFile:
+    """A static file held in memory with its validators and an optional gzip copy."""
+
+    def __init__(self, path, stat, content_type):
+        with open(path, "rb") as f:
+            self.body = f.read()
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.content_type = content_type
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.gzipped = None
+        if len(self.body) >= GZIP_MIN_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            self.gzipped = gzip.compress(self.body, compresslevel=6)
+
+    @property
+    def cost(self):
+        return len(self.body) + len(self.gzipped or b"")
+
+
+class FileCache:
+    """Thread-safe in-memory LRU cache of static files, refreshed when a file's mtime or size changes.
+
+    Files larger than `max_file_bytes` are not cached (get() returns None and
+    they are served from disk); the least recently used files are evicted
+    once the cache holds more than `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=FILE_CACHE_MAX_BYTES, max_file_bytes=FILE_CACHE_MAX_FILE_BYTES):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._files = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path, content_type):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size > self.max_file_bytes:
+            return None
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is None or cached.mtime != stat.st_mtime or cached.size != stat.st_size:
+                if cached is not None:
+                    self._bytes -= self._files.pop(path).cost
+                cached = CachedFile(path, stat, content_type)
+                self._files[path] = cached
+                self._bytes += cached.cost
+                while self._bytes > self.max_bytes and len(self._files) > 1:
+                    _, evicted = self._files.popitem(last=False)
+                    self._bytes -= evicted.cost
+            else:
+                self._files.move_to_end(path)
+            return cached
+
+
+def make_handler(directory, default_file=None, cache=None, latency_ms=0.0, jitter_ms=0.0, allowed_files=None):
     class Handler(http.server.SimpleHTTPRequestHandler):
+        # HTTP/1.1 keeps connections alive between requests; every response sets Content-Length
+        protocol_version = "HTTP/1.1"
+
         def __init__(self, *args, **kwargs):
             super().__init__(*args, directory=directory, **kwargs)
 
@@ -22,6 +103,52 @@ def make_handler(directory, default_file=None):
                 self.path = '/' + default_file
             super().do_GET()
 
+        def do_HEAD(self):
+            if default_file and self.path == '/':
+                self.path = '/' + default_file
+            super().do_HEAD()
+
+        def send_head(self):
+            if latency_ms or jitter_ms:
+                time.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+            if allowed_files is not None and os.path.relpath(self.translate_path(self.path), directory) not in allowed_files:
+                self.send_error(404, "File not found")
+                return None
+            if cache is None:
+                return super().send_head()
+
+            path = self.translate_path(self.path)
+            if os.path.isdir(path) or path.endswith('/'):
+                return super().send_head()
+            cached = cache.get(path, self.guess_type(path))
+            if cached is None:
+                return super().send_head()
+
+            use_gzip = cached.gzipped is not None and 'gzip' in self.headers.get('Accept-Encoding', '')
+            etag = cached.etag[:-1] + '-gzip"' if use_gzip else cached.etag
+            if etag in self.headers.get('If-None-Match', ''):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+
+            body = cached.gzipped if use_gzip else cached.body
+            self.send_response(200)
+            self.send_header('Content-Type', cached.content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Last-Modified', cached.last_modified)
+            self.send_header('ETag', etag)
+            # Clients may keep a copy but must revalidate, so edits show up on the next load
+            self.send_header('Cache-Control', 'no-cache')
+            if cached.gzipped is not None:
+                self.send_header('Vary', 'Accept-Encoding')
+            if use_gzip:
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            return io.BytesIO(body)
+
         def end_headers(self):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
@@ -38,14 +165,37 @@ def make_handler(directory, default_file=None):
     return Handler
 
 
-def start_server(port, directory, label, default_file=None):
-    handler = make_handler(directory, default_file)
-    with socketserver.TCPServer(("", port), handler) as httpd:
-        print(f"  {label}: http://localhost:{port}  (serving {directory}/)")
+class ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(port, directory, label, default_file=None, threaded=True, use_cache=True, latency_ms=0.0, jitter_ms=0.0,
+                 allowed_files=None):
+    handler = make_handler(directory, default_file, FileCache() if use_cache else None, latency_ms, jitter_ms, allowed_files)
+    server_class = ThreadingServer if threaded else socketserver.TCPServer
+    with server_class(("", port), handler) as httpd:
+        extras = []
+        if latency_ms or jitter_ms:
+            extras.append(f"+{latency_ms:g}±{jitter_ms:g}ms latency")
+        if not threaded:
+            extras.append("single-threaded")
+        if not use_cache:
+            extras.append("no cache")
+        suffix = f"  [{', '.join(extras)}]" if extras else ""
+        print(f"  {label}: http://localhost:{port}  (serving {directory}/){suffix}")
         httpd.serve_forever()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard and the buggy UI test target")
+    parser.add_argument("--latency", type=float, default=BUGGY_UI_LATENCY_MS, help="Milliseconds of delay added to every buggy UI response")
+    parser.add_argument("--jitter", type=float, default=BUGGY_UI_JITTER_MS, help="Random ± milliseconds added to --latency")
+    parser.add_argument("--single-threaded", action="store_true", help="Handle one connection at a time (the old behaviour)")
+    parser.add_argument("--no-cache", action="store_true", help="Read files from disk on every request, without ETag or gzip")
+    args = parser.parse_args()
+    options = {"threaded": not args.single_threaded, "use_cache": not args.no_cache}
+
     # Validate directories/files
     if not os.path.exists(DASHBOARD_DIR):
         print(f"Error: '{DASHBOARD_DIR}' directory not found!")
@@ -63,12 +213,13 @@ def main():
         buggy_thread = threading.Thread(
             target=start_server,
             args=(BUGGY_UI_PORT, BUGGY_UI_DIR, "Buggy UI", "mokeBuggyUI.html"),
+            kwargs={**options, "latency_ms": args.latency, "jitter_ms": args.jitter, "allowed_files": BUGGY_UI_FILES},
             daemon=True,
         )
         buggy_thread.start()
 
         # Start dashboard server on the main thread
-        start_server(DASHBOARD_PORT, DASHBOARD_DIR, "Dashboard")
+        start_server(DASHBOARD_PORT, DASHBOARD_DIR, "Dashboard", **options)
 
     except KeyboardInterrupt:
         print("\n\nServers stopped.")
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from backend.browser_pool import BrowserPool, PooledBrowser
+
+
+class FlakyPool(BrowserPool):
+	"""A pool whose launches fail while `failures` is positive and otherwise return a fake browser."""
+
+	def __init__(self, failures, **kwargs):
+		super().__init__(**kwargs)
+		self.failures = failures
+		self.launched = 0
+
+	async def _launch(self, key, profile_kwargs):
+		await asyncio.sleep(0)
+		if self.failures > 0:
+			self.failures -= 1
+			raise RuntimeError("browser failed to start")
+		self.launched += 1
+		return PooledBrowser(key, session=None)
+
+	async def _is_healthy(self, pooled):
+		return True
+
+	async def _reset(self, pooled, visited_urls):
+		pass
+
+	async def _close(self, pooled):
+		pass
+
+
+def test_failed_launch_frees_the_slot():
+	async def scenario():
+		pool = FlakyPool(failures=1, max_size=1)
+		with pytest.raises(RuntimeError):
+			await pool.acquire("mobile", {})
+		assert pool._in_use == 0 and pool.size == 0
+		# With max_size=1 this would wait forever if the failed launch had kept its slot
+		pooled = await asyncio.wait_for(pool.acquire("mobile", {}), timeout=1)
+		assert pool._in_use == 1
+		await pool.release(pooled)
+		assert pool._in_use == 0 and pool.stats()["idle"] == {"mobile": 1}
+
+	asyncio.run(scenario())
+
+
+def test_failed_warm_up_releases_its_reservations():
+	async def scenario():
+		pool = FlakyPool(failures=1, max_size=4)
+		with pytest.raises(RuntimeError):
+			await pool.warm("mobile", {}, count=3)
+		assert pool._warming == 0 and pool.size == 0
+
+		# The second of three launches fails: the first browser stays idle, the rest is released
+		pool.failures = 0
+		original = pool._launch
+
+		async def fail_second(key, profile_kwargs):
+			if pool.launched == 1:
+				raise RuntimeError("browser failed to start")
+			return await original(key, profile_kwargs)
+
+		pool._launch = fail_second
+		with pytest.raises(RuntimeError):
+			await pool.warm("mobile", {}, count=3)
+		assert pool._warming == 0
+		assert pool.size == 1 and pool.stats()["idle"] == {"mobile": 1}
+
+	asyncio.run(scenario())
+
+
+def test_waiting_acquire_is_woken_by_a_failed_launch():
+	async def scenario():
+		pool = FlakyPool(failures=0, max_size=1)
+		held = await pool.acquire("mobile", {})
+		pool.failures = 1
+		waiter = asyncio.create_task(pool.acquire("mobile", {}))
+		await asyncio.sleep(0)
+		await pool.release(held, discard=True)
+		with pytest.raises(RuntimeError):
+			await asyncio.wait_for(waiter, timeout=1)
+		assert pool._in_use == 0 and pool.size == 0
+
+	asyncio.run(scenario())
@@ -0,0 +1,50 @@
+from backend.failure_clusters import FAILURE_SIMILARITY, fingerprint, minhash, normalize, similarity
+
+
+def failed_run(error, url="http://localhost:8001/checkout", action=None, final_result=None):
+	return {
+		"error": None,
+		"final_result": final_result,
+		"steps": [
+			{"url": "http://localhost:8001/cart", "title": "Cart", "action": [{"click": {"index": 2}}], "success": 1, "error": None},
+			{"url": url, "title": "Checkout", "action": action or [{"click": {"index": 7}}], "success": 0, "error": error},
+		],
+	}
+
+
+def test_normalize_masks_volatile_values():
+	assert normalize("Order 1234 FAILED  in 2.5s") == "order <n> failed in <n>s"
+	assert normalize("request 3f2a9c1e-0b4d-4e5f-8a7b-9c0d1e2f3a4b") == "request <uuid>"
+	assert normalize("session 5f3e2d1c0b9a") == "session <hex>"
+
+
+def test_same_failure_with_other_ids_has_the_same_fingerprint():
+	first = fingerprint(failed_run("Payment 8812 declined: card ending 4242 (request 3f2a9c1e-0b4d-4e5f-8a7b-9c0d1e2f3a4b)"))
+	second = fingerprint(failed_run("Payment 9907 declined: card ending 1111 (request 0a1b2c3d-4e5f-4a7b-8c9d-0e1f2a3b4c5d)"))
+	assert first == second
+	assert similarity(minhash(first), minhash(second)) == 1.0
+
+
+def test_similar_failures_match_and_different_ones_do_not():
+	base = minhash(fingerprint(failed_run("Element with index 7 is not clickable: the Pay button is covered by the cookie banner")))
+	similar = minhash(fingerprint(failed_run("Element with index 7 is not clickable: the Pay button is covered by the newsletter banner")))
+	different = minhash(fingerprint(failed_run(
+		"Navigation failed: net::ERR_CONNECTION_REFUSED",
+		url="http://localhost:8001/signup",
+		action=[{"input": {"index": 1, "text": "a@b.c"}}],
+	)))
+	assert similarity(base, similar) >= FAILURE_SIMILARITY
+	assert similarity(base, different) < FAILURE_SIMILARITY
+
+
+def test_final_result_is_used_when_nothing_raised():
+	run = failed_run(None, final_result="The discount code was accepted but the total did not change")
+	assert any(feature.startswith("result:") for feature in fingerprint(run))
+	assert not any(feature.startswith("result:") for feature in fingerprint(failed_run("Timeout", final_result="Gave up")))
+
+
+def test_similarity_of_empty_or_mismatched_signatures_is_zero():
+	signature = minhash({"error:boom"})
+	assert similarity([], []) == 0.0
+	assert similarity(signature, signature[:10]) == 0.0
+	assert minhash(set()) == []
@@ -0,0 +1,83 @@
+from backend.report_cache import ReportCache, normalize_run
+
+PROMPTS = ["You are a Senior QA Engineer.", "login"]
+
+
+def make_run(**overrides):
+	run = {
+		"id": "login_mobile_20260101_120000_000001",
+		"task": "login",
+		"device": "mobile",
+		"is_done": 1,
+		"is_successful": 0,
+		"error": None,
+		"final_result": "The login button did nothing",
+		"duration_seconds": 42.5,
+		"output_dir": "results/login_mobile_20260101_120000_000001",
+		"perf": {"lcp_ms": 900},
+		"steps": [
+			{
+				"url": "http://localhost:8001/login", "title": "Login",
+				"action": [{"click": {"index": 3}}], "error": None,
+				"next_goal": "Submit the form", "duration_seconds": 3.2, "perf": {"lcp_ms": 800},
+				"screenshot": "results/login_mobile_20260101_120000_000001/screenshots/step_0.png",
+			},
+			{
+				"url": "http://localhost:8001/login", "title": "Login",
+				"action": [{"click": {"index": 3}}], "error": "Timed out after 2.5s at 2026-01-01T12:00:05Z",
+				"next_goal": "Try again", "duration_seconds": 2.5, "perf": None,
+				"screenshot": "results/login_mobile_20260101_120000_000001/screenshots/step_1.png",
+			},
+		],
+	}
+	run.update(overrides)
+	return run
+
+
+def rerun(run):
+	"""The same run again, a day later: other ids, paths, timings, perf and narration."""
+	other = make_run(
+		id="login_mobile_20260102_090000_000002",
+		duration_seconds=57.1,
+		output_dir="results/login_mobile_20260102_090000_000002",
+		perf={"lcp_ms": 1400},
+	)
+	other["steps"] = [
+		dict(
+			step,
+			next_goal="Click submit",
+			duration_seconds=step["duration_seconds"] * 2,
+			perf={"lcp_ms": 1200},
+			screenshot=step["screenshot"].replace("20260101_120000_000001", "20260102_090000_000002"),
+			error=step["error"] and "Timed out after 3.75s at 2026-01-02T09:00:07Z",
+		)
+		for step in run["steps"]
+	]
+	return other
+
+
+def test_rerun_of_the_same_failure_has_the_same_key(tmp_path):
+	cache = ReportCache(directory=str(tmp_path))
+	run = make_run()
+	assert normalize_run(run) == normalize_run(rerun(run))
+	assert cache.key("model", PROMPTS, run) == cache.key("model", PROMPTS, rerun(run))
+
+
+def test_what_happened_changes_the_key(tmp_path):
+	cache = ReportCache(directory=str(tmp_path))
+	run = make_run()
+	key = cache.key("model", PROMPTS, run)
+	changed_step = make_run()
+	changed_step["steps"][0] = dict(changed_step["steps"][0], action=[{"click": {"index": 4}}])
+	assert cache.key("model", PROMPTS, changed_step) != key
+	assert cache.key("model", PROMPTS, make_run(final_result="The page crashed")) != key
+	assert cache.key("model", PROMPTS, make_run(is_successful=1)) != key
+	assert cache.key("model", PROMPTS, make_run(device="desktop")) != key
+
+
+def test_model_and_prompts_change_the_key(tmp_path):
+	cache = ReportCache(directory=str(tmp_path))
+	run = make_run()
+	key = cache.key("model", PROMPTS, run)
+	assert cache.key("other-model", PROMPTS, run) != key
+	assert cache.key("model", [*PROMPTS[:-1], "signup"], run) != key
@@ -0,0 +1,60 @@
+import sqlite3
+
+from backend.run_store import COLUMN_MIGRATIONS, SCHEMA, RunStore
+
+
+def create_baseline_database(path):
+	"""A database written before any COLUMN_MIGRATIONS, holding one finished run."""
+	conn = sqlite3.connect(path)
+	conn.executescript(SCHEMA)
+	conn.execute(
+		"INSERT INTO runs (id, task, device, status, started_at, output_dir, is_successful, final_result) "
+		"VALUES ('old_run', 'login', 'mobile', 'done', '2026-01-01T12:00:00', 'results/old_run', 1, 'Logged in')"
+	)
+	conn.execute(
+		"INSERT INTO steps (run_id, step_index, url, action, success) "
+		"VALUES ('old_run', 0, 'http://localhost:8001/login', '[{\"click\": {\"index\": 3}}]', 1)"
+	)
+	conn.commit()
+	conn.close()
+
+
+def columns(path, table):
+	conn = sqlite3.connect(path)
+	try:
+		return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+	finally:
+		conn.close()
+
+
+def test_baseline_database_is_migrated(tmp_path):
+	path = str(tmp_path / "runs.db")
+	create_baseline_database(path)
+	store = RunStore(path)
+	try:
+		run = store.get_run("old_run")
+		assert run["final_result"] == "Logged in"
+		assert run["report_state"] is None and run["owner_pid"] is None and run["perf"] is None
+		assert run["steps"][0]["action"] == [{"click": {"index": 3}}]
+
+		store.set_report_state("old_run", "pass")
+		assert store.get_run("old_run")["report_state"] == "pass"
+	finally:
+		store.close()
+	for table, column, _ in COLUMN_MIGRATIONS:
+		assert column in columns(path, table)
+
+
+def test_migrated_database_opens_again(tmp_path):
+	path = str(tmp_path / "runs.db")
+	create_baseline_database(path)
+	store = RunStore(path)
+	store.start_run("new_run", "signup", "desktop", "results/new_run")
+	store.close()
+
+	store = RunStore(path)
+	try:
+		assert {run["id"] for run in store.list_runs()["items"]} == {"old_run", "new_run"}
+		assert store.get_run("new_run")["owner_pid"] is not None
+	finally:
+		store.close()
@@ -0,0 +1,49 @@
+import time
+
+from backend import watchdog as watchdog_module
+from backend.watchdog import BROWSER_PROFILE_MARKER, ResourceWatchdog
+
+
+class FakeProcess:
+	def __init__(self, pid, ppid, browser=True):
+		self.pid = pid
+		cmdline = ["chrome", f"--user-data-dir=/tmp/{BROWSER_PROFILE_MARKER}{pid}"] if browser else ["python"]
+		self.info = {"pid": pid, "ppid": ppid, "cmdline": cmdline, "create_time": time.time() - 3600}
+
+
+class FakePool:
+	def __init__(self, pids):
+		self._pids = set(pids)
+
+	def pids(self):
+		return self._pids
+
+
+def find_leaked(monkeypatch, me, procs, owned, live=()):
+	monkeypatch.setattr(watchdog_module.os, "getpid", lambda: me)
+	monkeypatch.setattr(watchdog_module.psutil, "process_iter", lambda attrs: procs)
+	monkeypatch.setattr(watchdog_module.psutil, "pid_exists", lambda pid: pid in live)
+	leaked = ResourceWatchdog(pool=FakePool(owned), grace=0).find_leaked()
+	return sorted((proc.pid, reason) for proc, reason in leaked)
+
+
+def test_owned_browsers_of_a_pid_1_worker_are_not_reaped(monkeypatch):
+	procs = [FakeProcess(10, 1), FakeProcess(11, 1), FakeProcess(12, 1, browser=False)]
+	assert find_leaked(monkeypatch, me=1, procs=procs, owned={10, 11}) == []
+
+
+def test_pid_1_worker_reaps_untracked_and_reparented_browsers(monkeypatch):
+	# 11 was launched by us and lost by the pool, 12 was reparented to us after its parent died
+	procs = [FakeProcess(10, 1), FakeProcess(11, 1), FakeProcess(12, 1)]
+	assert find_leaked(monkeypatch, me=1, procs=procs, owned={10}) == [(11, "untracked"), (12, "untracked")]
+
+
+def test_untracked_children_are_kept_while_a_pooled_pid_is_unknown(monkeypatch):
+	procs = [FakeProcess(10, 1), FakeProcess(11, 1)]
+	assert find_leaked(monkeypatch, me=1, procs=procs, owned={10, None}) == []
+
+
+def test_orphans_of_other_workers_are_reaped(monkeypatch):
+	procs = [FakeProcess(10, 500), FakeProcess(20, 1), FakeProcess(21, 600), FakeProcess(22, 700)]
+	owned = {10}
+	assert find_leaked(monkeypatch, me=500, procs=procs, owned=owned, live={500, 700}) == [(20, "orphaned"), (21, "orphaned")]